@@ -0,0 +1,797 @@
+#!/usr/bin/env python3
+"""Audio relay between PulseAudio and the browser, replacing socat + pacat/parec + websockify.
+
+Speaker (6082): one long-lived capture of VNC_Speaker.monitor, fanned out to every
+connected WebSocket. Mic (6081): PCM from the browser played into the VNC_Mic sink.
+Both carry raw s16le mono 44.1 kHz, the format the UI already sends and expects.
+Speaker clients that ask for ?codec=opus get Opus packets instead (see OPUS_*).
+Also routes new application streams to VNC_Speaker as PulseAudio reports them.
+"""
+import argparse
+import asyncio
+import ctypes
+import ctypes.util
+import fnmatch
+import http
+import json
+import logging
+import math
+import os
+import re
+import statistics
+import struct
+import subprocess
+import threading
+import time
+import urllib.parse
+from collections import deque
+
+import websockets
+
+# Stream format, as spoken by useAudio.ts
+RATE = 44100
+CHANNELS = 1
+SAMPLE_BYTES = 2
+FRAME_MS = 20                # Capture period; one WebSocket message per frame
+SPEAKER_PORT = 6082
+MIC_PORT = 6081
+SPEAKER_DEVICE = 'VNC_Speaker.monitor'
+MIC_DEVICE = 'VNC_Mic'
+MIC_LATENCY_MS = 60          # PulseAudio playback buffer for the mic stream
+MIC_MAX_MS = 200             # Mic audio queued beyond this is dropped, oldest first
+REOPEN_DELAY = 1.0           # Seconds before reopening a failed PulseAudio stream
+
+# Per-listener jitter buffer. A listener's target is how much audio it should hold
+# before playing: two frames plus four times the measured jitter, kept within
+# [JITTER_MIN, JITTER_MAX] ms. Jitter is the RFC 3550 estimator, run over ping RTTs
+# (the network) and over how long frames wait here for the socket (send stalls).
+# Targets are announced to the client as {"type": "latency", "target": ms}; audio
+# queued here beyond target + JITTER_SLACK is dropped oldest-first, so a stalled
+# link catches up instead of drifting further and further behind.
+JITTER_MIN = 40
+JITTER_MAX = 500
+JITTER_SLACK = 100
+TARGET_STEP = 10             # ms the target must move before it is announced again
+PING_INTERVAL = 1.0
+PING_TIMEOUT = 10
+STATS_INTERVAL = 60          # Seconds between stats log lines while clients are connected
+
+# Synthetic source (--source tone) for tests and benchmarks: a 440 Hz burst at the
+# start of every TONE_PERIOD of the wall clock, silence in between, so a receiver on
+# the same host can tell how long ago each burst left the source.
+TONE_PERIOD = 0.5
+TONE_BURST = 0.05
+TONE_HZ = 440
+
+# Opus speaker mode: ws://host:6082/?codec=opus&bitrate=32000&frame=20. The first
+# message on every speaker connection is {"type": "format", ...} naming what follows,
+# and a client that asked for Opus where libopus isn't installed gets PCM. Opus runs at
+# 48 kHz, so Opus listeners are fed from a second capture at OPUS_RATE (PulseAudio
+# resamples), opened with the first Opus listener and closed after the last. Each
+# (bitrate, frame) pair has one encoder whose packets go to all listeners that chose it.
+OPUS_RATE = 48000
+OPUS_BITRATE = 32000         # 32 kbit/s vs 705.6 kbit/s of PCM
+OPUS_BITRATE_MIN = 6000
+OPUS_BITRATE_MAX = 256000
+OPUS_FRAMES_MS = (10, 20, 40, 60)
+OPUS_MAX_PACKET = 4000       # Bytes; the size libopus recommends for one packet
+OPUS_APPLICATION_AUDIO = 2049
+OPUS_SET_BITRATE_REQUEST = 4002
+
+# Sink-input routing: `pactl subscribe` reports every new stream, which is then moved
+# by the first --route PATTERN=SINK whose glob matches its application.name or
+# application.process.binary (case-insensitive), or to ROUTE_DEFAULT_SINK. An empty
+# SINK leaves matching streams where they are; the relay's own streams always are.
+ROUTE_DEFAULT_SINK = 'VNC_Speaker'
+ROUTE_KEEP = [('VestaVNC', '')]
+ROUTE_PROPERTIES = ('application.name', 'application.process.binary')
+ROUTE_SAMPLES = 200          # Recent routing latencies kept for the stats percentiles
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+
+# --- Sources and sinks ---
+
+class PaSampleSpec(ctypes.Structure):
+    _fields_ = [('format', ctypes.c_int), ('rate', ctypes.c_uint32), ('channels', ctypes.c_uint8)]
+
+class PaBufferAttr(ctypes.Structure):
+    _fields_ = [(name, ctypes.c_uint32) for name in ('maxlength', 'tlength', 'prebuf', 'minreq', 'fragsize')]
+
+PA_SAMPLE_S16LE = 3
+PA_STREAM_PLAYBACK = 1
+PA_STREAM_RECORD = 2
+PA_DEFAULT = 0xFFFFFFFF      # (uint32_t) -1: let the server choose
+
+def load_pulse_simple():
+    name = ctypes.util.find_library('pulse-simple')
+    if not name:
+        return None
+    lib = ctypes.CDLL(name)
+    lib.pa_simple_new.restype = ctypes.c_void_p
+    lib.pa_simple_new.argtypes = [ctypes.c_char_p, ctypes.c_char_p, ctypes.c_int, ctypes.c_char_p, ctypes.c_char_p,
+                                  ctypes.POINTER(PaSampleSpec), ctypes.c_void_p, ctypes.POINTER(PaBufferAttr),
+                                  ctypes.POINTER(ctypes.c_int)]
+    lib.pa_simple_read.argtypes = [ctypes.c_void_p, ctypes.c_void_p, ctypes.c_size_t, ctypes.POINTER(ctypes.c_int)]
+    lib.pa_simple_write.argtypes = [ctypes.c_void_p, ctypes.c_void_p, ctypes.c_size_t, ctypes.POINTER(ctypes.c_int)]
+    lib.pa_simple_free.argtypes = [ctypes.c_void_p]
+    pulse = ctypes.CDLL(ctypes.util.find_library('pulse'))
+    pulse.pa_strerror.restype = ctypes.c_char_p
+    lib.strerror = lambda code: pulse.pa_strerror(code).decode()
+    return lib
+
+class PulseStream:
+    """Blocking libpulse-simple stream, talking to the PulseAudio server in-process.
+    ctypes drops the GIL around the blocking read/write calls."""
+
+    lib = None
+
+    def __init__(self, direction, device, latency_ms, rate=RATE):
+        lib = PulseStream.lib
+        spec = PaSampleSpec(PA_SAMPLE_S16LE, rate, CHANNELS)
+        size = frame_bytes(latency_ms, rate)
+        if direction == PA_STREAM_RECORD:
+            attr = PaBufferAttr(PA_DEFAULT, PA_DEFAULT, PA_DEFAULT, PA_DEFAULT, size)
+        else:
+            attr = PaBufferAttr(PA_DEFAULT, size, PA_DEFAULT, PA_DEFAULT, PA_DEFAULT)
+        err = ctypes.c_int()
+        self.handle = lib.pa_simple_new(None, b'VestaVNC', direction, device.encode(), b'audio-relay',
+                                        ctypes.byref(spec), None, ctypes.byref(attr), ctypes.byref(err))
+        if not self.handle:
+            raise OSError(f"pa_simple_new({device}): {lib.strerror(err.value)}")
+        self.buf = ctypes.create_string_buffer(frame_bytes(FRAME_MS, rate))
+
+    def read(self, n):
+        if len(self.buf) < n:
+            self.buf = ctypes.create_string_buffer(n)
+        err = ctypes.c_int()
+        if PulseStream.lib.pa_simple_read(self.handle, self.buf, n, ctypes.byref(err)) < 0:
+            raise OSError(f"pa_simple_read: {PulseStream.lib.strerror(err.value)}")
+        return self.buf.raw[:n]
+
+    def write(self, data):
+        err = ctypes.c_int()
+        if PulseStream.lib.pa_simple_write(self.handle, data, len(data), ctypes.byref(err)) < 0:
+            raise OSError(f"pa_simple_write: {PulseStream.lib.strerror(err.value)}")
+
+    def close(self):
+        if self.handle:
+            PulseStream.lib.pa_simple_free(self.handle)
+            self.handle = None
+
+class PipeStream:
+    """Fallback when libpulse-simple isn't installed: one long-lived parec/pacat process
+    (not one per connection as with socat's fork)."""
+
+    def __init__(self, direction, device, latency_ms, rate=RATE):
+        tool = 'parec' if direction == PA_STREAM_RECORD else 'pacat'
+        self.proc = subprocess.Popen(
+            [tool, f'--device={device}', '--client-name=VestaVNC', '--format=s16le', f'--rate={rate}', f'--channels={CHANNELS}',
+             f'--latency-msec={latency_ms}', '--raw'],
+            stdin=subprocess.PIPE if direction == PA_STREAM_PLAYBACK else None,
+            stdout=subprocess.PIPE if direction == PA_STREAM_RECORD else None)
+
+    def read(self, n):
+        data = self.proc.stdout.read(n)
+        if len(data) < n:
+            raise OSError(f"parec exited ({self.proc.poll()})")
+        return data
+
+    def write(self, data):
+        self.proc.stdin.write(data)
+        self.proc.stdin.flush()
+
+    def close(self):
+        self.proc.kill()
+        self.proc.wait()
+
+class ToneStream:
+    """--source tone: TONE_HZ bursts on the TONE_PERIOD grid of time.time(), paced in
+    real time like a capture device. As a sink it discards what it is given."""
+
+    def __init__(self, direction=None, device=None, latency_ms=None, rate=RATE):
+        self.rate = rate
+        self.clock = None
+
+    def read(self, n):
+        samples = n // SAMPLE_BYTES
+        if self.clock is None:
+            # Frames line up with the bursts, so latency doesn't depend on start-up phase
+            self.clock = math.ceil(time.time() / TONE_PERIOD) * TONE_PERIOD
+        start = self.clock
+        self.clock += samples / self.rate
+        # A frame is ready once its last sample has been "recorded"
+        delay = self.clock - time.time()
+        if delay > 0:
+            time.sleep(delay)
+        return tone_frame(start, samples, self.rate)
+
+    def write(self, data):
+        pass
+
+    def close(self):
+        pass
+
+TONE_BURSTS = {}             # rate -> one burst of s16le samples
+
+def tone_frame(start, samples, rate=RATE):
+    if rate not in TONE_BURSTS:
+        TONE_BURSTS[rate] = b''.join(struct.pack('<h', int(12000 * math.sin(2 * math.pi * TONE_HZ * i / rate)))
+                                     for i in range(int(TONE_BURST * rate)))
+    out = bytearray(samples * SAMPLE_BYTES)
+    first = math.floor(start / TONE_PERIOD)
+    for k in (first, first + 1):
+        burst = k * TONE_PERIOD
+        i0 = max(0, math.ceil((burst - start) * rate))
+        i1 = min(samples, math.ceil((burst + TONE_BURST - start) * rate))
+        if i0 < i1:
+            j0 = round((start + i0 / rate - burst) * rate)
+            chunk = TONE_BURSTS[rate][j0 * SAMPLE_BYTES:(j0 + i1 - i0) * SAMPLE_BYTES]
+            out[i0 * SAMPLE_BYTES:i0 * SAMPLE_BYTES + len(chunk)] = chunk
+    return bytes(out)
+
+def frame_bytes(ms, rate=RATE):
+    return int(rate * ms / 1000) * SAMPLE_BYTES * CHANNELS
+
+def stream_class(source):
+    if source == 'tone':
+        return ToneStream
+    if source == 'pulse':
+        PulseStream.lib = load_pulse_simple()
+        if PulseStream.lib is not None:
+            return PulseStream
+        logger.warning("libpulse-simple not found, falling back to parec/pacat")
+    return PipeStream
+
+
+# --- Opus ---
+
+def load_opus():
+    name = ctypes.util.find_library('opus')
+    if not name:
+        return None
+    lib = ctypes.CDLL(name)
+    lib.opus_encoder_create.restype = ctypes.c_void_p
+    lib.opus_encoder_create.argtypes = [ctypes.c_int32, ctypes.c_int, ctypes.c_int, ctypes.POINTER(ctypes.c_int)]
+    lib.opus_encode.restype = ctypes.c_int32
+    lib.opus_encode.argtypes = [ctypes.c_void_p, ctypes.c_char_p, ctypes.c_int, ctypes.c_char_p, ctypes.c_int32]
+    lib.opus_encoder_destroy.argtypes = [ctypes.c_void_p]
+    lib.opus_strerror.restype = ctypes.c_char_p
+    lib.strerror = lambda code: lib.opus_strerror(code).decode()
+    return lib
+
+class OpusEncoder:
+    """One libopus encoder at OPUS_RATE, cutting the capture's FRAME_MS frames into
+    frame_ms packets for every listener that asked for this bitrate and frame size."""
+
+    lib = None
+
+    def __init__(self, bitrate, frame_ms):
+        lib = OpusEncoder.lib
+        err = ctypes.c_int()
+        self.handle = lib.opus_encoder_create(OPUS_RATE, CHANNELS, OPUS_APPLICATION_AUDIO, ctypes.byref(err))
+        if not self.handle or err.value:
+            raise OSError(f"opus_encoder_create: {lib.strerror(err.value)}")
+        lib.opus_encoder_ctl(ctypes.c_void_p(self.handle), OPUS_SET_BITRATE_REQUEST, ctypes.c_int32(bitrate))
+        self.samples = OPUS_RATE * frame_ms // 1000
+        self.size = frame_bytes(frame_ms, OPUS_RATE)
+        self.pending = b''
+        self.out = ctypes.create_string_buffer(OPUS_MAX_PACKET)
+        self.listeners = set()
+
+    def encode(self, pcm):
+        self.pending += pcm
+        packets = []
+        while len(self.pending) >= self.size:
+            chunk, self.pending = self.pending[:self.size], self.pending[self.size:]
+            n = OpusEncoder.lib.opus_encode(self.handle, chunk, self.samples, self.out, OPUS_MAX_PACKET)
+            if n < 0:
+                raise OSError(f"opus_encode: {OpusEncoder.lib.strerror(n)}")
+            packets.append(self.out.raw[:n])
+        return packets
+
+    def close(self):
+        if self.handle:
+            OpusEncoder.lib.opus_encoder_destroy(self.handle)
+            self.handle = None
+
+def speaker_format(path):
+    """What a speaker client gets, from the query string it connected with."""
+    query = urllib.parse.parse_qs(urllib.parse.urlsplit(path or '').query)
+    fmt = {'type': 'format', 'codec': 'pcm', 'rate': RATE, 'channels': CHANNELS, 'frameMs': FRAME_MS}
+    if query.get('codec', [''])[0] != 'opus' or OpusEncoder.lib is None:
+        return fmt
+    try:
+        bitrate = int(query.get('bitrate', [OPUS_BITRATE])[0])
+        frame_ms = int(query.get('frame', [FRAME_MS])[0])
+    except ValueError:
+        return fmt
+    if frame_ms not in OPUS_FRAMES_MS:
+        frame_ms = FRAME_MS
+    bitrate = min(OPUS_BITRATE_MAX, max(OPUS_BITRATE_MIN, bitrate))
+    return dict(fmt, codec='opus', rate=OPUS_RATE, frameMs=frame_ms, bitrate=bitrate)
+
+
+# --- Speaker: capture once, fan out ---
+
+class JitterEstimate:
+    """RFC 3550 interarrival jitter over a series of delay samples (ms)."""
+
+    def __init__(self):
+        self.value = 0.0
+        self.last = None
+
+    def add(self, delay):
+        if self.last is not None:
+            self.value += (abs(delay - self.last) - self.value) / 16
+        self.last = delay
+
+class Listener:
+    """One speaker WebSocket: its outgoing queue, jitter estimates and counters."""
+
+    def __init__(self, ws, fmt):
+        self.ws = ws
+        self.peer = '%s:%s' % ws.remote_address[:2] if ws.remote_address else '?'
+        self.format = fmt
+        self.frame_ms = fmt['frameMs']
+        self.queue = deque()             # (capture time, frame or Opus packet)
+        self.ready = asyncio.Event()
+        self.network = JitterEstimate()  # Over ping RTTs
+        self.stalls = JitterEstimate()   # Over time frames waited here for the socket
+        self.rtt = None
+        self.target = JITTER_MIN
+        self.announced = None
+        self.sent = self.dropped = self.bytes = 0
+        self.connected = time.time()
+
+    def push(self, captured, frame):
+        self.queue.append((captured, frame))
+        limit = max(2, (self.target + JITTER_SLACK) // self.frame_ms)
+        while len(self.queue) > limit:
+            self.queue.popleft()
+            self.dropped += 1
+        self.ready.set()
+
+    async def send_frames(self):
+        while True:
+            await self.ready.wait()
+            self.ready.clear()
+            while self.queue:
+                captured, frame = self.queue.popleft()
+                await self.ws.send(frame)
+                self.stalls.add((time.monotonic() - captured) * 1000)
+                self.sent += 1
+                self.bytes += len(frame)
+            await self.retarget()
+
+    async def measure(self):
+        while True:
+            await asyncio.sleep(PING_INTERVAL)
+            t0 = time.monotonic()
+            await asyncio.wait_for(await self.ws.ping(), PING_TIMEOUT)
+            self.rtt = (time.monotonic() - t0) * 1000
+            self.network.add(self.rtt)
+            await self.retarget()
+
+    async def retarget(self):
+        jitter = max(self.network.value, self.stalls.value)
+        self.target = int(min(JITTER_MAX, max(JITTER_MIN, 2 * self.frame_ms + 4 * jitter)))
+        if self.announced is None or abs(self.target - self.announced) >= TARGET_STEP:
+            self.announced = self.target
+            await self.ws.send(json.dumps({'type': 'latency', 'target': self.target}))
+
+    def stats(self):
+        return {
+            'peer': self.peer,
+            'codec': self.format['codec'],
+            'bitrate': self.format.get('bitrate'),
+            'seconds': round(time.time() - self.connected),
+            'sent': self.sent,
+            'dropped': self.dropped,
+            'bytes': self.bytes,
+            'queuedMs': len(self.queue) * self.frame_ms,
+            'rttMs': self.rtt and round(self.rtt, 1),
+            'jitterMs': round(self.network.value, 1),
+            'stallJitterMs': round(self.stalls.value, 1),
+            'targetMs': self.target,
+        }
+
+class Capture:
+    """A thread reading FRAME_MS frames of the speaker monitor at one rate and handing
+    them to deliver() on the event loop, reopening the stream after errors."""
+
+    def __init__(self, stream_cls, device, rate, deliver):
+        self.stream_cls = stream_cls
+        self.device = device
+        self.rate = rate
+        self.deliver = deliver
+        self.running = True
+        self.errors = 0
+
+    def start(self, loop):
+        threading.Thread(target=self.run, args=(loop,), daemon=True).start()
+
+    def stop(self):
+        # The thread notices after its current read
+        self.running = False
+
+    def forward(self, captured, frame):
+        # On the loop, so a frame read just before stop() isn't delivered
+        if self.running:
+            self.deliver(captured, frame)
+
+    def run(self, loop):
+        size = frame_bytes(FRAME_MS, self.rate)
+        while self.running:
+            try:
+                stream = self.stream_cls(PA_STREAM_RECORD, self.device, FRAME_MS, self.rate)
+            except OSError as e:
+                self.errors += 1
+                logger.warning(f"Speaker capture unavailable: {e}")
+                time.sleep(REOPEN_DELAY)
+                continue
+            logger.info(f"Capturing {self.device} at {self.rate} Hz ({self.stream_cls.__name__})")
+            try:
+                while self.running:
+                    frame = stream.read(size)
+                    loop.call_soon_threadsafe(self.forward, time.monotonic(), frame)
+            except OSError as e:
+                self.errors += 1
+                logger.warning(f"Speaker capture failed: {e}")
+            finally:
+                stream.close()
+            if self.running:
+                time.sleep(REOPEN_DELAY)
+        logger.info(f"Stopped capturing {self.device} at {self.rate} Hz")
+
+class Speaker:
+    """PCM listeners all get the same captured frames; Opus listeners share one encoder
+    per (bitrate, frame size), fed by an OPUS_RATE capture that runs while any exist."""
+
+    def __init__(self, stream_cls, device):
+        self.stream_cls = stream_cls
+        self.device = device
+        self.listeners = set()
+        self.pcm = Capture(stream_cls, device, RATE, self.broadcast)
+        self.opus = None
+        self.encoders = {}               # (bitrate, frame_ms) -> OpusEncoder
+        self.frames = 0
+        self.packets = 0
+        self.errors = 0                  # Of captures already stopped
+
+    def start(self, loop):
+        self.loop = loop
+        self.pcm.start(loop)
+
+    def broadcast(self, captured, frame):
+        self.frames += 1
+        for listener in self.listeners:
+            if listener.format['codec'] == 'pcm':
+                listener.push(captured, frame)
+
+    def broadcast_opus(self, captured, frame):
+        for key, encoder in list(self.encoders.items()):
+            try:
+                packets = encoder.encode(frame)
+            except OSError as e:
+                logger.warning(f"Opus encoder {key}: {e}")
+                continue
+            for packet in packets:
+                self.packets += 1
+                for listener in encoder.listeners:
+                    listener.push(captured, packet)
+
+    def join(self, listener):
+        fmt = listener.format
+        if fmt['codec'] == 'opus':
+            key = (fmt['bitrate'], fmt['frameMs'])
+            if key not in self.encoders:
+                self.encoders[key] = OpusEncoder(*key)
+            self.encoders[key].listeners.add(listener)
+        self.listeners.add(listener)
+        if self.encoders and self.opus is None:
+            self.opus = Capture(self.stream_cls, self.device, OPUS_RATE, self.broadcast_opus)
+            self.opus.start(self.loop)
+
+    def leave(self, listener):
+        self.listeners.discard(listener)
+        fmt = listener.format
+        if fmt['codec'] != 'opus':
+            return
+        key = (fmt['bitrate'], fmt['frameMs'])
+        encoder = self.encoders.get(key)
+        if encoder is not None:
+            encoder.listeners.discard(listener)
+            if not encoder.listeners:
+                encoder.close()
+                del self.encoders[key]
+        if not self.encoders and self.opus is not None:
+            self.opus.stop()
+            self.errors += self.opus.errors
+            self.opus = None
+
+    def capture_errors(self):
+        return self.errors + self.pcm.errors + (self.opus.errors if self.opus else 0)
+
+    async def handler(self, ws, path=None):
+        listener = Listener(ws, speaker_format(ws.path))
+        try:
+            self.join(listener)
+        except OSError as e:
+            logger.warning(f"Opus unavailable for {listener.peer}, sending PCM: {e}")
+            listener = Listener(ws, speaker_format(None))
+            self.join(listener)
+        logger.info(f"Speaker listener {listener.peer} connected ({listener.format['codec']}, "
+                    f"{len(self.listeners)} total)")
+        tasks = []
+        try:
+            await ws.send(json.dumps(listener.format))
+            tasks = [asyncio.ensure_future(listener.send_frames()), asyncio.ensure_future(listener.measure()),
+                     asyncio.ensure_future(ws.wait_closed())]
+            done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if not task.cancelled() and task.exception() and \
+                        not isinstance(task.exception(), (websockets.ConnectionClosed, asyncio.TimeoutError)):
+                    logger.warning(f"Speaker listener {listener.peer}: {task.exception()}")
+        except websockets.ConnectionClosed:
+            pass
+        finally:
+            for task in tasks:
+                task.cancel()
+            self.leave(listener)
+            logger.info(f"Speaker listener {listener.peer} left: {json.dumps(listener.stats())}")
+
+
+# --- Mic: browser -> sink ---
+
+class Mic:
+    """Browser microphone into the VNC_Mic sink through one long-lived playback stream.
+    The newest connection owns the mic; PCM from older ones is dropped so two tabs
+    don't interleave."""
+
+    def __init__(self, stream_cls, device):
+        self.stream_cls = stream_cls
+        self.device = device
+        self.owner = None
+        self.queue = deque()
+        self.queued = 0
+        self.cond = threading.Condition()
+        self.received = self.dropped = self.ignored = 0
+
+    def start(self):
+        threading.Thread(target=self.play, daemon=True).start()
+
+    def feed(self, data):
+        limit = frame_bytes(MIC_MAX_MS)
+        with self.cond:
+            self.queue.append(data)
+            self.queued += len(data)
+            while self.queued > limit and len(self.queue) > 1:
+                self.queued -= len(self.queue.popleft())
+                self.dropped += 1
+            self.cond.notify()
+
+    def play(self):
+        stream = None
+        while True:
+            with self.cond:
+                while not self.queue:
+                    self.cond.wait()
+                data = self.queue.popleft()
+                self.queued -= len(data)
+            try:
+                if stream is None:
+                    stream = self.stream_cls(PA_STREAM_PLAYBACK, self.device, MIC_LATENCY_MS)
+                    logger.info(f"Playing mic into {self.device} ({self.stream_cls.__name__})")
+                stream.write(data)
+            except OSError as e:
+                logger.warning(f"Mic playback failed: {e}")
+                if stream is not None:
+                    stream.close()
+                    stream = None
+                time.sleep(REOPEN_DELAY)
+
+    async def handler(self, ws, path=None):
+        self.owner = ws
+        logger.info("Mic connected")
+        try:
+            async for message in ws:
+                if ws is not self.owner:
+                    self.ignored += 1
+                elif isinstance(message, bytes):
+                    self.received += 1
+                    self.feed(message)
+        except websockets.ConnectionClosed:
+            pass
+        finally:
+            if self.owner is ws:
+                self.owner = None
+            logger.info("Mic disconnected")
+
+    def stats(self):
+        return {'connected': self.owner is not None, 'received': self.received, 'dropped': self.dropped,
+                'ignored': self.ignored, 'queuedMs': round(self.queued / frame_bytes(1))}
+
+
+# --- Router: new streams -> VNC_Speaker ---
+
+async def pactl(*args):
+    proc = await asyncio.create_subprocess_exec('pactl', *args, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                                env=dict(os.environ, LC_ALL='C'))
+    out, err = await proc.communicate()
+    if proc.returncode:
+        raise OSError(f"pactl {args[0]}: {err.decode().strip() or proc.returncode}")
+    return out.decode()
+
+def parse_sink_inputs(text):
+    """`pactl list sink-inputs` -> {index: {'sink': index, property: value}}"""
+    inputs, current = {}, None
+    for line in text.splitlines():
+        m = re.match(r'Sink Input #(\d+)', line)
+        if m:
+            current = inputs[int(m.group(1))] = {}
+            continue
+        m = re.match(r'\tSink: (\d+)', line) or re.match(r'\t\t([\w.]+) = "(.*)"$', line)
+        if current is not None and m:
+            if len(m.groups()) == 1:
+                current['sink'] = int(m.group(1))
+            else:
+                current[m.group(1)] = m.group(2)
+    return inputs
+
+class Router:
+    """Moves each new sink-input to its sink as soon as `pactl subscribe` announces it,
+    replacing start.sh's loop that re-moved every stream every 5 s."""
+
+    def __init__(self, rules, default_sink):
+        self.rules = ROUTE_KEEP + rules
+        self.default_sink = default_sink
+        self.sinks = {}                  # index -> name
+        self.moved = self.kept = self.ignored = self.failed = 0
+        self.latencies = deque(maxlen=ROUTE_SAMPLES)
+
+    def sink_for(self, props):
+        for pattern, sink in self.rules:
+            for key in ROUTE_PROPERTIES:
+                if fnmatch.fnmatch(props.get(key, '').lower(), pattern.lower()):
+                    return sink
+        return self.default_sink
+
+    async def load_sinks(self):
+        self.sinks = {int(line.split('\t')[0]): line.split('\t')[1]
+                      for line in (await pactl('list', 'sinks', 'short')).splitlines() if '\t' in line}
+
+    async def route(self, indexes, announced):
+        try:
+            inputs = parse_sink_inputs(await pactl('list', 'sink-inputs'))
+            for index in indexes:
+                props = inputs.get(index)
+                if props is None:
+                    continue  # Already gone
+                sink = self.sink_for(props)
+                name = props.get('application.name', '?')
+                if not sink:
+                    self.ignored += 1
+                elif self.sinks.get(props.get('sink')) == sink:
+                    self.kept += 1
+                else:
+                    try:
+                        await pactl('move-sink-input', str(index), sink)
+                    except OSError as e:
+                        self.failed += 1
+                        logger.warning(f"Could not move {name} (#{index}) to {sink}: {e}")
+                        continue
+                    self.moved += 1
+                    if announced is not None:
+                        self.latencies.append((time.monotonic() - announced) * 1000)
+                    logger.info(f"Routed {name} (#{index}) to {sink}")
+        except OSError as e:
+            self.failed += len(indexes)
+            logger.warning(f"Sink-input routing failed: {e}")
+
+    async def run(self):
+        while True:
+            try:
+                proc = await asyncio.create_subprocess_exec('pactl', 'subscribe', stdout=subprocess.PIPE,
+                                                            env=dict(os.environ, LC_ALL='C'))
+            except FileNotFoundError:
+                logger.warning("pactl not found, not routing sink-inputs")
+                return
+            try:
+                # Streams that appeared before the subscription (or while it was down)
+                await self.load_sinks()
+                await self.route(list(parse_sink_inputs(await pactl('list', 'sink-inputs'))), None)
+                logger.info(f"Routing new streams to {self.default_sink}")
+                async for line in proc.stdout:
+                    m = re.match(rb"Event '(new|remove)' on (sink-input|sink) #(\d+)", line)
+                    if not m:
+                        continue
+                    if m.group(2) == b'sink':
+                        await self.load_sinks()
+                    elif m.group(1) == b'new':
+                        asyncio.ensure_future(self.route([int(m.group(3))], time.monotonic()))
+            except OSError as e:
+                logger.warning(f"Router failed: {e}")
+            finally:
+                if proc.returncode is None:
+                    proc.kill()
+                await proc.wait()
+            logger.warning(f"pactl subscribe exited ({proc.returncode})")
+            await asyncio.sleep(REOPEN_DELAY)
+
+    def stats(self):
+        latencies = sorted(self.latencies)
+        return {
+            'moved': self.moved, 'kept': self.kept, 'ignored': self.ignored, 'failed': self.failed,
+            'latencyP50Ms': round(statistics.median(latencies), 1) if latencies else None,
+            'latencyMaxMs': round(latencies[-1], 1) if latencies else None,
+        }
+
+def route_rule(value):
+    pattern, sep, sink = value.partition('=')
+    if not sep or not pattern:
+        raise argparse.ArgumentTypeError('expected PATTERN=SINK')
+    return pattern, sink
+
+
+# --- Server ---
+
+def relay_stats(speaker, mic, router):
+    return {'frames': speaker.frames, 'opusPackets': speaker.packets, 'opusEncoders': len(speaker.encoders),
+            'captureErrors': speaker.capture_errors(),
+            'listeners': [l.stats() for l in speaker.listeners], 'mic': mic.stats(),
+            'router': router and router.stats()}
+
+def stats_endpoint(speaker, mic, router):
+    # Plain GET /stats on either port answers JSON instead of upgrading
+    async def process_request(path, headers):
+        if path.split('?')[0] == '/stats':
+            body = json.dumps(relay_stats(speaker, mic, router)).encode()
+            return http.HTTPStatus.OK, [('Content-Type', 'application/json'), ('Access-Control-Allow-Origin', '*')], body
+        return None
+    return process_request
+
+async def log_stats(speaker, mic, router):
+    while True:
+        await asyncio.sleep(STATS_INTERVAL)
+        if speaker.listeners or mic.owner is not None:
+            logger.info(f"Audio stats: {json.dumps(relay_stats(speaker, mic, router))}")
+
+async def serve(args):
+    stream_cls = stream_class(args.source)
+    OpusEncoder.lib = load_opus()
+    if OpusEncoder.lib is None:
+        logger.warning("libopus not found, speaker clients asking for Opus get PCM")
+    speaker = Speaker(stream_cls, args.speaker_device)
+    mic = Mic(stream_cls, args.mic_device)
+    router = None if args.no_router else Router(args.route, args.route_default)
+    speaker.start(asyncio.get_running_loop())
+    mic.start()
+    if router:
+        asyncio.ensure_future(router.run())
+    asyncio.ensure_future(log_stats(speaker, mic, router))
+    # PCM doesn't compress; websockets' own keepalive is replaced by Listener.measure
+    options = dict(subprotocols=['binary'], compression=None, ping_interval=None,
+                   process_request=stats_endpoint(speaker, mic, router))
+    async with websockets.serve(speaker.handler, args.host, args.speaker_port, **options), \
+            websockets.serve(mic.handler, args.host, args.mic_port, max_size=1 << 20, **options):
+        logger.info(f"Audio relay: speaker on {args.speaker_port}, mic on {args.mic_port}, source {args.source}")
+        await asyncio.Future()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--speaker-port', type=int, default=SPEAKER_PORT)
+    parser.add_argument('--mic-port', type=int, default=MIC_PORT)
+    parser.add_argument('--speaker-device', default=SPEAKER_DEVICE)
+    parser.add_argument('--mic-device', default=MIC_DEVICE)
+    parser.add_argument('--source', choices=('pulse', 'pipe', 'tone'), default='pulse',
+                        help='pulse: libpulse-simple in-process; pipe: parec/pacat; tone: synthetic test signal')
+    parser.add_argument('--route', type=route_rule, action='append', default=[], metavar='PATTERN=SINK',
+                        help='send streams whose application name or binary matches PATTERN to SINK '
+                             '(empty SINK: leave them alone); first match wins')
+    parser.add_argument('--route-default', default=ROUTE_DEFAULT_SINK, metavar='SINK',
+                        help='sink for streams no --route matches (empty: leave them alone)')
+    parser.add_argument('--no-router', action='store_true', help="don't route sink-inputs")
+    asyncio.run(serve(parser.parse_args()))
@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+"""Speaker latency, bandwidth and server CPU: audio_relay.py (PCM and Opus) vs socat + websockify.
+
+All chains carry the same synthetic source: audio_relay.py --source tone, and for
+the old chain socat EXECs this script with --emit-tone for every connection, where
+start.sh runs parec. A tone burst starts on every TONE_PERIOD boundary of the wall
+clock, so when a listener sees a burst begin, arrival time minus that boundary is
+the end-to-end latency. Opus listeners decode each packet with libopus before
+looking. CPU is the chain's processes plus their reaped children. The Opus chain is
+skipped without libopus, the old one where socat or websockify isn't installed.
+
+    python3 benchmarks/bench_audio_relay.py --clients 8 --seconds 20
+"""
+import argparse
+import array
+import asyncio
+import ctypes
+import json
+import math
+import os
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import time
+
+import websockets
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+import audio_relay  # noqa: E402
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from bench_usb_api import percentile  # noqa: E402
+
+CLK_TCK = os.sysconf('SC_CLK_TCK')
+WARMUP = 1.0                 # Seconds of bursts ignored while buffers fill
+LOUD = 1000                  # Peak sample level that counts as the burst having started
+
+
+def emit_tone():
+    stream = audio_relay.ToneStream()
+    size = audio_relay.frame_bytes(audio_relay.FRAME_MS)
+    out = sys.stdout.buffer
+    try:
+        while True:
+            out.write(stream.read(size))
+            out.flush()
+    except (BrokenPipeError, KeyboardInterrupt):
+        pass
+
+
+def proc_stat(pid):
+    with open(f'/proc/{pid}/stat') as f:
+        return f.read().rsplit(')', 1)[1].split()
+
+
+def cpu_seconds(pid):
+    # utime, stime, cutime, cstime (fields 14-17); fields[0] here is field 3
+    return sum(int(x) for x in proc_stat(pid)[11:15]) / CLK_TCK
+
+
+def descendants(pids):
+    children = {}
+    for entry in os.listdir('/proc'):
+        if entry.isdigit():
+            try:
+                children.setdefault(int(proc_stat(entry)[1]), []).append(int(entry))
+            except (OSError, IndexError):
+                pass
+    found, stack = set(), list(pids)
+    while stack:
+        pid = stack.pop()
+        found.add(pid)
+        stack.extend(children.get(pid, []))
+    return found
+
+
+def wait_port(port):
+    for _ in range(100):
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=0.1).close()
+            return
+        except OSError:
+            time.sleep(0.05)
+    raise RuntimeError(f'nothing listening on {port}')
+
+
+class OpusDecoder:
+    def __init__(self, lib, frame_ms):
+        lib.opus_decoder_create.restype = ctypes.c_void_p
+        lib.opus_decoder_create.argtypes = [ctypes.c_int32, ctypes.c_int, ctypes.POINTER(ctypes.c_int)]
+        lib.opus_decode.argtypes = [ctypes.c_void_p, ctypes.c_char_p, ctypes.c_int32, ctypes.c_void_p,
+                                    ctypes.c_int, ctypes.c_int]
+        lib.opus_decoder_destroy.argtypes = [ctypes.c_void_p]
+        self.lib = lib
+        self.handle = lib.opus_decoder_create(audio_relay.OPUS_RATE, audio_relay.CHANNELS, ctypes.byref(ctypes.c_int()))
+        self.samples = audio_relay.OPUS_RATE * frame_ms // 1000
+        self.pcm = (ctypes.c_int16 * self.samples)()
+
+    def decode(self, packet):
+        n = self.lib.opus_decode(self.handle, packet, len(packet), self.pcm, self.samples, 0)
+        return bytes(self.pcm)[:max(0, n) * audio_relay.SAMPLE_BYTES]
+
+    def close(self):
+        self.lib.opus_decoder_destroy(self.handle)
+
+
+def loud(pcm):
+    samples = array.array('h', pcm)
+    return bool(samples) and max(max(samples), -min(samples)) > LOUD
+
+
+async def listen(port, seconds, query):
+    latencies, size, quiet_until = [], 0, 0
+    decoder = None
+    start = time.time()
+    async with websockets.connect(f'ws://127.0.0.1:{port}/{query}', subprotocols=['binary'], max_size=None,
+                                  compression=None, ping_interval=None) as ws:
+        while time.time() - start < seconds:
+            message = await asyncio.wait_for(ws.recv(), 5)
+            now = time.time()
+            if isinstance(message, str):
+                fmt = json.loads(message)
+                if fmt['type'] == 'format' and fmt['codec'] == 'opus':
+                    decoder = OpusDecoder(audio_relay.load_opus(), fmt['frameMs'])
+                continue  # Otherwise latency announcements from the relay
+            size += len(message)
+            pcm = decoder.decode(message) if decoder else message
+            if now < quiet_until or not loud(pcm):
+                continue
+            burst = math.floor(now / audio_relay.TONE_PERIOD) * audio_relay.TONE_PERIOD
+            quiet_until = burst + audio_relay.TONE_PERIOD * 0.6
+            if now - start > WARMUP:
+                latencies.append((now - burst) * 1000)
+    if decoder:
+        decoder.close()
+    return latencies, size
+
+
+async def run_clients(port, clients, seconds, query, pids, sample):
+    tasks = [asyncio.ensure_future(listen(port, seconds, query)) for _ in range(clients)]
+    await asyncio.sleep(seconds / 2)
+    sample['processes'] = len(descendants(pids))
+    return await asyncio.gather(*tasks)
+
+
+def bench_chain(name, procs, port, args, query=''):
+    pids = [p.pid for p in procs]
+    try:
+        wait_port(port)
+        cpu0 = sum(cpu_seconds(pid) for pid in pids)
+        sample = {}
+        results = asyncio.run(run_clients(port, args.clients, args.seconds, query, pids, sample))
+        time.sleep(1)  # Let per-connection children exit and be reaped into cutime
+        cpu = sum(cpu_seconds(pid) for pid in pids) - cpu0
+    finally:
+        for p in procs:
+            p.terminate()
+        for p in procs:
+            p.wait()
+    latencies = [l for lat, _ in results for l in lat]
+    return {
+        'chain': name,
+        'clients': args.clients,
+        'bursts': len(latencies),
+        'p50_ms': round(statistics.median(latencies), 1) if latencies else None,
+        'p99_ms': round(percentile(latencies, 0.99), 1) if latencies else None,
+        'kb_per_s_per_client': round(statistics.mean(size for _, size in results) / args.seconds / 1024, 1),
+        'server_cpu_pct': round(cpu / args.seconds * 100, 1),
+        'processes': sample.get('processes'),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--clients', type=int, default=8)
+    parser.add_argument('--seconds', type=float, default=20)
+    parser.add_argument('--port', type=int, default=16082)
+    parser.add_argument('--bitrate', type=int, default=audio_relay.OPUS_BITRATE)
+    parser.add_argument('--frame-ms', type=int, default=audio_relay.FRAME_MS, choices=audio_relay.OPUS_FRAMES_MS)
+    parser.add_argument('--json', action='store_true', help='machine-readable output')
+    parser.add_argument('--emit-tone', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.emit_tone:
+        emit_tone()
+        return
+
+    quiet = dict(stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    def relay():
+        return subprocess.Popen([sys.executable, os.path.join(ROOT, 'audio_relay.py'), '--source', 'tone',
+                                 '--host', '127.0.0.1', '--speaker-port', str(args.port),
+                                 '--mic-port', str(args.port + 1)], **quiet)
+
+    results = [bench_chain('audio_relay pcm', [relay()], args.port, args)]
+    if audio_relay.load_opus():
+        query = f'?codec=opus&bitrate={args.bitrate}&frame={args.frame_ms}'
+        results.append(bench_chain('audio_relay opus', [relay()], args.port, args, query))
+    else:
+        results.append({'chain': 'audio_relay opus', 'skipped': 'libopus not installed'})
+
+    if shutil.which('socat') and shutil.which('websockify'):
+        tone = f'{sys.executable} {os.path.abspath(__file__)} --emit-tone'
+        socat = subprocess.Popen(['socat', f'TCP-LISTEN:{args.port + 2},reuseaddr,fork,bind=127.0.0.1',
+                                  f'EXEC:{tone}'], **quiet)
+        websockify = subprocess.Popen(['websockify', str(args.port + 3), f'127.0.0.1:{args.port + 2}'], **quiet)
+        results.append(bench_chain('socat+websockify', [socat, websockify], args.port + 3, args))
+    else:
+        results.append({'chain': 'socat+websockify', 'skipped': 'socat or websockify not installed'})
+
+    if args.json:
+        print(json.dumps(results))
+        return
+    for r in results:
+        if 'skipped' in r:
+            print(f"{r['chain']:>17}: skipped ({r['skipped']})")
+            continue
+        print(f"{r['chain']:>17}: p50 {r['p50_ms']} ms  p99 {r['p99_ms']} ms over {r['bursts']} bursts  "
+              f"{r['server_cpu_pct']}% CPU  {r['processes']} processes  {r['kb_per_s_per_client']} KiB/s per client")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""Throughput of BrowserFS.read: base64-in-JSON vs binary frames.
+
+Starts the browser_mount.py WebSocket server in-process and a fake browser
+peer in a separate process that serves a synthetic file from memory, then
+reads the whole file through BrowserFS.read once per framing mode.
+
+    python3 benchmarks/bench_browser_framing.py --size-mb 256 --threads 4
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from fake_browser import FakeBrowser, bm, make_file, start_bridge  # noqa: E402
+
+
+def read_all(fs, path, size, chunk, threads):
+    offsets = range(0, size, chunk)
+
+    def read_one(offset):
+        # fh 0 is not an open handle, so neither mode gets read-ahead
+        return offset, bytes(fs.read(path, chunk, offset, 0))
+
+    out = bytearray(size)
+    with ThreadPoolExecutor(threads) as pool:
+        for offset, data in pool.map(read_one, offsets):
+            out[offset:offset + len(data)] = data
+    return out
+
+
+def bench_mode(port, size, chunk, threads, binary):
+    with FakeBrowser(port, size, binary) as peer:
+        fs = bm.BrowserFS()
+        cpu0, t0 = time.process_time(), time.perf_counter()
+        data = read_all(fs, peer.path, size, chunk, threads)
+        elapsed = time.perf_counter() - t0
+        cpu = time.process_time() - cpu0
+    return {
+        'mode': 'binary' if binary else 'json',
+        'bytes': size,
+        'seconds': round(elapsed, 3),
+        'mb_per_s': round(size / elapsed / 1e6, 1),
+        'bridge_cpu_s_per_gb': round(cpu / (size / 1e9), 2),
+        'ok': data == make_file(size),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--size-mb', type=int, default=256)
+    parser.add_argument('--chunk-kb', type=int, default=128)
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--port', type=int, default=16084)
+    parser.add_argument('--json', action='store_true', help='machine-readable output')
+    args = parser.parse_args()
+
+    start_bridge(args.port)
+
+    size = args.size_mb * 1024 * 1024
+    results = [bench_mode(args.port, size, args.chunk_kb * 1024, args.threads, binary)
+               for binary in (False, True)]
+
+    if args.json:
+        print(json.dumps(results))
+        return
+    for r in results:
+        print(f"{r['mode']:>6}: {r['mb_per_s']:8.1f} MB/s  {r['seconds']:7.2f} s  "
+              f"{r['bridge_cpu_s_per_gb']:6.2f} CPU-s/GB  {'ok' if r['ok'] else 'MISMATCH'}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""Sequential copy through BrowserFS with and without read-ahead.
+
+Copies a synthetic file the way `cp` does (one open handle, fixed-size
+sequential reads on a single thread) from a fake browser peer that adds
+a simulated round-trip latency to every request. Without read-ahead the
+copy is RTT-bound; with it, it should approach the link bandwidth.
+
+    python3 benchmarks/bench_browser_readahead.py --size-mb 256 --latency-ms 20
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from fake_browser import FakeBrowser, bm, make_file, start_bridge  # noqa: E402
+
+
+def copy_file(fs, path, size, chunk):
+    out = bytearray()
+    fh = fs.open(path, os.O_RDONLY)
+    try:
+        offset = 0
+        while offset < size:
+            data = fs.read(path, chunk, offset, fh)
+            if not data:
+                break
+            out += bytes(data)
+            offset += len(data)
+    finally:
+        fs.release(path, fh)
+    return out
+
+
+def bench_mode(port, size, chunk, latency_ms, readahead):
+    bm.READAHEAD_MAX = readahead
+    bm.block_cache.clear()
+    with FakeBrowser(port, size, binary=True, latency_ms=latency_ms) as peer:
+        fs = bm.BrowserFS()
+        fs.getattr(peer.path)  # lets read-ahead stop at end of file
+        t0 = time.perf_counter()
+        data = copy_file(fs, peer.path, size, chunk)
+        elapsed = time.perf_counter() - t0
+    return {
+        'readahead_max': readahead,
+        'latency_ms': latency_ms,
+        'bytes': size,
+        'seconds': round(elapsed, 3),
+        'mb_per_s': round(size / elapsed / 1e6, 1),
+        'block_cache': bm.block_cache.stats(),
+        'ok': data == make_file(size),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--size-mb', type=int, default=256)
+    parser.add_argument('--chunk-kb', type=int, default=128, help='kernel read size')
+    parser.add_argument('--latency-ms', type=float, default=20)
+    parser.add_argument('--port', type=int, default=16084)
+    parser.add_argument('--json', action='store_true', help='machine-readable output')
+    args = parser.parse_args()
+
+    start_bridge(args.port)
+    size = args.size_mb * 1024 * 1024
+    results = [bench_mode(args.port, size, args.chunk_kb * 1024, args.latency_ms, readahead)
+               for readahead in (0, bm.READAHEAD_MAX)]
+
+    if args.json:
+        print(json.dumps(results))
+        return
+    for r in results:
+        label = f"readahead {r['readahead_max'] // 1024} KiB" if r['readahead_max'] else 'no readahead'
+        print(f"{label:>20}: {r['mb_per_s']:8.1f} MB/s  {r['seconds']:7.2f} s  {'ok' if r['ok'] else 'MISMATCH'}")
+
+
+if __name__ == '__main__':
+    main()
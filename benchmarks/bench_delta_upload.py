@@ -0,0 +1,284 @@
+#!/usr/bin/env python3
+"""Re-uploading an edited file: /api/upload (every byte) vs the /api/delta block protocol.
+
+Writes a file of random bytes under /root, then for each edit pattern puts the
+original back on the server, edits a local copy and sends it both ways. The
+delta client here is the reference one: it reads the server's block signature,
+finds blocks it already has at any byte offset with a rolling adler32
+(vectorized with numpy where an edit broke the block alignment) confirmed by SHA-256, and sends block references plus
+the bytes in between. Reports bytes up and down, wall time split into
+signature / matching / apply plus an estimate for a --mbit link, and checks
+the result's sha256.
+
+    python3 benchmarks/bench_delta_upload.py --size-mb 256
+"""
+import argparse
+import hashlib
+import http.client
+import json
+import os
+import random
+import shutil
+import struct
+import sys
+import tempfile
+import time
+import urllib.parse
+import zlib
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from bench_usb_api import start_server  # noqa: E402
+
+HEADER = struct.Struct('>QQI')
+RECORD = struct.Struct('>I16s')
+REF = struct.Struct('>cII')
+LITERAL = struct.Struct('>cI')
+LITERAL_MAX = 64 << 20
+SEGMENT = 4 << 20            # Window starts whose weak sums are computed in one numpy pass
+ADLER = 65521
+
+
+def weak_sums(window, block):
+    # adler32 of window[i:i+block] for every i, from prefix sums instead of rolling byte by byte
+    x = np.frombuffer(window, dtype=np.uint8).astype(np.int64)
+    s = np.concatenate(([0], np.cumsum(x)))
+    t = np.concatenate(([0], np.cumsum(s)))
+    a = (1 + s[block:] - s[:-block]) % ADLER
+    b = (block + t[block + 1:] - t[1:-block] - block * s[:-block]) % ADLER
+    return ((b << 16) | a).astype(np.uint32)
+
+
+def fetch_signature(port, path):
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=600)
+    conn.request('GET', '/api/delta/signature?path=' + urllib.parse.quote(path))
+    resp = conn.getresponse()
+    body = resp.read()
+    conn.close()
+    if resp.status != 200:
+        raise RuntimeError(f'signature: {resp.status} {body[:200]!r}')
+    size, mtime_ns, block = HEADER.unpack_from(body)
+    records = [RECORD.unpack_from(body, HEADER.size + i * RECORD.size)
+               for i in range((len(body) - HEADER.size) // RECORD.size)]
+    return size, mtime_ns, block, records, len(body)
+
+
+def make_delta(data, size, block, records):
+    # [('B', first, count) | ('L', start, end)] rebuilding data from the server's blocks.
+    # Unedited stretches are matched a block at a time at C speed (zlib, hashlib); only
+    # after a miss are weak sums computed at every offset, over a region that doubles
+    # until the stream finds its way back onto the server's blocks.
+    full = size // block      # Blocks of exactly `block` bytes; a shorter tail is matched separately
+    by_weak = {}
+    for i, (weak, strong) in enumerate(records[:full]):
+        by_weak.setdefault(weak, []).append((i, strong))
+    # Membership through a 16 MiB table on the low 24 bits: np.isin sorts every region
+    known = np.zeros(1 << 24, dtype=bool)
+    known[np.array(list(by_weak), dtype=np.uint32) & 0xFFFFFF] = True
+    view = memoryview(data)
+    n = len(data)
+    out = []
+    literal = 0               # Start of bytes not yet covered by an instruction
+    last = -2
+
+    def match(at, weak):
+        candidates = by_weak.get(weak)
+        if not candidates:
+            return None
+        strong = hashlib.sha256(view[at:at + block]).digest()[:16]
+        found = [i for i, s in candidates if s == strong]
+        if not found:
+            return None
+        return last + 1 if last + 1 in found else found[0]
+
+    def ref(i, at):
+        if at > literal:
+            out.append(('L', literal, at))
+        elif out and out[-1][0] == 'B' and out[-1][1] + out[-1][2] == i:
+            out[-1] = ('B', out[-1][1], out[-1][2] + 1)
+            return
+        out.append(('B', i, 1))
+
+    pos, region = 0, 16 * block
+    while full and pos + block <= n:
+        i = match(pos, zlib.adler32(view[pos:pos + block]))
+        at = pos
+        if i is None:
+            end = min(pos + region, n - block + 1)
+            weak = weak_sums(view[pos:end + block - 1], block)
+            for at in (np.flatnonzero(known[weak & 0xFFFFFF]) + pos).tolist():
+                i = match(at, int(weak[at - pos]))
+                if i is not None:
+                    break
+            if i is None:
+                pos, region = end, min(region * 2, SEGMENT)
+                continue
+        ref(i, at)
+        pos = literal = at + block
+        last, region = i, 16 * block
+    tail = size - full * block
+    if tail and n - tail >= literal and hashlib.sha256(view[n - tail:]).digest()[:16] == records[full][1]:
+        ref(full, n - tail)
+        literal = n
+    if literal < n:
+        out.append(('L', literal, n))
+    return out
+
+
+def send_delta(port, path, data, base, instructions, sha256):
+    length = sum(REF.size if op == 'B' else LITERAL.size * -(-(b - a) // LITERAL_MAX) + b - a
+                 for op, a, b in instructions)
+    query = urllib.parse.urlencode({'path': path, 'base': base, 'sha256': sha256})
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=600)
+    conn.putrequest('POST', '/api/delta/apply?' + query)
+    conn.putheader('Content-Length', str(length))
+    conn.endheaders()
+    view = memoryview(data)
+    for op, a, b in instructions:
+        if op == 'B':
+            conn.send(REF.pack(b'B', a, b))
+            continue
+        for start in range(a, b, LITERAL_MAX):
+            stop = min(start + LITERAL_MAX, b)
+            conn.send(LITERAL.pack(b'L', stop - start))
+            conn.send(view[start:stop])
+    resp = conn.getresponse()
+    result = json.loads(resp.read())
+    conn.close()
+    if resp.status != 200:
+        raise RuntimeError(f'apply: {resp.status} {result}')
+    return length
+
+
+def send_full(port, folder, name, data):
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=600)
+    conn.putrequest('POST', '/api/upload?path=' + urllib.parse.quote(folder))
+    conn.putheader('Content-Length', str(len(data)))
+    conn.putheader('X-File-Name', name)
+    conn.endheaders()
+    conn.send(memoryview(data))
+    resp = conn.getresponse()
+    resp.read()
+    conn.close()
+    if resp.status != 200:
+        raise RuntimeError(f'upload: {resp.status}')
+    return len(data)
+
+
+def noise(rng, n):
+    # randbytes in pieces: one call is limited to 2**31 bits
+    return b''.join(rng.randbytes(min(16 << 20, n - i)) for i in range(0, n, 16 << 20))
+
+
+def edits(rng):
+    # name -> function(bytearray) editing it in place, the way people change big files
+    def scattered(buf):
+        for _ in range(16):
+            at = rng.randrange(len(buf) - 4096)
+            buf[at:at + 4096] = rng.randbytes(4096)
+
+    def insert(buf):
+        at = len(buf) // 2
+        buf[at:at] = rng.randbytes(1024)
+
+    def delete(buf):
+        at = len(buf) // 3
+        del buf[at:at + 64 * 1024]
+
+    def append(buf):
+        buf += rng.randbytes(1 << 20)
+
+    def truncate(buf):
+        del buf[len(buf) * 9 // 10:]
+
+    def rewrite(buf):
+        buf[:] = noise(rng, len(buf))
+
+    return [('unchanged', lambda buf: None), ('16 x 4 KiB overwritten', scattered),
+            ('1 KiB inserted', insert), ('64 KiB deleted', delete), ('1 MiB appended', append),
+            ('last 10% cut', truncate), ('rewritten', rewrite)]
+
+
+def bench_edit(port, folder, original, name, edit, mbit):
+    target = os.path.join(folder, 'target.bin')
+    shutil.copyfile(original, target)
+    with open(original, 'rb') as f:
+        buf = bytearray(f.read())
+    edit(buf)
+    data = bytes(buf)
+    sha256 = hashlib.sha256(data).hexdigest()
+
+    t0 = time.perf_counter()
+    sent_full = send_full(port, folder, 'target.bin', data)
+    full_s = time.perf_counter() - t0
+    shutil.copyfile(original, target)
+
+    t0 = time.perf_counter()
+    size, mtime_ns, block, records, received = fetch_signature(port, target)
+    t1 = time.perf_counter()
+    instructions = make_delta(data, size, block, records)
+    t2 = time.perf_counter()
+    sent = send_delta(port, target, data, f'{size}:{mtime_ns}:{block}', instructions, sha256)
+    t3 = time.perf_counter()
+    with open(target, 'rb') as f:
+        ok = hashlib.sha256(f.read()).hexdigest() == sha256
+    return {
+        'edit': name,
+        'block': block,
+        'full_bytes_up': sent_full,
+        'full_s': round(full_s, 3),
+        'delta_bytes_up': sent,
+        'delta_bytes_down': received,
+        'delta_s': round(t3 - t0, 3),
+        'signature_s': round(t1 - t0, 3),
+        'match_s': round(t2 - t1, 3),
+        'apply_s': round(t3 - t2, 3),
+        'literal_bytes': sum(b - a for op, a, b in instructions if op == 'L'),
+        # Loopback hides the transfer; these add it back for a link of --mbit
+        'full_link_s': round(full_s + sent_full * 8 / (mbit * 1e6), 2),
+        'delta_link_s': round(t3 - t0 + (sent + received) * 8 / (mbit * 1e6), 2),
+        'ok': ok,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--size-mb', type=int, default=256)
+    parser.add_argument('--port', type=int, default=16083)
+    parser.add_argument('--async', dest='use_async', action='store_true', help='run usb_manager.py --async')
+    parser.add_argument('--mbit', type=float, default=100, help='link speed for the *_link_s estimates')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--json', action='store_true', help='machine-readable output')
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    folder = tempfile.mkdtemp(prefix='.vesta-bench-', dir='/root')
+    original = os.path.join(folder, 'original.bin')
+    with open(original, 'wb') as f:
+        f.write(noise(rng, args.size_mb << 20))
+    proc = start_server(args.port, args.use_async)
+    try:
+        results = [bench_edit(args.port, folder, original, name, edit, args.mbit) for name, edit in edits(rng)]
+    finally:
+        proc.terminate()
+        proc.wait()
+        shutil.rmtree(folder, ignore_errors=True)
+
+    if args.json:
+        print(json.dumps(results))
+        return
+    mb = 1 << 20
+    print(f"{args.size_mb} MiB file, block {results[0]['block']} B, link estimates at {args.mbit:g} Mbit/s")
+    for r in results:
+        print(f"{r['edit']:>24}: full {r['full_bytes_up'] / mb:8.1f} MiB {r['full_s']:6.2f} s   "
+              f"delta {r['delta_bytes_up'] / mb:8.2f} MiB up {r['delta_bytes_down'] / mb:5.2f} MiB down "
+              f"{r['delta_s']:6.2f} s (sig {r['signature_s']:.2f} match {r['match_s']:.2f} "
+              f"apply {r['apply_s']:.2f})   on the link: full {r['full_link_s']:.1f} s delta {r['delta_link_s']:.1f} s  "
+              f"{'ok' if r['ok'] else 'MISMATCH'}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,476 @@
+#!/usr/bin/env python3
+"""Benchmark suite for usb_manager.py and the browser_mount.py bridge, for comparing commits.
+
+File API: generates synthetic trees under /root (wide: one big folder; deep: a
+long chain of folders; many-small: many folders of small files; few-huge: a
+few large files), then drives /api/usbs, /api/files, /api/download and
+/api/upload from --clients concurrent clients. Each scenario gets a fresh
+usb_manager.py (threaded and --async), so its peak RSS and thread count are
+its own.
+
+Bridge: a child process runs BrowserFS against the fake browser peer in
+fake_browser.py with each --latency-ms injected per request, and measures
+sequential and random reads, writes and uncached getattr.
+
+Contents, sizes and request order come from --seed, so two runs on the same
+machine do the same work. With --repeat N every scenario runs N times and the
+median of each figure is reported. --out writes the results as JSON, with the
+commit and machine they came from; --compare puts them next to an earlier file.
+
+    python3 benchmarks/bench_suite.py --out before.json
+    git checkout my-branch
+    python3 benchmarks/bench_suite.py --out after.json --compare before.json
+    python3 benchmarks/bench_suite.py --compare before.json after.json   # no new run
+"""
+import argparse
+import http.client
+import itertools
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from bench_usb_api import percentile, proc_status, start_server  # noqa: E402
+
+SCALES = {
+    'quick': dict(wide=1000, depth=20, small_dirs=20, small_files=50, huge=1, huge_mb=32,
+                  requests=200, big_requests=4, upload_kb=64, upload_mb=8, bridge_mb=32, bridge_ops=200),
+    'default': dict(wide=5000, depth=100, small_dirs=100, small_files=100, huge=2, huge_mb=256,
+                    requests=2000, big_requests=16, upload_kb=64, upload_mb=64, bridge_mb=128, bridge_ops=1000),
+}
+NOISE = 16 << 20             # Random bytes generated once and reused for large files
+REGRESSION = 0.10            # Relative change --compare flags
+NOISE_MS = 0.5               # Latency changes smaller than this are timer noise, whatever the ratio
+LOWER_IS_BETTER = ('_ms', '_mb', 'seconds', 'errors', 'threads')
+
+
+def git_commit():
+    try:
+        head = subprocess.run(['git', '-C', ROOT, 'rev-parse', 'HEAD'], capture_output=True, text=True).stdout.strip()
+        dirty = bool(subprocess.run(['git', '-C', ROOT, 'status', '--porcelain', '-uno'],
+                                    capture_output=True, text=True).stdout.strip())
+        return head or None, dirty
+    except OSError:
+        return None, None
+
+
+def rss_mb(pid, key='VmHWM'):
+    return round(int(proc_status(pid)[key]) / 1024, 1)
+
+
+# --- Synthetic trees ---
+
+def write_file(path, size, noise, rng):
+    with open(path, 'wb') as f:
+        while size > 0:
+            start = rng.randrange(len(noise) - min(size, len(noise)) + 1)
+            piece = noise[start:start + min(size, len(noise))]
+            f.write(piece)
+            size -= len(piece)
+
+
+def make_trees(base, scale, rng):
+    noise = rng.randbytes(NOISE)
+    tree = {'base': base, 'deep_dirs': [], 'small_dirs': [], 'small_files': [], 'huge_files': []}
+    wide = os.path.join(base, 'wide')
+    os.makedirs(wide)
+    for i in range(scale['wide']):
+        write_file(os.path.join(wide, f'file{i:06d}.txt'), rng.randrange(4096), noise, rng)
+    tree['wide'] = wide
+
+    path = os.path.join(base, 'deep')
+    for level in range(scale['depth']):
+        path = os.path.join(path, f'level{level:03d}')
+        os.makedirs(path)
+        for i in range(4):
+            write_file(os.path.join(path, f'note{i}.txt'), rng.randrange(4096), noise, rng)
+        tree['deep_dirs'].append(path)
+
+    for d in range(scale['small_dirs']):
+        folder = os.path.join(base, 'small', f'dir{d:04d}')
+        os.makedirs(folder)
+        for i in range(scale['small_files']):
+            name = os.path.join(folder, f'img{i:04d}.jpg')
+            write_file(name, rng.randrange(256, 16384), noise, rng)
+            tree['small_files'].append(name)
+        tree['small_dirs'].append(folder)
+
+    os.makedirs(os.path.join(base, 'huge'))
+    for i in range(scale['huge']):
+        name = os.path.join(base, 'huge', f'disk{i}.img')
+        write_file(name, scale['huge_mb'] << 20, noise, rng)
+        tree['huge_files'].append(name)
+
+    tree['upload'] = os.path.join(base, 'upload')
+    os.makedirs(tree['upload'])
+    return tree
+
+
+# --- File API ---
+
+def call(port, method, route, body=None, name=None):
+    # (seconds, ok, bytes moved); a fresh connection per request, like the UI's fetch() calls
+    t0 = time.perf_counter()
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=300)
+    size = 0
+    try:
+        if body is None:
+            conn.request(method, route)
+        else:
+            conn.putrequest(method, route)
+            conn.putheader('Content-Length', str(len(body)))
+            conn.putheader('X-File-Name', name)
+            conn.endheaders()
+            conn.send(body)
+            size = len(body)
+        resp = conn.getresponse()
+        while True:
+            chunk = resp.read(256 * 1024)
+            if not chunk:
+                break
+            if body is None:
+                size += len(chunk)
+        ok = resp.status == 200
+    except OSError:
+        ok = False
+    finally:
+        conn.close()
+    return time.perf_counter() - t0, ok, size
+
+
+def file_api_scenarios(tree, scale, rng):
+    # name -> [(method, route, body or None)], in a seeded order
+    q = urllib.parse.quote
+    n = scale['requests']
+    small_body = rng.randbytes(scale['upload_kb'] << 10)
+    large_body = rng.randbytes(scale['upload_mb'] << 20)
+
+    def pick(items, count):
+        return [rng.choice(items) for _ in range(count)]
+
+    def upload(body):
+        return ('POST', '/api/upload?path=' + q(tree['upload']), body)
+
+    return {
+        'usbs': [('GET', '/api/usbs', None)] * n,
+        'files wide (page)': [('GET', f"/api/files?path={q(tree['wide'])}&limit=200", None)] * n,
+        'files wide (all)': [('GET', f"/api/files?path={q(tree['wide'])}", None)] * n,
+        'files deep': [('GET', '/api/files?path=' + q(d), None) for d in pick(tree['deep_dirs'], n)],
+        'files many-small': [('GET', '/api/files?path=' + q(d), None) for d in pick(tree['small_dirs'], n)],
+        'download small': [('GET', '/api/download?path=' + q(f), None) for f in pick(tree['small_files'], n)],
+        'download huge': [('GET', '/api/download?path=' + q(f), None)
+                          for f in pick(tree['huge_files'], scale['big_requests'])],
+        'upload small': [upload(small_body)] * (n // 4),
+        'upload large': [upload(large_body)] * max(scale['big_requests'] // 4, 1),
+    }
+
+
+def run_file_api(port, use_async, name, work, clients):
+    proc = start_server(port, use_async)
+    peak_threads = 0
+    done = threading.Event()
+
+    def sample():
+        nonlocal peak_threads
+        while not done.is_set():
+            try:
+                peak_threads = max(peak_threads, int(proc_status(proc.pid)['Threads']))
+            except (OSError, KeyError, ValueError):
+                pass
+            time.sleep(0.02)
+
+    sampler = threading.Thread(target=sample, daemon=True)
+    sampler.start()
+    counter = itertools.count()
+    try:
+        for method, route, body in work[:1]:
+            call(port, method, route, body, 'warmup.bin')  # Caches and lazy imports, untimed
+        t0 = time.perf_counter()
+        with ThreadPoolExecutor(clients) as pool:
+            results = list(pool.map(lambda w: call(port, w[0], w[1], w[2], f'u{next(counter)}.bin'), work))
+        elapsed = time.perf_counter() - t0
+        rss = rss_mb(proc.pid)
+    finally:
+        done.set()
+        sampler.join()
+        proc.terminate()
+        proc.wait()
+    latencies = [r[0] for r in results]
+    return {
+        'suite': 'file_api',
+        'scenario': name,
+        'mode': 'async' if use_async else 'threaded',
+        'clients': clients,
+        'requests': len(results),
+        'errors': sum(1 for r in results if not r[1]),
+        'seconds': round(elapsed, 3),
+        'req_per_s': round(len(results) / elapsed, 1),
+        'mb_per_s': round(sum(r[2] for r in results) / elapsed / 1e6, 1),
+        'p50_ms': round(statistics.median(latencies) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 2),
+        'peak_rss_mb': rss,
+        'peak_threads': peak_threads,
+    }
+
+
+# --- Browser bridge (runs in a child process, so RSS is the bridge's own) ---
+
+def bridge_results(args):
+    from fake_browser import FakeBrowser, bm, start_bridge
+    scale = SCALES[args.scale]
+    size = scale['bridge_mb'] << 20
+    ops = scale['bridge_ops']
+    chunk = 128 * 1024
+    start_bridge(args.bridge_port)
+    fs = bm.BrowserFS()
+    results = []
+
+    def record(name, latency_ms, latencies, elapsed, moved):
+        results.append({
+            'suite': 'bridge',
+            'scenario': name,
+            'latency_ms': latency_ms,
+            'ops': len(latencies),
+            'seconds': round(elapsed, 3),
+            'ops_per_s': round(len(latencies) / elapsed, 1),
+            'mb_per_s': round(moved / elapsed / 1e6, 1),
+            'p50_ms': round(statistics.median(latencies) * 1000, 2),
+            'p99_ms': round(percentile(latencies, 0.99) * 1000, 2),
+            'rss_mb': rss_mb(os.getpid(), 'VmRSS'),
+            'peak_rss_mb': rss_mb(os.getpid()),
+        })
+
+    def timed(fn, *a):
+        t0 = time.perf_counter()
+        result = fn(*a)
+        return time.perf_counter() - t0, result
+
+    for latency in args.latency_ms:
+        rng = random.Random(args.seed)
+        for cache in (bm.attr_cache, bm.dir_cache, bm.block_cache):
+            cache.clear()
+        with FakeBrowser(args.bridge_port, size, binary=True, latency_ms=latency) as peer:
+            path = peer.path
+            fs('getattr', path)  # Read-ahead stops at end of file
+
+            # Sequential copy, the way cp reads: one handle, one thread, read-ahead on
+            fh = fs('open', path, os.O_RDONLY)
+            latencies, t0 = [], time.perf_counter()
+            for offset in range(0, size, chunk):
+                seconds, data = timed(fs, 'read', path, chunk, offset, fh)
+                latencies.append(seconds)
+            record('sequential read', latency, latencies, time.perf_counter() - t0, size)
+            fs('release', path, fh)
+
+            # 4 KiB reads at random offsets from --clients threads, cold block cache
+            bm.block_cache.clear()
+            offsets = [rng.randrange(size - 4096) for _ in range(ops)]
+            t0 = time.perf_counter()
+            with ThreadPoolExecutor(args.clients) as pool:
+                latencies = [s for s, _ in pool.map(lambda o: timed(fs, 'read', path, 4096, o, 0), offsets)]
+            record('random read 4k', latency, latencies, time.perf_counter() - t0, 4096 * ops)
+
+            # Uncached getattr: one round trip to the browser each
+            latencies, t0 = [], time.perf_counter()
+            for _ in range(min(ops, 200)):
+                bm.attr_cache.clear()
+                latencies.append(timed(fs, 'getattr', path)[0])
+            record('getattr', latency, latencies, time.perf_counter() - t0, 0)
+
+            # Sequential write through the write-back buffer, closed (flushed) at the end
+            written = size // 4
+            payload = rng.randbytes(chunk)
+            fh = fs('open', path, os.O_WRONLY)
+            latencies, t0 = [], time.perf_counter()
+            for offset in range(0, written, chunk):
+                latencies.append(timed(fs, 'write', path, payload, offset, fh)[0])
+            latencies.append(timed(fs, 'flush', path, fh)[0])
+            fs('release', path, fh)
+            record('sequential write', latency, latencies, time.perf_counter() - t0, written)
+    return results
+
+
+def run_bridge(args):
+    cmd = [sys.executable, os.path.abspath(__file__), '--bridge-child', '--scale', args.scale,
+           '--clients', str(args.clients), '--seed', str(args.seed), '--bridge-port', str(args.bridge_port),
+           '--latency-ms', *map(str, args.latency_ms)]
+    out = subprocess.run(cmd, capture_output=True, text=True)
+    if out.returncode:
+        print(out.stderr, file=sys.stderr)
+        return [{'suite': 'bridge', 'scenario': 'all', 'skipped': out.stderr.strip().splitlines()[-1:]}]
+    return json.loads(out.stdout)
+
+
+# --- Runs, repeats and comparison ---
+
+def key(r):
+    return r['suite'], r['scenario'], r.get('mode', r.get('latency_ms'))
+
+
+def median_of(runs):
+    # One result per scenario: the median of every number across runs
+    merged = []
+    for results in zip(*runs):
+        row = dict(results[0])
+        for field, value in row.items():
+            if isinstance(value, (int, float)) and not isinstance(value, bool) and field not in ('clients', 'latency_ms'):
+                values = [r[field] for r in results]
+                row[field] = round(statistics.median(values), 3) if isinstance(value, float) else int(statistics.median(values))
+        merged.append(row)
+    return merged
+
+
+def run_suite(args):
+    scale = SCALES[args.scale]
+    runs = []
+    for _ in range(args.repeat):
+        rng = random.Random(args.seed)
+        results = []
+        if 'file_api' in args.suites:
+            base = tempfile.mkdtemp(prefix='.vesta-bench-', dir='/root')
+            try:
+                tree = make_trees(base, scale, rng)
+                scenarios = file_api_scenarios(tree, scale, rng)
+                for use_async in args.modes:
+                    for name, work in scenarios.items():
+                        results.append(run_file_api(args.port, use_async, name, work, args.clients))
+                        for entry in os.scandir(tree['upload']):
+                            os.unlink(entry.path)
+            finally:
+                shutil.rmtree(base, ignore_errors=True)
+        if 'bridge' in args.suites:
+            results += run_bridge(args)
+        runs.append(results)
+    commit, dirty = git_commit()
+    return {
+        'meta': {
+            'commit': commit,
+            'dirty': dirty,
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'host': platform.node(),
+            'cpus': os.cpu_count(),
+            'python': platform.python_version(),
+            'scale': args.scale,
+            'clients': args.clients,
+            'seed': args.seed,
+            'repeat': args.repeat,
+        },
+        'results': median_of(runs),
+    }
+
+
+def compare(old, new, threshold):
+    # Rows of (scenario, field, old, new, change) and whether anything got worse than threshold
+    before = {key(r): r for r in old['results']}
+    rows, regressed = [], False
+    for r in new['results']:
+        o = before.get(key(r))
+        if o is None or 'skipped' in r or 'skipped' in o:
+            continue
+        for field in ('req_per_s', 'ops_per_s', 'mb_per_s', 'p50_ms', 'p99_ms', 'peak_rss_mb', 'errors'):
+            if field not in r or field not in o:
+                continue
+            if field == 'errors':
+                if r[field] or o[field]:
+                    rows.append((' / '.join(str(k) for k in key(r)), field, o[field], r[field], 0.0, r[field] > o[field]))
+                    regressed |= r[field] > o[field]
+                continue
+            if not o[field]:
+                continue
+            change = (r[field] - o[field]) / o[field]
+            worse = change > threshold if field.endswith(LOWER_IS_BETTER) else change < -threshold
+            if field.endswith('_ms') and abs(r[field] - o[field]) < NOISE_MS:
+                worse = False
+            regressed |= worse
+            rows.append((' / '.join(str(k) for k in key(r)), field, o[field], r[field], change, worse))
+    return rows, regressed
+
+
+def print_results(doc):
+    meta = doc['meta']
+    print(f"commit {(meta['commit'] or '?')[:12]}{' (dirty)' if meta['dirty'] else ''}  {meta['scale']} scale  "
+          f"{meta['clients']} clients  {meta['cpus']} CPUs  python {meta['python']}")
+    for r in doc['results']:
+        if 'skipped' in r:
+            print(f"{r['suite']:>8} {r['scenario']:>18}: skipped ({r['skipped']})")
+            continue
+        where = r.get('mode') or f"{r['latency_ms']:g} ms"
+        rate = f"{r['req_per_s']:8.1f} req/s" if 'req_per_s' in r else f"{r['ops_per_s']:8.1f} op/s "
+        errors = f"  {r['errors']} errors" if r.get('errors') else ''
+        print(f"{r['suite']:>8} {r['scenario']:>18} {where:>8}: {rate} {r['mb_per_s']:8.1f} MB/s  "
+              f"p50 {r['p50_ms']:8.2f} ms  p99 {r['p99_ms']:8.2f} ms  RSS {r['peak_rss_mb']:6.1f} MB{errors}")
+
+
+def print_comparison(rows, regressed, old, new):
+    print(f"{(old['meta']['commit'] or '?')[:12]} -> {(new['meta']['commit'] or '?')[:12]}")
+    for name, field, a, b, change, worse in rows:
+        print(f"{name:>40} {field:>12}: {a:10} -> {b:10}  {change * 100:+6.1f}%{'  REGRESSION' if worse else ''}")
+    print('regressions found' if regressed else 'no regressions')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--scale', choices=SCALES, default='default')
+    parser.add_argument('--suites', nargs='+', choices=('file_api', 'bridge'), default=['file_api', 'bridge'])
+    parser.add_argument('--modes', nargs='+', choices=('threaded', 'async'), default=['threaded', 'async'])
+    parser.add_argument('--clients', type=int, default=16)
+    parser.add_argument('--latency-ms', nargs='+', type=float, default=[0, 20],
+                        help='round-trip delay the fake browser adds, one bridge run each')
+    parser.add_argument('--repeat', type=int, default=1)
+    parser.add_argument('--seed', type=int, default=6083)
+    parser.add_argument('--port', type=int, default=16083)
+    parser.add_argument('--bridge-port', type=int, default=16084)
+    parser.add_argument('--out', help='write the results as JSON here')
+    parser.add_argument('--compare', nargs='+', metavar='JSON',
+                        help='an earlier --out file to compare this run with, or two files to compare without running')
+    parser.add_argument('--threshold', type=float, default=REGRESSION,
+                        help='relative change counted as a regression (exit status 1)')
+    parser.add_argument('--json', action='store_true', help='machine-readable output')
+    parser.add_argument('--bridge-child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.bridge_child:
+        print(json.dumps(bridge_results(args)))
+        return
+    if args.compare and len(args.compare) > 2:
+        parser.error('--compare takes one or two files')
+    if args.compare and len(args.compare) == 2:
+        with open(args.compare[0]) as f:
+            old = json.load(f)
+        with open(args.compare[1]) as f:
+            doc = json.load(f)
+    else:
+        args.modes = [mode == 'async' for mode in args.modes]
+        doc = run_suite(args)
+        if args.out:
+            with open(args.out, 'w') as f:
+                json.dump(doc, f, indent=1)
+        if args.json:
+            print(json.dumps(doc))
+        else:
+            print_results(doc)
+        if not args.compare:
+            return
+        with open(args.compare[0]) as f:
+            old = json.load(f)
+    rows, regressed = compare(old, doc, args.threshold)
+    if args.json and len(args.compare) == 2:
+        print(json.dumps([dict(zip(('scenario', 'field', 'old', 'new', 'change', 'regression'), row)) for row in rows]))
+    elif not args.json:
+        print_comparison(rows, regressed, old, doc)
+    sys.exit(1 if regressed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+"""Load test for usb_manager.py: threaded server vs --async.
+
+Builds a synthetic directory under /root (the API only serves allowed roots),
+starts usb_manager.py once per mode, parks a number of idle connections on it
+the way open File Manager tabs and stalled clients do, and then drives a mix
+of listing, device, settings and download requests from concurrent clients.
+Reports throughput, per-route p50/p99 latency and the server's peak thread
+count and RSS.
+
+    python3 benchmarks/bench_usb_api.py --clients 32 --requests 2000 --idle 200
+"""
+import argparse
+import http.client
+import json
+import os
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SERVER = os.path.join(ROOT, 'usb_manager.py')
+
+
+def make_tree(files, download_mb):
+    base = tempfile.mkdtemp(prefix='.vesta-bench-', dir='/root')
+    listing = os.path.join(base, 'listing')
+    os.makedirs(listing)
+    for i in range(files):
+        if i % 50 == 0:
+            os.makedirs(os.path.join(listing, f'dir{i:05d}'))
+        with open(os.path.join(listing, f'file{i:05d}.txt'), 'wb') as f:
+            f.write(b'x' * (i % 4096))
+    with open(os.path.join(base, 'download.bin'), 'wb') as f:
+        f.write(os.urandom(download_mb * 1024 * 1024))
+    return base
+
+
+def proc_status(pid):
+    status = {}
+    with open(f'/proc/{pid}/status') as f:
+        for line in f:
+            key, _, value = line.partition(':')
+            status[key] = value.split()[0] if value.split() else ''
+    return status
+
+
+def start_server(port, use_async, extra=()):
+    cmd = [sys.executable, SERVER, '--port', str(port)] + (['--async'] if use_async else []) + list(extra)
+    proc = subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    for _ in range(100):
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=0.1).close()
+            return proc
+        except OSError:
+            time.sleep(0.05)
+    proc.kill()
+    raise RuntimeError('usb_manager.py did not start')
+
+
+def open_idle(port, count):
+    # Half a request line: the server has accepted the socket and is waiting on it
+    socks = []
+    for _ in range(count):
+        s = socket.create_connection(('127.0.0.1', port))
+        s.sendall(b'GET /api/ping HTTP/1.1\r\n')
+        socks.append(s)
+    return socks
+
+
+def request(port, route):
+    t0 = time.perf_counter()
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+    try:
+        conn.request('GET', route)
+        resp = conn.getresponse()
+        size = 0
+        while True:
+            chunk = resp.read(256 * 1024)
+            if not chunk:
+                break
+            size += len(chunk)
+        ok = resp.status == 200
+    except OSError:
+        ok, size = False, 0
+    finally:
+        conn.close()
+    return route, time.perf_counter() - t0, ok, size
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def bench_mode(port, use_async, base, args):
+    routes = [
+        '/api/files?path=' + urllib.parse.quote(os.path.join(base, 'listing')),
+        '/api/usbs',
+        '/api/settings',
+    ]
+    download = '/api/download?path=' + urllib.parse.quote(os.path.join(base, 'download.bin'))
+    # One download per --download-every requests, listings and metadata otherwise
+    work = [download if args.download_every and i % args.download_every == 0 else routes[i % len(routes)]
+            for i in range(args.requests)]
+
+    proc = start_server(port, use_async)
+    peak_threads = 0
+    done = threading.Event()
+
+    def sample():
+        nonlocal peak_threads
+        while not done.is_set():
+            try:
+                peak_threads = max(peak_threads, int(proc_status(proc.pid)['Threads']))
+            except (OSError, KeyError, ValueError):
+                pass
+            time.sleep(0.02)
+
+    sampler = threading.Thread(target=sample, daemon=True)
+    sampler.start()
+    idle = open_idle(port, args.idle)
+    try:
+        time.sleep(0.2)
+        t0 = time.perf_counter()
+        with ThreadPoolExecutor(args.clients) as pool:
+            results = list(pool.map(lambda route: request(port, route), work))
+        elapsed = time.perf_counter() - t0
+        rss_kb = int(proc_status(proc.pid)['VmHWM'])
+    finally:
+        done.set()
+        sampler.join()
+        for s in idle:
+            s.close()
+        proc.terminate()
+        proc.wait()
+
+    by_route = {}
+    for route, latency, ok, size in results:
+        name = route.split('?')[0]
+        by_route.setdefault(name, []).append(latency)
+    return {
+        'mode': 'async' if use_async else 'threaded',
+        'requests': len(results),
+        'errors': sum(1 for r in results if not r[2]),
+        'seconds': round(elapsed, 3),
+        'req_per_s': round(len(results) / elapsed, 1),
+        'bytes': sum(r[3] for r in results),
+        'peak_threads': peak_threads,
+        'peak_rss_mb': round(rss_kb / 1024, 1),
+        'routes': {
+            name: {
+                'count': len(lat),
+                'p50_ms': round(statistics.median(lat) * 1000, 2),
+                'p99_ms': round(percentile(lat, 0.99) * 1000, 2),
+            } for name, lat in sorted(by_route.items())
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--clients', type=int, default=32)
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--idle', type=int, default=200, help='idle connections held open during the run')
+    parser.add_argument('--files', type=int, default=2000, help='entries in the listed directory')
+    parser.add_argument('--download-mb', type=int, default=8)
+    parser.add_argument('--download-every', type=int, default=50)
+    parser.add_argument('--port', type=int, default=16083)
+    parser.add_argument('--json', action='store_true', help='machine-readable output')
+    args = parser.parse_args()
+
+    base = make_tree(args.files, args.download_mb)
+    try:
+        results = [bench_mode(args.port, use_async, base, args) for use_async in (False, True)]
+    finally:
+        shutil.rmtree(base, ignore_errors=True)
+
+    if args.json:
+        print(json.dumps(results))
+        return
+    for r in results:
+        print(f"{r['mode']:>8}: {r['req_per_s']:8.1f} req/s  {r['seconds']:7.2f} s  "
+              f"{r['errors']} errors  peak {r['peak_threads']} threads  {r['peak_rss_mb']} MB RSS")
+        for name, s in r['routes'].items():
+            print(f"          {name:<16} n={s['count']:<6} p50 {s['p50_ms']:8.2f} ms  p99 {s['p99_ms']:8.2f} ms")
+
+
+if __name__ == '__main__':
+    main()
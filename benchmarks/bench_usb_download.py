@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""Server CPU per GB served by /api/download: userspace copy vs sendfile.
+
+Writes a file under /root, warms the page cache, then downloads it repeatedly
+from usb_manager.py started with and without --no-sendfile (threaded and
+--async) and reads the server's CPU time from /proc.
+
+    python3 benchmarks/bench_usb_download.py --size-mb 512 --rounds 8 --clients 2
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from bench_usb_api import request, start_server  # noqa: E402
+
+CLK_TCK = os.sysconf('SC_CLK_TCK')
+
+
+def cpu_seconds(pid):
+    with open(f'/proc/{pid}/stat') as f:
+        fields = f.read().rsplit(')', 1)[1].split()
+    # utime and stime are fields 14 and 15; fields[0] here is field 3
+    return (int(fields[11]) + int(fields[12])) / CLK_TCK
+
+
+def bench_mode(port, route, size, args, use_async, sendfile):
+    proc = start_server(port, use_async, [] if sendfile else ['--no-sendfile'])
+    try:
+        request(port, route)  # page cache and server warm-up
+        cpu0, t0 = cpu_seconds(proc.pid), time.perf_counter()
+        with ThreadPoolExecutor(args.clients) as pool:
+            results = list(pool.map(lambda _: request(port, route), range(args.rounds)))
+        elapsed = time.perf_counter() - t0
+        cpu = cpu_seconds(proc.pid) - cpu0
+    finally:
+        proc.terminate()
+        proc.wait()
+    served = sum(r[3] for r in results)
+    return {
+        'mode': ('async' if use_async else 'threaded') + (' sendfile' if sendfile else ' copy'),
+        'ok': all(r[2] for r in results) and served == size * args.rounds,
+        'bytes': served,
+        'mb_per_s': round(served / elapsed / 1e6, 1),
+        'server_cpu_s_per_gb': round(cpu / (served / 1e9), 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--size-mb', type=int, default=512)
+    parser.add_argument('--rounds', type=int, default=8)
+    parser.add_argument('--clients', type=int, default=2)
+    parser.add_argument('--port', type=int, default=16083)
+    parser.add_argument('--json', action='store_true', help='machine-readable output')
+    args = parser.parse_args()
+
+    base = tempfile.mkdtemp(prefix='.vesta-bench-', dir='/root')
+    try:
+        path = os.path.join(base, 'download.bin')
+        size = args.size_mb * 1024 * 1024
+        with open(path, 'wb') as f:
+            for _ in range(args.size_mb):
+                f.write(os.urandom(1024 * 1024))
+        route = '/api/download?path=' + urllib.parse.quote(path)
+        results = [bench_mode(args.port, route, size, args, use_async, sendfile)
+                   for use_async in (False, True) for sendfile in (False, True)]
+    finally:
+        shutil.rmtree(base, ignore_errors=True)
+
+    if args.json:
+        print(json.dumps(results))
+        return
+    for r in results:
+        print(f"{r['mode']:>17}: {r['mb_per_s']:8.1f} MB/s  {r['server_cpu_s_per_gb']:6.3f} server CPU-s/GB  "
+              f"{'ok' if r['ok'] else 'FAILED'}")
+
+
+if __name__ == '__main__':
+    main()
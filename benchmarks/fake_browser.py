@@ -0,0 +1,113 @@
+"""Fake browser peer for the browser_mount.py bridge.
+
+Serves (and accepts writes to) one synthetic file from memory over the bridge protocol, the way
+FilesModal.tsx does, so benchmarks can drive BrowserFS without a browser.
+Runs in its own process (see start_peer) to keep it off the bridge's GIL.
+"""
+import asyncio
+import base64
+import json
+import multiprocessing
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'vesta'))
+import browser_mount as bm  # noqa: E402
+
+SEED = 6084
+
+
+def make_file(size):
+    return random.Random(SEED).randbytes(size)
+
+
+def run_peer(port, session, size, binary, ready, latency_ms=0):
+    import websockets
+
+    content = bytearray(make_file(size))
+    delay = latency_ms / 1000.0
+
+    async def answer_json(ws, msg):
+        if msg['method'] == 'GETATTR':
+            reply = {'st_mode': 0o100644, 'st_size': size, 'st_mtime': 0}
+        else:
+            chunk = content[msg['offset']:msg['offset'] + msg['length']]
+            reply = base64.b64encode(chunk).decode('ascii')
+        await ws.send(json.dumps({'id': msg['id'], 'data': reply}))
+
+    async def answer_frame(ws, frame):
+        _, opcode, path_len, request_id, offset, length = bm.FRAME_HEADER.unpack_from(frame)
+        if opcode == bm.OP_WRITE:
+            start = bm.FRAME_HEADER.size + path_len
+            content[offset:offset + length] = frame[start:start + length]
+            header = bm.FRAME_HEADER.pack(bm.FRAME_VERSION, opcode | bm.OP_REPLY, 0, request_id, offset, length)
+            await ws.send(header)
+            return
+        chunk = content[offset:offset + length]
+        header = bm.FRAME_HEADER.pack(bm.FRAME_VERSION, opcode | bm.OP_REPLY, 0, request_id, offset, len(chunk))
+        await ws.send(b''.join((header, chunk)))
+
+    async def answer(ws, message):
+        if delay:
+            await asyncio.sleep(delay)
+        if isinstance(message, bytes):
+            await answer_frame(ws, message)
+        else:
+            await answer_json(ws, json.loads(message))
+
+    async def main():
+        async with websockets.connect(f'ws://127.0.0.1:{port}/?session={session}', max_size=bm.MAX_FRAME_SIZE, compression=None) as ws:
+            if binary:
+                await ws.send(json.dumps({'type': 'HELLO', 'binary': True, 'frameVersion': bm.FRAME_VERSION}))
+            ready.set()
+            async for message in ws:
+                if delay:
+                    # Simulated network latency must not serialise requests
+                    asyncio.ensure_future(answer(ws, message))
+                else:
+                    await answer(ws, message)
+
+    asyncio.run(main())
+
+
+class FakeBrowser:
+    """Context manager running run_peer in a child process.
+
+    The file is exposed as self.path, inside the peer's session directory.
+    """
+    def __init__(self, port, size, binary=True, latency_ms=0, session=None):
+        ctx = multiprocessing.get_context('spawn')
+        self.ready = ctx.Event()
+        self.binary = binary
+        self.session = session or ('bench-binary' if binary else 'bench-json')
+        self.path = f'/{self.session}/bench.bin'
+        self.process = ctx.Process(target=run_peer, args=(port, self.session, size, binary, self.ready, latency_ms),
+                                   daemon=True)
+
+    def __enter__(self):
+        self.process.start()
+        self.ready.wait(30)
+        deadline = time.monotonic() + 10
+        while time.monotonic() < deadline:
+            session = bm.sessions.get(self.session)
+            if session and session.conn and session.binary_frames == self.binary:
+                return self
+            time.sleep(0.01)
+        raise RuntimeError('fake browser did not connect')
+
+    def __exit__(self, *exc):
+        self.process.terminate()
+        self.process.join()
+        while bm.sessions[self.session].conn is not None:
+            time.sleep(0.01)
+
+
+def start_bridge(port):
+    """Run the bridge's WebSocket server on a background thread."""
+    import threading
+    bm.WS_PORT = port
+    threading.Thread(target=bm.run_server_thread, daemon=True).start()
+    bm.logger.setLevel('WARNING')
+    bm.logging.getLogger('websockets').setLevel('WARNING')
@@ -71,7 +71,7 @@ fi
 HOST_DIR=$(pwd)
 # Use array to safely handle paths with spaces if needed
 # We mount the entire 'vesta' folder to /vesta so UI changes in dist are instant
-SWAP_ARGS=(-v "$HOST_DIR/start.sh:/start.sh" -v "$HOST_DIR/usb_manager.py:/usb_manager.py" -v "$HOST_DIR/vesta:/vesta")
+SWAP_ARGS=(-v "$HOST_DIR/start.sh:/start.sh" -v "$HOST_DIR/usb_manager.py:/usb_manager.py" -v "$HOST_DIR/supervisor.py:/supervisor.py" -v "$HOST_DIR/audio_relay.py:/audio_relay.py" -v "$HOST_DIR/vesta:/vesta")
 
 # 4. Run Container
 echo "---------------------------------------------------"
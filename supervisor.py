@@ -0,0 +1,417 @@
+#!/usr/bin/env python3
+"""Starts VestaVNC's services and keeps them running, replacing start.sh's one-by-one launch.
+
+Services that don't need each other start at once; one that does waits only for the
+other's readiness probe (a socket file appearing, a port accepting connections),
+not for fixed sleeps. A service that exits is started again after a backoff that
+doubles with each quick crash. When each service was spawned and became ready is
+logged and kept, with pids and restart counts, in the --status JSON file.
+
+Runs as PID 1 (start.sh execs it), so it also reaps orphaned processes and stops
+every service on SIGTERM.
+"""
+import argparse
+import glob
+import json
+import logging
+import os
+import pwd
+import signal
+import socket
+import stat
+import subprocess
+import threading
+import time
+
+STATUS_FILE = '/run/vesta-services.json'
+PROBE_INTERVAL = 0.05        # Seconds between readiness probes
+READY_TIMEOUT = 30           # Seconds a service may take to become ready before it is restarted
+BACKOFF_MIN = 1.0            # First restart delay; doubled after every crash
+BACKOFF_MAX = 30.0
+BACKOFF_RESET = 60           # Seconds up after which a crash counts as the first again
+STOP_TIMEOUT = 5             # Seconds between SIGTERM and SIGKILL on shutdown
+
+DISPLAY = ':1'
+VNC_PORT = 5901
+VNC_GEOMETRY = '1280x720'
+VNC_DEPTH = 16               # 16-bit keeps Xvnc from starving the desktop of CPU
+NOVNC_PORT = 6080
+AUDIO_PORT = 6082            # audio_relay.py's speaker port; mic is 6081
+USB_PORT = 6083
+MOUNT_PORT = 6084
+PULSE_SOCKETS = ('/var/run/pulse/native', f'/run/user/{os.getuid()}/pulse/native', '/tmp/pulse-*/native')
+
+# Idempotent, so a retry doesn't load the sinks twice; fails until VNC_Speaker exists
+SINKS_SCRIPT = """
+pactl list sinks short | grep -q VNC_Mic ||
+    pactl load-module module-null-sink sink_name=VNC_Mic sink_properties=device.description="VNC_Microphone_Input"
+pactl set-default-source VNC_Mic.monitor
+pactl list sinks short | grep -q VNC_Speaker ||
+    pactl load-module module-null-sink sink_name=VNC_Speaker sink_properties=device.description="VNC_Speaker_Output"
+pactl set-default-sink VNC_Speaker
+pactl set-sink-mute VNC_Speaker 0
+pactl set-sink-volume VNC_Speaker 100%
+pactl list sinks short | grep -q VNC_Speaker
+"""
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+children = set()             # pids of processes started here, which Popen waits for itself
+children_lock = threading.Lock()
+
+def popen(cmd, **kwargs):
+    # Registered before the reaper can see the pid exit
+    with children_lock:
+        proc = subprocess.Popen(cmd, **kwargs)
+        children.add(proc.pid)
+    return proc
+
+def forget(proc):
+    with children_lock:
+        children.discard(proc.pid)
+
+def zombie_children():
+    # Our exited-but-unreaped children, from /proc: waitid(P_ALL) only ever shows the first one
+    me = os.getpid()
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat') as f:
+                stat = f.read()
+        except OSError:
+            continue
+        # The command name may hold spaces and parentheses: fields resume after the last ')'
+        state, ppid = stat.rsplit(')', 1)[1].split()[:2]
+        if state == 'Z' and int(ppid) == me:
+            yield int(entry)
+
+
+# --- Readiness probes ---
+
+def port_open(port):
+    def probe():
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=0.2).close()
+            return True
+        except OSError:
+            return False
+    return probe
+
+def find_socket(patterns):
+    for pattern in patterns:
+        for path in glob.glob(pattern):
+            try:
+                if stat.S_ISSOCK(os.stat(path).st_mode):
+                    return path
+            except OSError:
+                pass
+    return None
+
+def pulse_ready():
+    # Point everything started from here on at the socket, as start.sh's exports did
+    path = find_socket(PULSE_SOCKETS)
+    if path is None:
+        logger.warning("PulseAudio socket not found! Audio will likely fail.")
+        return
+    os.environ['PULSE_SERVER'] = f'unix:{path}'
+    try:
+        os.chmod(path, 0o777)
+    except OSError:
+        pass
+    config = os.path.expanduser('~/.config/pulse')
+    os.makedirs(config, exist_ok=True)
+    with open(os.path.join(config, 'client.conf'), 'w') as f:
+        f.write(f"default-server = {os.environ['PULSE_SERVER']}\n")
+    logger.info(f"PulseAudio socket found at {path}")
+
+
+# --- Services ---
+
+class Service:
+    """One child process, started once the services in `after` are ready.
+
+    ready: probe returning True once the service can be used (None: as soon as it runs).
+    oneshot: a setup command that is done, and ready, when it exits 0. It runs again
+        whenever a service in `after` comes back up, since that one lost its state.
+    before: command run (failures ignored) before every start, to clear leftovers.
+    on_ready: called in the supervisor every time the service becomes ready.
+    log: file for the child's output; otherwise it goes to ours prefixed with [name].
+    """
+
+    def __init__(self, name, cmd, ready=None, after=(), oneshot=False, before=None, on_ready=None, log=None):
+        self.name = name
+        self.cmd = cmd
+        self.probe = ready
+        self.after = after
+        self.oneshot = oneshot
+        self.before = before
+        self.on_ready = on_ready
+        self.log = log
+        self.proc = None
+        self.ready = threading.Event()
+        self.state = 'waiting'
+        self.restarts = 0
+        self.ready_count = 0         # Times it became ready; dependents' oneshots watch it
+        self.last_exit = None
+        self.spawned_at = None       # Seconds after supervisor start, first spawn
+        self.ready_at = None         # Seconds after supervisor start, first time ready
+
+    def spawn(self):
+        if self.before:
+            try:
+                proc = popen(self.before, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+                proc.wait()
+                forget(proc)
+            except OSError:
+                pass
+        if self.log:
+            out = open(self.log, 'ab')
+        else:
+            out = subprocess.PIPE
+        try:
+            # Own process group, so stopping the service also stops what it started
+            self.proc = popen(self.cmd, stdin=subprocess.DEVNULL, stdout=out, stderr=subprocess.STDOUT,
+                              start_new_session=True)
+        finally:
+            if self.log:
+                out.close()
+        if not self.log:
+            threading.Thread(target=self.relay_output, args=(self.proc.stdout,), daemon=True).start()
+
+    def relay_output(self, stream):
+        for line in stream:
+            print(f"[{self.name}] {line.decode(errors='replace').rstrip()}", flush=True)
+
+    def wait_ready(self, stopping):
+        # True once the probe passes; False if the process exits or takes too long first
+        deadline = time.monotonic() + READY_TIMEOUT
+        while not stopping.is_set():
+            if self.proc.poll() is not None:
+                return self.oneshot and self.proc.returncode == 0
+            if self.probe is None or self.probe():
+                return not self.oneshot or self.proc.wait() == 0
+            if time.monotonic() > deadline:
+                logger.warning(f"{self.name} not ready after {READY_TIMEOUT} s, restarting it")
+                self.terminate()
+                return False
+            time.sleep(PROBE_INTERVAL)
+        return False
+
+    def terminate(self):
+        if self.proc is None or self.proc.poll() is not None:
+            return
+        try:
+            os.killpg(self.proc.pid, signal.SIGTERM)
+            self.proc.wait(STOP_TIMEOUT)
+        except subprocess.TimeoutExpired:
+            os.killpg(self.proc.pid, signal.SIGKILL)
+            self.proc.wait()
+        except ProcessLookupError:
+            pass
+
+    def status(self):
+        return {
+            'state': self.state,
+            'pid': self.proc.pid if self.proc and self.proc.poll() is None else None,
+            'after': [s.name for s in self.after],
+            'spawned': self.spawned_at,
+            'ready': self.ready_at,
+            'startup': round(self.ready_at - self.spawned_at, 3) if self.ready_at is not None else None,
+            'restarts': self.restarts,
+            'last_exit': self.last_exit,
+        }
+
+
+class Supervisor:
+    def __init__(self, services, status_file):
+        self.services = services
+        self.status_file = status_file
+        self.stopping = threading.Event()
+        self.started = time.monotonic()
+        self.lock = threading.Lock()
+        self.announced = False
+
+    def elapsed(self):
+        return round(time.monotonic() - self.started, 3)
+
+    def set_state(self, service, state):
+        service.state = state
+        self.write_status()
+
+    def write_status(self):
+        with self.lock:
+            doc = {'uptime': self.elapsed(), 'services': {s.name: s.status() for s in self.services}}
+            tmp = self.status_file + '.tmp'
+            try:
+                with open(tmp, 'w') as f:
+                    json.dump(doc, f, indent=1)
+                os.replace(tmp, self.status_file)
+            except OSError as e:
+                logger.warning(f"Could not write {self.status_file}: {e}")
+
+    def keep_running(self, service):
+        for dep in service.after:
+            while not dep.ready.wait(0.5):
+                if self.stopping.is_set():
+                    return
+        delay = BACKOFF_MIN
+        while not self.stopping.is_set():
+            seen = [dep.ready_count for dep in service.after]
+            try:
+                service.spawn()
+            except OSError as e:
+                logger.error(f"Could not start {service.name}: {e}")
+                service.proc = None
+            else:
+                if service.spawned_at is None:
+                    service.spawned_at = self.elapsed()
+                self.set_state(service, 'starting')
+                up = time.monotonic()
+                if service.wait_ready(self.stopping):
+                    if service.on_ready:
+                        service.on_ready()
+                    service.ready_count += 1
+                    if not service.ready.is_set():
+                        service.ready_at = self.elapsed()
+                        service.ready.set()
+                        logger.info(f"{service.name} ready in {service.ready_at - service.spawned_at:.2f} s "
+                                    f"(+{service.ready_at:.2f} s)")
+                        self.all_ready()
+                    if service.oneshot:
+                        forget(service.proc)
+                        self.set_state(service, 'done')
+                        if not self.rearm(service, seen):
+                            return
+                        delay = BACKOFF_MIN
+                        continue
+                    self.set_state(service, 'running')
+                service.proc.wait()
+                forget(service.proc)
+                if self.stopping.is_set():
+                    return
+                service.last_exit = service.proc.returncode
+                if time.monotonic() - up > BACKOFF_RESET:
+                    delay = BACKOFF_MIN
+            service.restarts += 1
+            self.set_state(service, 'backoff')
+            logger.warning(f"{service.name} exited ({service.last_exit}), restarting in {delay:g} s")
+            self.stopping.wait(delay)
+            delay = min(delay * 2, BACKOFF_MAX)
+
+    def rearm(self, service, seen):
+        # Wait for a dependency to become ready again (restarted PulseAudio has no sinks);
+        # False if there is nothing to wait for or we are stopping
+        if not service.after:
+            return False
+        while not self.stopping.wait(0.5):
+            for dep, count in zip(service.after, seen):
+                if dep.ready_count != count:
+                    logger.info(f"{dep.name} restarted, running {service.name} again")
+                    return True
+        return False
+
+    def all_ready(self):
+        with self.lock:
+            if self.announced or not all(s.ready.is_set() for s in self.services):
+                return
+            self.announced = True
+        width = max(len(s.name) for s in self.services)
+        for s in sorted(self.services, key=lambda s: s.ready_at):
+            logger.info(f"  {s.name:<{width}}  spawned +{s.spawned_at:6.2f} s  ready +{s.ready_at:6.2f} s")
+        logger.info(f"All services ready in {self.elapsed():.2f} s")
+        print("-------------------------------------------------------", flush=True)
+        print(f"READY! Use: http://localhost:{NOVNC_PORT}/", flush=True)
+        print("-------------------------------------------------------", flush=True)
+
+    def reap_orphans(self):
+        # As PID 1 we inherit every orphan; collect those, but leave our own children to Popen
+        with children_lock:
+            try:
+                if os.waitid(os.P_ALL, 0, os.WEXITED | os.WNOHANG | os.WNOWAIT) is None:
+                    return  # Nothing has exited: skip the /proc scan
+            except ChildProcessError:
+                return
+            for pid in zombie_children():
+                if pid in children:
+                    continue
+                try:
+                    os.waitpid(pid, os.WNOHANG)
+                except ChildProcessError:
+                    pass
+
+    def stop(self, *_):
+        self.stopping.set()
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        logger.info(f"Starting {', '.join(s.name for s in self.services)}")
+        self.write_status()
+        threads = [threading.Thread(target=self.keep_running, args=(s,), daemon=True) for s in self.services]
+        for t in threads:
+            t.start()
+        while not self.stopping.wait(1):
+            self.reap_orphans()
+        logger.info("Stopping services")
+        # Dependents first
+        for s in reversed(self.services):
+            s.terminate()
+        for t in threads:
+            t.join(STOP_TIMEOUT)
+        for s in self.services:
+            s.state = 'stopped'
+        self.write_status()
+
+
+def build_services(args):
+    def has_user(name):
+        try:
+            pwd.getpwnam(name)
+            return True
+        except KeyError:
+            return False
+
+    if has_user('pulse'):
+        pulse_cmd = ['pulseaudio', '--system', '--disallow-exit', '--disallow-module-loading=0']
+    else:
+        pulse_cmd = ['pulseaudio', '--exit-idle-time=-1', '--disallow-exit', '--disallow-module-loading=0',
+                     '--system=false', '--realtime=false']
+
+    vnc = Service('vnc', ['vncserver', DISPLAY, '-fg', '-geometry', args.geometry, '-depth', str(VNC_DEPTH),
+                          '-localhost', 'no', '-SecurityTypes', args.security_types],
+                  ready=port_open(VNC_PORT), before=['vncserver', '-kill', DISPLAY])
+    pulse = Service('pulseaudio', pulse_cmd, ready=lambda: find_socket(PULSE_SOCKETS) is not None,
+                    before=['pulseaudio', '-k'], on_ready=pulse_ready)
+    sinks = Service('audio-sinks', ['sh', '-c', SINKS_SCRIPT], after=[pulse], oneshot=True)
+    # One process for both directions: a single capture of VNC_Speaker.monitor fanned out
+    # to every listener on 6082, and browser mic audio into VNC_Mic from 6081. It also
+    # moves each new application stream to VNC_Speaker as PulseAudio announces it
+    audio = Service('audio', ['python3', '/audio_relay.py'], ready=port_open(AUDIO_PORT), after=[sinks])
+    usb = Service('usb_manager', ['python3', '/usb_manager.py', '--async'], ready=port_open(USB_PORT))
+    mount = Service('browser_mount', ['python3', '/browser_mount.py'], ready=port_open(MOUNT_PORT),
+                    log='/var/log/browser_mount.log')
+    # noVNC connects to the VNC server per client, so it can listen before Xvnc does
+    novnc = Service('novnc', ['/vesta/utils/novnc_proxy', '--vnc', f'127.0.0.1:{VNC_PORT}',
+                              '--listen', f'0.0.0.0:{NOVNC_PORT}', '--web', '/vesta'],
+                    ready=port_open(NOVNC_PORT))
+    # WebRTC streamer (disabled):
+    # Service('webrtc', ['python3', '/vesta/webrtc_streamer.py'], log='/var/log/webrtc_streamer.log')
+    services = [vnc, pulse, sinks, audio, usb, mount, novnc]
+    skipped = {s for s in services if s.name in args.skip}
+    for s in services:
+        s.after = [dep for dep in s.after if dep not in skipped]
+    return [s for s in services if s not in skipped]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--security-types', default=os.environ.get('SECURITY_TYPES', 'VncAuth'))
+    parser.add_argument('--geometry', default=VNC_GEOMETRY)
+    parser.add_argument('--status', default=STATUS_FILE, help='JSON file kept up to date with service states')
+    parser.add_argument('--skip', action='append', default=[], metavar='SERVICE',
+                        help="don't run SERVICE (vnc, pulseaudio, audio-sinks, audio, usb_manager, "
+                             "browser_mount, novnc); services waiting on it start without it")
+    args = parser.parse_args()
+    Supervisor(build_services(args), args.status).run()
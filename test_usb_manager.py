@@ -0,0 +1,221 @@
+"""Unit tests for usb_manager.py's request parsing and bookkeeping helpers.
+
+Run from the repository root: python3 -m unittest test_usb_manager
+"""
+import email.utils
+import http.client
+import io
+import json
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import usb_manager as um
+
+
+class Request(um.USBHandler):
+    """A handler with no socket: headers and body in, status and body captured."""
+
+    def __init__(self, headers=None, body=b''):
+        self.headers = http.client.HTTPMessage()
+        for name, value in (headers or {}).items():
+            self.headers[name] = value
+        self.rfile = io.BytesIO(body)
+        self.wfile = io.BytesIO()
+        self.status = None
+        self.close_connection = False
+
+    def send_response(self, code, message=None):
+        self.status = code
+
+    def send_header(self, keyword, value):
+        pass
+
+    def end_headers(self):
+        pass
+
+    def body(self):
+        return json.loads(self.wfile.getvalue())
+
+
+class ParseRangesTest(unittest.TestCase):
+
+    def test_single_range(self):
+        self.assertEqual(um.parse_ranges('bytes=0-99', 1000), [(0, 99)])
+
+    def test_suffix_range(self):
+        self.assertEqual(um.parse_ranges('bytes=-100', 1000), [(900, 999)])
+        # Longer than the file: the whole file
+        self.assertEqual(um.parse_ranges('bytes=-5000', 1000), [(0, 999)])
+
+    def test_open_ended_range(self):
+        self.assertEqual(um.parse_ranges('bytes=990-', 1000), [(990, 999)])
+
+    def test_overlapping_and_adjacent_ranges_merge(self):
+        self.assertEqual(um.parse_ranges('bytes=500-599, 0-99, 50-149, 150-199', 1000),
+                         [(0, 199), (500, 599)])
+        self.assertEqual(um.parse_ranges('bytes=0-10,-990', 1000), [(0, 999)])
+
+    def test_end_past_eof_is_clamped(self):
+        self.assertEqual(um.parse_ranges('bytes=900-5000', 1000), [(900, 999)])
+
+    def test_start_past_eof_is_unsatisfiable(self):
+        self.assertEqual(um.parse_ranges('bytes=1000-1100', 1000), [])
+        self.assertEqual(um.parse_ranges('bytes=-0', 1000), [])
+        # Only the parts that overlap the file survive
+        self.assertEqual(um.parse_ranges('bytes=2000-, 10-19', 1000), [(10, 19)])
+
+    def test_ignored_headers(self):
+        for header in ('items=0-1', 'bytes=', 'bytes=abc', 'bytes=5', 'bytes=-', 'bytes=10-5',
+                       'bytes=' + ','.join(['0-1'] * (um.MAX_RANGES + 1))):
+            self.assertIsNone(um.parse_ranges(header, 1000), header)
+
+
+class IfRangeTest(unittest.TestCase):
+    etag = '"5f3a-3e8"'
+    mtime = 1700000000
+
+    def matches(self, validator):
+        return Request({'If-Range': validator} if validator else None).if_range_matches(self.etag, self.mtime)
+
+    def test_absent_validator_allows_ranges(self):
+        self.assertTrue(self.matches(None))
+
+    def test_matching_etag(self):
+        self.assertTrue(self.matches(self.etag))
+
+    def test_mismatched_etag_sends_whole_file(self):
+        self.assertFalse(self.matches('"other"'))
+
+    def test_weak_etag_never_matches(self):
+        # If-Range compares strongly
+        self.assertFalse(self.matches('W/' + self.etag))
+
+    def test_date_validator(self):
+        self.assertTrue(self.matches(email.utils.formatdate(self.mtime, usegmt=True)))
+        self.assertFalse(self.matches(email.utils.formatdate(self.mtime - 1, usegmt=True)))
+        self.assertFalse(self.matches('not a date'))
+
+
+class UploadRangesTest(unittest.TestCase):
+
+    def setUp(self):
+        folder = tempfile.TemporaryDirectory()
+        self.addCleanup(folder.cleanup)
+        self.upload = um.Upload('test', os.path.join(folder.name, 'file.bin'), 1000)
+        self.addCleanup(self.upload.cancel)
+
+    def add(self, *spans):
+        for start, end in spans:
+            self.upload.add_range(start, end)
+        return self.upload.ranges
+
+    def test_out_of_order_chunks_stay_sorted(self):
+        self.assertEqual(self.add((600, 700), (0, 100), (300, 400)), [[0, 100], [300, 400], [600, 700]])
+
+    def test_adjacent_chunks_merge(self):
+        self.assertEqual(self.add((100, 200), (0, 100), (200, 300)), [[0, 300]])
+
+    def test_overlapping_chunks_merge(self):
+        self.assertEqual(self.add((0, 150), (100, 250), (600, 700), (650, 680)), [[0, 250], [600, 700]])
+        # One span covering several earlier ones
+        self.assertEqual(self.add((50, 800)), [[0, 800]])
+
+    def test_resent_chunk_changes_nothing(self):
+        self.assertEqual(self.add((0, 100), (0, 100)), [[0, 100]])
+
+    def test_empty_range_is_ignored(self):
+        self.assertEqual(self.add((50, 50), (70, 60)), [])
+
+    def test_missing_and_received(self):
+        self.add((900, 1000), (100, 200))
+        self.assertEqual(self.upload.missing(), [[0, 100], [200, 900]])
+        self.assertEqual(self.upload.status()['received'], 200)
+        self.add((0, 100), (200, 900))
+        self.assertEqual(self.upload.missing(), [])
+
+
+
+class DeltaApplyTest(unittest.TestCase):
+    block = 4096
+
+    def setUp(self):
+        folder = tempfile.TemporaryDirectory()
+        self.addCleanup(folder.cleanup)
+        self.folder = folder.name
+        patch = mock.patch.object(um, 'ALLOWED_ROOTS', [self.folder])
+        patch.start()
+        self.addCleanup(patch.stop)
+        # Two full blocks and a short last one
+        self.old = os.urandom(2 * self.block + 1808)
+        self.path = os.path.join(self.folder, 'file.bin')
+        with open(self.path, 'wb') as f:
+            f.write(self.old)
+
+    def ref(self, first, count):
+        return um.DELTA_REF.pack(b'B', first, count)
+
+    def literal(self, data):
+        return um.DELTA_LITERAL.pack(b'L', len(data)) + data
+
+    def apply(self, delta, path=None, block=None):
+        st = os.stat(self.path)
+        base = f'{st.st_size}:{st.st_mtime_ns}:{block or self.block}'
+        request = Request({'Content-Length': str(len(delta))}, delta)
+        request.delta_apply(path or self.path, {'base': [base]})
+        return request
+
+    def contents(self):
+        with open(self.path, 'rb') as f:
+            return f.read()
+
+    def test_short_last_block_is_copied_to_eof(self):
+        request = self.apply(self.literal(b'head') + self.ref(2, 1))
+        self.assertEqual(request.status, 200)
+        self.assertEqual(self.contents(), b'head' + self.old[2 * self.block:])
+        self.assertEqual(request.body()['reused'], 1808)
+
+    def test_reference_running_past_eof_stops_at_eof(self):
+        request = self.apply(self.ref(1, 5) + self.literal(b'tail'))
+        self.assertEqual(request.status, 200)
+        self.assertEqual(self.contents(), self.old[self.block:] + b'tail')
+
+    def test_reference_starting_past_eof_is_rejected(self):
+        request = self.apply(self.ref(3, 1))
+        self.assertEqual(request.status, 400)
+        self.assertEqual(self.contents(), self.old)
+        self.assertEqual(os.listdir(self.folder), ['file.bin'])
+
+    def test_truncated_delta_leaves_file_alone(self):
+        request = self.apply(self.ref(0, 1) + self.literal(b'abcdef')[:-2])
+        self.assertEqual(request.status, 400)
+        self.assertEqual(self.contents(), self.old)
+        self.assertEqual(os.listdir(self.folder), ['file.bin'])
+
+    def test_folder_target_is_rejected(self):
+        folder = os.path.join(self.folder, 'sub')
+        os.mkdir(folder)
+        request = self.apply(self.ref(0, 1), path=folder)
+        self.assertEqual(request.status, 400)
+        self.assertEqual(request.body()['error'], 'Not a regular file')
+
+    def test_missing_target(self):
+        request = self.apply(self.ref(0, 1), path=os.path.join(self.folder, 'gone.bin'))
+        self.assertEqual(request.status, 404)
+
+    def test_block_size_out_of_bounds(self):
+        for block in (um.DELTA_BLOCK_MIN - 1, um.DELTA_BLOCK_MAX + 1):
+            request = self.apply(self.ref(0, 1), block=block)
+            self.assertEqual(request.status, 400)
+        self.assertEqual(self.contents(), self.old)
+
+    def test_changed_file_is_refused(self):
+        request = Request({'Content-Length': '9'}, self.ref(0, 1))
+        request.delta_apply(self.path, {'base': [f'{len(self.old)}:1:{self.block}']})
+        self.assertEqual(request.status, 412)
+        self.assertEqual(self.contents(), self.old)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,43 +1,1955 @@
+import argparse
+import asyncio
+import base64
+import bisect
+import ctypes
+import email.utils
+import errno
+import fcntl
+import gzip
+import hashlib
+import http.client
 import http.server
+import io
 import json
+import math
+import multiprocessing
 import os
+import queue
+import re
 import subprocess
 import urllib.parse
+import select
 import shutil
+import socket
+import sqlite3
+import stat
+import struct
+import sys
+import tarfile
 import threading
 import time
+import zipfile
+import zlib
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, ThreadPoolExecutor, as_completed, wait
+from concurrent.futures import TimeoutError as FuturesTimeout
+from concurrent.futures.process import BrokenProcessPool
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = None  # python3-pil missing: no image thumbnails, PDFs and videos still work
+
+try:
+    import brotli
+except ImportError:
+    brotli = None  # python3-brotli missing: JSON responses are offered gzip only
 
 PORT = 6083
 
+# Downloads
+USE_SENDFILE = True          # Serve file bodies with sendfile(2); --no-sendfile copies through userspace
+COPY_CHUNK = 1024 * 1024     # Read size when copying through userspace
+MAX_RANGES = 32              # Range requests with more parts are answered with the whole file
+
+# Folder / multi-file downloads, streamed as zip or tar
+ARCHIVE_CHUNK = 256 * 1024   # Bytes per HTTP chunk
+ARCHIVE_FORMATS = {'zip': 'application/zip', 'tar': 'application/x-tar', 'tgz': 'application/gzip'}
+# Already compressed: deflating these again costs CPU and saves nothing
+STORED_EXTENSIONS = {
+    '.zip', '.gz', '.tgz', '.bz2', '.xz', '.zst', '.7z', '.rar', '.lz4', '.br',
+    '.jpg', '.jpeg', '.png', '.gif', '.webp', '.avif', '.heic', '.jxl',
+    '.mp3', '.m4a', '.aac', '.ogg', '.opus', '.flac',
+    '.mp4', '.m4v', '.mkv', '.webm', '.mov', '.avi',
+    '.docx', '.xlsx', '.pptx', '.odt', '.ods', '.odp', '.epub', '.jar', '.apk', '.whl', '.deb', '.rpm',
+}
+
+# Directory listings
+DIR_CACHE_DIRS = 64          # Listings kept in memory (and inotify watches held)
+DIR_CACHE_TTL = 10           # Seconds an mtime-checked listing is trusted; file sizes change without the dir mtime
+MTIME_SLACK = 2              # A dir modified this close to its scan may change again within the same mtime tick
+LIST_PAGE_MAX = 5000
+# Local filesystems whose changes inotify reliably reports; 9p/drvfs/FUSE/network mounts get mtime checks
+INOTIFY_FSTYPES = {'ext2', 'ext3', 'ext4', 'xfs', 'btrfs', 'f2fs', 'zfs', 'tmpfs', 'overlay',
+                   'vfat', 'exfat', 'ntfs3'}
+
+# Polled JSON (/api/usbs, /api/files, /api/list_usb_devices, /api/settings)
+JSON_COMPRESS_MIN = 1024     # Bytes; smaller bodies are sent as they are
+JSON_GZIP_LEVEL = 6
+JSON_BROTLI_QUALITY = 5      # Smaller than gzip -6 on JSON at about the same CPU; 11 is many times slower
+JSON_CACHE_BYTES = 16 << 20  # Compressed bodies kept by ETag and encoding, least recently used dropped first
+
+# Block devices
+DEVICE_RESYNC = 30           # Seconds between full rescans, for containers where no event source fires
+DEVICE_SETTLE = 0.2          # Seconds to let a burst of hotplug/mount events settle before rescanning
+DEVICE_FEED_MAX = 256        # Changes kept for /api/devices?since=
+
+# Search index (/api/search)
+SEARCH_DB = '/var/lib/vesta/search.db'  # Outside the indexed roots, kept across restarts
+SEARCH_RESCAN = 600          # Seconds between full mtime-diff passes over every root
+SEARCH_SETTLE = 1            # Seconds to gather change hints before rescanning those folders
+SEARCH_BATCH = 200           # Folders written per transaction while crawling
+SEARCH_LIMIT = 500           # Default and maximum results per query
+SEARCH_LIMIT_MAX = 5000
+SEARCH_MODES = ('substring', 'prefix', 'glob')
+
+# Thumbnails (/api/thumbs)
+THUMB_CACHE_DIR = '/var/lib/vesta/thumbs'
+THUMB_CACHE_BYTES = 256 << 20  # Disk budget; least recently used thumbnails go first
+THUMB_WORKERS = 2            # Processes making cold thumbnails, at SCHED_IDLE priority
+THUMB_SIZE = 128             # Default longest side in pixels
+THUMB_SIZE_MAX = 512
+THUMB_QUALITY = 80
+THUMB_TIMEOUT = 20           # Seconds pdftoppm/ffmpeg may take for one file
+THUMB_WAIT = 60              # Seconds a request waits for queued thumbnails before giving up on them
+THUMB_BATCH_MAX = 500        # Paths per /api/thumbs request
+THUMB_IMAGE_TYPES = {'.jpg', '.jpeg', '.png', '.gif', '.webp', '.bmp', '.tif', '.tiff', '.ico'}
+THUMB_VIDEO_TYPES = {'.mp4', '.m4v', '.mkv', '.webm', '.mov', '.avi', '.wmv', '.mpg', '.mpeg', '.3gp'}
+
+# Event stream (/api/events)
+EVENT_BACKLOG = 1024         # Events kept for clients resuming with Last-Event-ID
+EVENT_KEEPALIVE = 15         # Seconds between SSE comments, so dead clients and idle proxies are noticed
+EVENT_POLL_TIMEOUT = 25      # Longest a /api/events/poll request is held open
+EVENT_MAX_SUBSCRIBERS = 1000
+UPLOAD_PROGRESS_INTERVAL = 0.5  # Seconds between progress events per upload
+
+# Resumable uploads
+UPLOAD_PREFIX = '.vesta-upload-'  # Temp file name, next to the target so completion is a rename
+UPLOAD_CHUNK = 8 << 20       # Chunk size suggested to clients
+UPLOAD_PARALLEL = 4          # Concurrent chunk requests suggested to clients
+UPLOAD_TTL = 6 * 3600        # Seconds an untouched partial upload is kept
+UPLOAD_GC_INTERVAL = 300
+
+# Delta uploads (/api/delta): re-sending an edited file as references to the blocks
+# the server already has plus the bytes that changed, as rsync does
+DELTA_BLOCK_MIN = 2048       # Block size is about sqrt(file size), kept within these bounds
+DELTA_BLOCK_MAX = 256 << 10
+DELTA_STRONG = 16            # Bytes of SHA-256 kept per block (WebCrypto has no cheaper strong hash)
+DELTA_CACHE_BYTES = 64 << 20 # Signatures kept by (path, size, mtime, block), least recently used dropped first
+DELTA_LITERAL_MAX = 64 << 20 # Largest literal run in one instruction; clients split longer ones
+
+# Copy / move jobs (/api/jobs, /api/import)
+JOB_WORKERS = 4              # Jobs copying at once
+JOB_PER_DEVICE = 2           # Of those, at most this many reading from any one source device
+JOB_CHUNK = 64 << 20         # Bytes per copy_file_range call; progress and cancel are checked in between
+JOB_BUFFER = 8 << 20         # Read size when copying through userspace
+JOB_KEEP = 100               # Finished jobs still listed by /api/jobs
+FICLONE = 0x40049409         # ioctl sharing the source's extents (btrfs, xfs/bcachefs with reflink)
+
+# Batched API calls (/api/batch)
+BATCH_MAX_OPS = 200          # Operations per request
+BATCH_WORKERS = 8            # Operations running at once, shared by every batch in flight
+BATCH_OPS = ('list', 'stat', 'mkdir', 'delete', 'import', 'drives', 'devices', 'settings')
+BATCH_WRITES = ('mkdir', 'delete', 'import')  # Run after earlier operations on overlapping paths
+
+# Asyncio server mode (--async)
+ASYNC_WORKERS = 16           # Threads running blocking route handlers
+STREAM_CHUNK = 64 * 1024     # Response bytes buffered before a write is pushed to the loop
+DRAIN_BYTES = 1024 * 1024    # Queued response bytes before the handler waits for the socket
+HEADER_TIMEOUT = 30          # Seconds a client may take to send its request headers
+IO_TIMEOUT = 60              # Seconds a body read or write may stall before giving up
+SENDFILE_CHUNK = 16 << 20    # Bytes per loop.sendfile call
+SENDFILE_MIN_RATE = 16 << 10 # Bytes/s below which a sendfile download counts as stalled
+
+# Metrics (/metrics, Prometheus text format) and the access log
+METRIC_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)  # Seconds
+ACCESS_LOG_SAMPLE = 20       # One in this many fast, successful requests is logged; the rest are only counted
+ACCESS_LOG_SLOW = 1.0        # Seconds; slower requests and errors are always logged
+ACCESS_LOG_QUEUE = 10000     # Lines waiting for the writer thread; beyond this they are dropped (and counted)
+
 # Global Settings
+ALLOWED_ROOTS = ['/root', '/media', '/.host_raw', '/host_mnt', '/mnt/browser']
+
 SETTINGS = {
     'usb_passthrough': False,  # Deprecated in favor of MOUNTED_PATHS
     'auto_mount': False,       # Disabled by default
     'password_enabled': False  # Password protection status
 }
 MOUNTED_PATHS = set()
+CORS_HEADERS = [
+    ('Access-Control-Allow-Origin', '*'),
+    ('Access-Control-Allow-Methods', 'GET, POST, OPTIONS'),
+    ('Access-Control-Allow-Headers', 'X-Requested-With, Content-Type, X-File-Name, Range, If-Range, If-None-Match, If-Modified-Since, Last-Event-ID'),
+    ('Access-Control-Expose-Headers', 'Accept-Ranges, Content-Range, Content-Length, ETag, Last-Modified'),
+    ('Access-Control-Allow-Private-Network', 'true'),
+]
+UPLOADS = {}                 # upload id -> Upload
+UPLOADS_LOCK = threading.Lock()
 
 # Helper to set system password
 def set_system_password(password):
     try:
         # 1. Update VNC Password
         # pipe password to vncpasswd
-        p1 = subprocess.Popen(['vncpasswd', '-f'], stdin=subprocess.PIPE, stdout=open(os.path.expanduser('~/.vnc/passwd'), 'wb'))
-        p1.communicate(input=password.encode())
+        with METRICS.timer('vesta_subprocess_duration_seconds', cmd='vncpasswd'):
+            p1 = subprocess.Popen(['vncpasswd', '-f'], stdin=subprocess.PIPE, stdout=open(os.path.expanduser('~/.vnc/passwd'), 'wb'))
+            p1.communicate(input=password.encode())
         
         # 2. Update System Root Password
         # echo "root:password" | chpasswd
-        p2 = subprocess.Popen(['chpasswd'], stdin=subprocess.PIPE)
-        p2.communicate(input=f"root:{password}".encode())
+        with METRICS.timer('vesta_subprocess_duration_seconds', cmd='chpasswd'):
+            p2 = subprocess.Popen(['chpasswd'], stdin=subprocess.PIPE)
+            p2.communicate(input=f"root:{password}".encode())
         return True
     except Exception as e:
         print(f"Password update failed: {e}", flush=True)
         return False
 
+def parse_ranges(header, size):
+    """Byte ranges of a Range header as sorted, merged [(first, last)] pairs.
+
+    Returns None if the header should be ignored (not bytes, malformed or too
+    many parts) and [] if none of the ranges overlap the file.
+    """
+    unit, _, spec = header.partition('=')
+    if unit.strip().lower() != 'bytes' or not spec.strip():
+        return None
+    parts = [p.strip() for p in spec.split(',') if p.strip()]
+    if len(parts) > MAX_RANGES:
+        return None
+    ranges = []
+    for part in parts:
+        first, sep, last = part.partition('-')
+        first, last = first.strip(), last.strip()
+        if not sep or not (first or last) or not (first or '0').isdigit() or not (last or '0').isdigit():
+            return None
+        if not first:
+            # Suffix range: the last N bytes
+            start, end = max(0, size - int(last)), size - 1
+        else:
+            start = int(first)
+            end = min(int(last), size - 1) if last else size - 1
+            if last and int(last) < start:
+                return None
+        if start <= end:
+            ranges.append((start, end))
+    ranges.sort()
+    merged = []
+    for start, end in ranges:
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+class ChunkedWriter:
+    """Write-only stream for zipfile/tarfile that frames output as HTTP/1.1 chunks
+    (or passes it through for HTTP/1.0 clients). Writes block on the socket, so a
+    slow client slows archive generation instead of growing a buffer."""
+
+    def __init__(self, raw, chunked):
+        self.raw = raw
+        self.chunked = chunked
+        self.buffer = bytearray()
+        self.sent = 0            # Body bytes handed to the socket, framing excluded
+
+    def write(self, data):
+        self.buffer += data
+        if len(self.buffer) >= ARCHIVE_CHUNK:
+            self.flush()
+        return len(data)
+
+    def flush(self):
+        if self.buffer:
+            if self.chunked:
+                self.raw.write(b'%x\r\n' % len(self.buffer) + self.buffer + b'\r\n')
+            else:
+                self.raw.write(self.buffer)
+            self.sent += len(self.buffer)
+            self.buffer.clear()
+
+    def close(self):
+        self.flush()
+        if self.chunked:
+            self.raw.write(b'0\r\n\r\n')
+
+def archive_members(roots):
+    # (path, name in the archive) for every dir and file under roots, each root keeping
+    # its own name. Symlinked directories are not descended into, so loops can't recur.
+    for root in roots:
+        base = os.path.dirname(root.rstrip('/')) or '/'
+        if not os.path.isdir(root):
+            yield root, os.path.relpath(root, base)
+            continue
+        for dirpath, dirnames, filenames in os.walk(root):
+            dirnames.sort()
+            yield dirpath, os.path.relpath(dirpath, base)
+            for name in sorted(filenames):
+                if not name.startswith(UPLOAD_PREFIX):
+                    path = os.path.join(dirpath, name)
+                    yield path, os.path.relpath(path, base)
+
+def write_zip(out, roots, compress):
+    with zipfile.ZipFile(out, 'w') as zf:
+        for path, arcname in archive_members(roots):
+            try:
+                info = zipfile.ZipInfo.from_file(path, arcname)
+                if info.is_dir():
+                    zf.writestr(info, b'')
+                    continue
+                stored = not compress or os.path.splitext(path)[1].lower() in STORED_EXTENSIONS
+                info.compress_type = zipfile.ZIP_STORED if stored else zipfile.ZIP_DEFLATED
+                f = open(path, 'rb')
+            except OSError as e:
+                print(f"[Archive] Skipping {path}: {e}", flush=True)
+                continue
+            with f, zf.open(info, 'w') as dest:
+                while True:
+                    chunk = f.read(COPY_CHUNK)
+                    if not chunk: break
+                    dest.write(chunk)
+
+def write_tar(out, roots, gzip):
+    # Stream mode ('w|') never seeks, so nothing is staged; tgz compresses the whole stream
+    with tarfile.open(fileobj=out, mode='w|gz' if gzip else 'w|') as tar:
+        for path, arcname in archive_members(roots):
+            try:
+                info = tar.gettarinfo(path, arcname)
+                if info.isreg():
+                    with open(path, 'rb') as f:
+                        tar.addfile(info, f)
+                else:
+                    tar.addfile(info)
+            except OSError as e:
+                print(f"[Archive] Skipping {path}: {e}", flush=True)
+
+def etag_in(header, etag, weak=True):
+    # If-None-Match compares weakly, If-Range strongly
+    tags = [t.strip() for t in header.split(',')]
+    if weak:
+        tags = [t[2:] if t.startswith('W/') else t for t in tags]
+    return '*' in tags or etag in tags
+
+def http_date(header):
+    try:
+        return email.utils.parsedate_to_datetime(header).timestamp()
+    except (TypeError, ValueError, IndexError, OverflowError):
+        return None
+
+def json_body(data):
+    # The body and its ETag, a hash of the bytes: unchanged data revalidates as unchanged
+    # whichever worker or restart built it. Weak, since gzip and br bodies share the tag
+    body = json.dumps(data).encode()
+    return body, 'W/"%s"' % hashlib.blake2b(body, digest_size=16).hexdigest()
+
+def accept_encoding(header):
+    # br or gzip, whichever the client weights higher (br on a tie), or None for identity
+    weights = {}
+    for part in (header or '').split(','):
+        name, _, params = part.partition(';')
+        q = 1.0
+        for param in params.split(';'):
+            key, _, value = param.strip().partition('=')
+            if key == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        weights[name.strip().lower()] = q
+    offered = ('br', 'gzip') if brotli else ('gzip',)
+    best = max(offered, key=lambda e: weights.get(e, weights.get('*', 0)))
+    return best if weights.get(best, weights.get('*', 0)) > 0 else None
+
+class EncodedCache:
+    """Compressed JSON bodies by (ETag, encoding). Clients polling the same folder or
+    device list share one compression per change instead of paying for one per request."""
+
+    def __init__(self, max_bytes=JSON_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.bodies = OrderedDict()  # (etag, encoding) -> bytes, least recently used first
+        self.total = 0
+        self.lock = threading.Lock()
+        self.hits = self.misses = 0
+
+    def get(self, etag, encoding, body):
+        key = (etag, encoding)
+        with self.lock:
+            encoded = self.bodies.get(key)
+            if encoded is not None:
+                self.bodies.move_to_end(key)
+                self.hits += 1
+                return encoded
+            self.misses += 1
+        if encoding == 'br':
+            encoded = brotli.compress(body, quality=JSON_BROTLI_QUALITY)
+        else:
+            encoded = gzip.compress(body, JSON_GZIP_LEVEL, mtime=0)
+        with self.lock:
+            if key not in self.bodies and len(encoded) <= self.max_bytes:
+                self.bodies[key] = encoded
+                self.total += len(encoded)
+                while self.total > self.max_bytes:
+                    _, old = self.bodies.popitem(last=False)
+                    self.total -= len(old)
+        return encoded
+
+JSON_CACHE = EncodedCache()
+
+def metric_labels(labels):
+    if not labels:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in labels)
+    return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(labels, escaped)) + '}'
+
+class Metrics:
+    """Counters, gauges and latency histograms for /metrics, in the Prometheus text format.
+    Recording is one dict update under a lock. Numbers the server keeps anyway (cache
+    hits, queue lengths) are read by collectors when /metrics is scraped, not pushed."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.values = {}         # (name, labels) -> counter or gauge value
+        self.types = {}          # name -> 'counter' | 'gauge'
+        self.histograms = {}     # (name, labels) -> [count per bucket..., +Inf, sum, count]
+        self.collectors = []     # callables returning [(name, type, {labels}, value)]
+
+    def add(self, name, value, kind, labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.types[name] = kind
+            self.values[key] = self.values.get(key, 0) + value
+
+    def inc(self, name, value=1, **labels):
+        self.add(name, value, 'counter', labels)
+
+    def gauge(self, name, delta, **labels):
+        self.add(name, delta, 'gauge', labels)
+
+    def observe(self, name, seconds, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        bucket = bisect.bisect_left(METRIC_BUCKETS, seconds)
+        with self.lock:
+            h = self.histograms.get(key)
+            if h is None:
+                h = self.histograms[key] = [0] * (len(METRIC_BUCKETS) + 3)
+            h[bucket] += 1
+            h[-2] += seconds
+            h[-1] += 1
+
+    @contextmanager
+    def timer(self, name, **labels):
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(name, time.monotonic() - start, **labels)
+
+    def render(self):
+        families = {}            # name -> (type, [(suffix, labels, value)])
+        with self.lock:
+            for (name, labels), value in self.values.items():
+                families.setdefault(name, (self.types[name], []))[1].append(('', labels, value))
+            for (name, labels), h in self.histograms.items():
+                rows = families.setdefault(name, ('histogram', []))[1]
+                total = 0
+                for le, n in zip(METRIC_BUCKETS + ('+Inf',), h):
+                    total += n
+                    rows.append(('_bucket', labels + (('le', le),), total))
+                rows.append(('_sum', labels, round(h[-2], 6)))
+                rows.append(('_count', labels, h[-1]))
+        for collect in self.collectors:
+            for name, kind, labels, value in collect():
+                families.setdefault(name, (kind, []))[1].append(('', tuple(sorted(labels.items())), value))
+        lines = []
+        for name in sorted(families):
+            kind, rows = families[name]
+            lines.append(f'# TYPE {name} {kind}')
+            lines.extend(f'{name}{suffix}{metric_labels(labels)} {value}' for suffix, labels, value in rows)
+        return '\n'.join(lines) + '\n'
+
+METRICS = Metrics()
+
+class AccessLog:
+    """One JSON line per request, written by a background thread so a handler never
+    waits on stdout. Fast successful requests are sampled one in ACCESS_LOG_SAMPLE
+    (their lines carry "sample" so counts can be scaled back up); errors and requests
+    slower than ACCESS_LOG_SLOW are always written."""
+
+    def __init__(self):
+        self.queue = queue.Queue(ACCESS_LOG_QUEUE)
+        self.seen = 0
+        self.dropped = 0
+
+    def start(self):
+        threading.Thread(target=self.run, daemon=True).start()
+
+    def request(self, record):
+        if record['status'] < 400 and record['ms'] < ACCESS_LOG_SLOW * 1000:
+            self.seen += 1       # Racy across threads, which only shifts which request is sampled
+            if self.seen % ACCESS_LOG_SAMPLE:
+                return
+            record['sample'] = ACCESS_LOG_SAMPLE
+        self.put(record)
+
+    def put(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def run(self):
+        while True:
+            lines = [json.dumps(self.queue.get())]
+            while len(lines) < 1000:
+                try:
+                    lines.append(json.dumps(self.queue.get_nowait()))
+                except queue.Empty:
+                    break
+            sys.stdout.write('\n'.join(lines) + '\n')
+            sys.stdout.flush()
+
+ACCESS_LOG = AccessLog()
+
+class EventBus:
+    """Typed events numbered by a sequence, with a backlog so a client that reconnects
+    with its last id gets only what it missed. Publishers may be on any thread; asyncio
+    subscribers wait on a future rather than holding a thread."""
+
+    def __init__(self, backlog=EVENT_BACKLOG):
+        self.cond = threading.Condition()
+        self.events = deque(maxlen=backlog)   # (seq, type, data)
+        self.seq = int(time.time() * 1000)    # Clock-seeded, so ids from before a restart read as too old
+        self.loop = None                      # Set by the asyncio server
+        self.waiters = set()                  # Futures on self.loop
+        self.subscribers = 0
+
+    def publish(self, event_type, **data):
+        with self.cond:
+            self.seq += 1
+            self.events.append((self.seq, event_type, data))
+            self.cond.notify_all()
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self._wake)
+
+    def _wake(self):
+        waiters, self.waiters = self.waiters, set()
+        for fut in waiters:
+            if not fut.done():
+                fut.set_result(None)
+
+    def since(self, seq):
+        # (latest seq, events after seq); events is None if seq is unknown or older than the backlog
+        with self.cond:
+            if seq == self.seq:
+                return self.seq, []
+            if seq is None or seq > self.seq or not self.events or self.events[0][0] > seq + 1:
+                return self.seq, None
+            return self.seq, [e for e in self.events if e[0] > seq]
+
+    def subscribe(self):
+        with self.cond:
+            if self.subscribers >= EVENT_MAX_SUBSCRIBERS:
+                return False
+            self.subscribers += 1
+            return True
+
+    def unsubscribe(self):
+        with self.cond:
+            self.subscribers -= 1
+
+    def wait(self, seq, timeout):
+        with self.cond:
+            self.cond.wait_for(lambda: self.seq != seq, timeout)
+
+    async def wait_async(self, seq, timeout):
+        if self.seq != seq:
+            return
+        fut = asyncio.get_running_loop().create_future()
+        self.waiters.add(fut)
+        try:
+            await asyncio.wait_for(fut, timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            self.waiters.discard(fut)
+
+EVENTS = EventBus()
+
+def parse_event_id(value):
+    # Resume token from Last-Event-ID or ?since=; garbage reads as too old, which gets a reset
+    if value is None:
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        return -1
+
+def sse_events(events):
+    return ''.join(f"id: {seq}\nevent: {event_type}\ndata: {json.dumps(data)}\n\n"
+                   for seq, event_type, data in events).encode()
+
+def sse_start(since):
+    # Opening bytes of a stream: reconnect delay, then what the client missed, or
+    # "ready" for a fresh subscriber and "reset" when the gap can't be filled
+    latest, events = EVENTS.since(since)
+    head = b'retry: 2000\n\n'
+    if since is None:
+        return latest, head + sse_events([(latest, 'ready', {})])
+    if events is None:
+        return latest, head + sse_events([(latest, 'reset', {})])
+    return latest, head + sse_events(events)
+
+def sse_next(seq):
+    latest, events = EVENTS.since(seq)
+    if events is None:
+        # Fell behind the backlog (very slow reader): start over
+        return latest, sse_events([(latest, 'reset', {})])
+    if not events:
+        return latest, b': keepalive\n\n'
+    return latest, sse_events(events)
+
+def poll_result(since):
+    latest, events = EVENTS.since(since)
+    if since is not None and events is None:
+        return {'seq': latest, 'reset': True}
+    return {'seq': latest, 'events': [{'id': i, 'type': t, 'data': d} for i, t, d in events or []]}
+
+def dir_changed(path):
+    SEARCH.touch(path)
+    # For writes of our own: inotify sees them on local disks, nothing does on 9p/FUSE
+    DIR_CACHE.invalidate(path)
+    EVENTS.publish('dir', path=path)
+
+class Upload:
+    """A resumable upload: chunks are written at their offsets into a temp file next to dest."""
+
+    def __init__(self, upload_id, dest, size, sha256=None):
+        self.id = upload_id
+        self.dest = dest
+        self.size = size
+        self.sha256 = sha256
+        self.temp = os.path.join(os.path.dirname(dest), UPLOAD_PREFIX + upload_id)
+        self.ranges = []         # Sorted, disjoint [start, end) spans already written
+        self.writers = 0         # Chunk requests in progress
+        self.finished = False
+        self.touched = time.time()
+        self.reported = 0        # When progress was last published
+        self.lock = threading.Lock()
+        self.fd = os.open(self.temp, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
+        # Sized up front so chunks can land anywhere. Sparse on purpose: posix_fallocate
+        # falls back to writing zeros on vfat/FUSE, free space is checked by the caller.
+        os.ftruncate(self.fd, size)
+
+    def add_range(self, start, end):
+        if start >= end:
+            return
+        spans = sorted(self.ranges + [[start, end]])
+        merged = [spans[0]]
+        for s, e in spans[1:]:
+            if s <= merged[-1][1]:
+                merged[-1][1] = max(merged[-1][1], e)
+            else:
+                merged.append([s, e])
+        self.ranges = merged
+
+    def missing(self):
+        gaps, pos = [], 0
+        for s, e in self.ranges:
+            if s > pos:
+                gaps.append([pos, s])
+            pos = e
+        if pos < self.size:
+            gaps.append([pos, self.size])
+        return gaps
+
+    def status(self):
+        return {
+            'id': self.id,
+            'name': os.path.basename(self.dest),
+            'size': self.size,
+            'received': sum(e - s for s, e in self.ranges),
+            'ranges': self.ranges,
+            'missing': self.missing(),
+        }
+
+    def cancel(self):
+        # Stop taking chunks; the fd goes once the last in-flight chunk has finished with it
+        with self.lock:
+            self.finished = True
+            idle = not self.writers
+        if idle:
+            self.discard()
+
+    def publish(self, state):
+        with self.lock:
+            received = sum(e - s for s, e in self.ranges)
+            self.reported = time.time()
+        EVENTS.publish('upload', id=self.id, name=os.path.basename(self.dest), path=os.path.dirname(self.dest),
+                       size=self.size, received=received, state=state)
+
+    def discard(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+        try:
+            os.unlink(self.temp)
+        except OSError: pass
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(COPY_CHUNK)
+            if not chunk: break
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def gc_uploads():
+    # Partial uploads nobody has touched for UPLOAD_TTL are abandoned
+    while True:
+        time.sleep(UPLOAD_GC_INTERVAL)
+        cutoff = time.time() - UPLOAD_TTL
+        with UPLOADS_LOCK:
+            stale = [u for u in UPLOADS.values() if u.touched < cutoff and not u.writers]
+            for upload in stale:
+                del UPLOADS[upload.id]
+        for upload in stale:
+            print(f"[Upload] Discarding stale upload {upload.id} ({upload.dest})", flush=True)
+            upload.cancel()
+            upload.publish('expired')
+
+def delta_block(size):
+    # rsync's choice: about sqrt(size), so a 2 GB file has ~46k blocks and a 20 B signature each
+    return min(max(-(-math.isqrt(size) // 1024) * 1024, DELTA_BLOCK_MIN), DELTA_BLOCK_MAX)
+
+DELTA_HEADER = struct.Struct('>QQI')            # size, mtime_ns, block size
+DELTA_RECORD = struct.Struct(f'>I{DELTA_STRONG}s')  # adler32, SHA-256 prefix
+DELTA_REF = struct.Struct('>cII')               # b'B', first block, block count
+DELTA_LITERAL = struct.Struct('>cI')            # b'L', length; the bytes follow
+
+class SignatureCache:
+    """Block signatures of files under /api/delta, by (path, size, mtime_ns, block).
+    A file re-uploaded several times is only read and hashed once per version."""
+
+    def __init__(self, max_bytes=DELTA_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.signatures = OrderedDict()
+        self.total = 0
+        self.lock = threading.Lock()
+        self.hits = self.misses = 0
+
+    def get(self, key):
+        with self.lock:
+            sig = self.signatures.get(key)
+            if sig is None:
+                self.misses += 1
+                return None
+            self.signatures.move_to_end(key)
+            self.hits += 1
+            return sig
+
+    def put(self, key, sig):
+        with self.lock:
+            if key in self.signatures or len(sig) > self.max_bytes:
+                return
+            self.signatures[key] = sig
+            self.total += len(sig)
+            while self.total > self.max_bytes:
+                _, old = self.signatures.popitem(last=False)
+                self.total -= len(old)
+
+SIGNATURES = SignatureCache()
+
+def copy_range(src, dst, offset, count):
+    # Bytes src[offset:offset+count] appended to dst: in the kernel where the
+    # filesystems allow it (a reflink on btrfs/xfs), through userspace otherwise
+    if hasattr(os, 'copy_file_range'):
+        try:
+            while count:
+                n = os.copy_file_range(src, dst, count, offset)
+                if not n:
+                    return
+                offset += n
+                count -= n
+            return
+        except OSError as e:
+            if e.errno not in (errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP,
+                               errno.ENOTSUP, errno.EBADF, errno.EIO):
+                raise
+    while count:
+        chunk = os.pread(src, min(count, COPY_CHUNK), offset)
+        if not chunk:
+            return
+        os.write(dst, chunk)
+        offset += len(chunk)
+        count -= len(chunk)
+
+class JobCancelled(Exception):
+    pass
+
+def unique_target(dest_dir, name, overwrite):
+    # "name (1).ext", "name (2).ext", ... unless the job replaces existing files
+    target = os.path.join(dest_dir, name)
+    if overwrite or not os.path.lexists(target):
+        return target
+    stem, ext = os.path.splitext(name)
+    for i in range(1, 10000):
+        target = os.path.join(dest_dir, f'{stem} ({i}){ext}')
+        if not os.path.lexists(target):
+            return target
+    raise FileExistsError(f"No free name for {name} in {dest_dir}")
+
+def tree_size(path):
+    # (bytes, files) under path; symlinks count as files but not bytes, they aren't followed
+    def size(p):
+        st = os.lstat(p)
+        return st.st_size if stat.S_ISREG(st.st_mode) else 0
+    if not os.path.isdir(path) or os.path.islink(path):
+        return size(path), 1
+    total = files = 0
+    for dirpath, _, filenames in os.walk(path):
+        for name in filenames:
+            try:
+                total += size(os.path.join(dirpath, name))
+                files += 1
+            except OSError: pass
+    return total, files
+
+class Job:
+    """Copy or move of files/folders into a folder. Data moves by rename, reflink or
+    copy_file_range where the filesystems allow it, through a userspace buffer otherwise."""
+
+    def __init__(self, job_id, op, sources, dest, overwrite=False, make_dest=False):
+        self.id = job_id
+        self.op = op
+        self.sources = sources
+        self.dest = dest
+        self.overwrite = overwrite
+        self.make_dest = make_dest  # Create dest when the job runs (imports into the Desktop)
+        self.device = os.stat(sources[0]).st_dev   # Scheduling key: the device being read
+        self.state = 'queued'
+        self.error = None
+        self.current = None
+        self.method = None       # How the latest file was copied
+        self.total = self.copied = 0
+        self.files = self.files_done = 0
+        self.created = time.time()
+        self.started = self.finished = None
+        self.reported = 0        # When progress was last published
+        self.cancelled = threading.Event()
+
+    def status(self):
+        elapsed = ((self.finished or time.time()) - self.started) if self.started else 0
+        rate = int(self.copied / elapsed) if elapsed > 0 else 0
+        return {
+            'id': self.id,
+            'op': self.op,
+            'sources': self.sources,
+            'dest': self.dest,
+            'state': self.state,
+            'error': self.error,
+            'current': self.current,
+            'method': self.method,
+            'total': self.total,
+            'copied': self.copied,
+            'files': self.files,
+            'filesDone': self.files_done,
+            'rate': rate,
+            'eta': round((self.total - self.copied) / rate, 1) if rate and self.state == 'running' else None,
+            'created': self.created,
+            'started': self.started,
+            'finished': self.finished,
+        }
+
+    def publish(self, force=False):
+        now = time.time()
+        if force or now - self.reported >= UPLOAD_PROGRESS_INTERVAL:
+            self.reported = now
+            EVENTS.publish('job', **self.status())
+
+    def advance(self, n):
+        self.copied += n
+        self.publish()
+        if self.cancelled.is_set():
+            raise JobCancelled()
+
+    def run(self):
+        self.state, self.started = 'running', time.time()
+        self.publish(True)
+        touched = {self.dest}
+        try:
+            if self.make_dest:
+                os.makedirs(self.dest, exist_ok=True)
+            dest_dev = os.stat(self.dest).st_dev
+            plan = []
+            for src in self.sources:
+                target = unique_target(self.dest, os.path.basename(src), self.overwrite)
+                # Moves within one filesystem are a rename: nothing to copy or count
+                rename = self.op == 'move' and os.lstat(src).st_dev == dest_dev
+                if not rename:
+                    size, files = tree_size(src)
+                    self.total += size
+                    self.files += files
+                plan.append((src, target, rename))
+            self.publish(True)
+            for src, target, rename in plan:
+                if self.cancelled.is_set():
+                    raise JobCancelled()
+                touched.add(os.path.dirname(src))
+                if rename:
+                    try:
+                        os.replace(src, target)
+                        self.method = 'rename'
+                        continue
+                    except OSError as e:
+                        # A folder onto a non-empty one: merge by copying
+                        if e.errno not in (errno.ENOTEMPTY, errno.EEXIST, errno.EISDIR, errno.ENOTDIR, errno.EXDEV):
+                            raise
+                        size, files = tree_size(src)
+                        self.total += size
+                        self.files += files
+                created = not os.path.lexists(target)
+                try:
+                    self.copy_tree(src, target)
+                except BaseException:
+                    # Don't leave half a folder behind; a merge into an existing one stays as is
+                    if created and os.path.isdir(target) and not os.path.islink(target):
+                        shutil.rmtree(target, ignore_errors=True)
+                    raise
+                if self.op == 'move':
+                    if os.path.isdir(src) and not os.path.islink(src):
+                        shutil.rmtree(src)
+                    else:
+                        os.unlink(src)
+                dir_changed(self.dest)
+            self.state = 'done'
+        except JobCancelled:
+            self.state = 'cancelled'
+        except Exception as e:
+            print(f"[Jobs] {self.op} {self.sources} -> {self.dest} failed: {e}", flush=True)
+            self.state, self.error = 'error', str(e)
+        self.current = None
+        self.finished = time.time()
+        for path in touched:
+            dir_changed(path)
+        self.publish(True)
+
+    def copy_tree(self, src, target):
+        if not os.path.isdir(src) or os.path.islink(src):
+            self.copy_file(src, target)
+            return
+        dirs = []
+        for dirpath, dirnames, filenames in os.walk(src):
+            dirnames.sort()
+            out = os.path.join(target, os.path.relpath(dirpath, src))
+            os.makedirs(out, exist_ok=True)
+            dirs.append((dirpath, out))
+            for name in sorted(filenames):
+                self.copy_file(os.path.join(dirpath, name), os.path.join(out, name))
+        # Folder times last, after the files inside them stopped changing them
+        for dirpath, out in reversed(dirs):
+            try:
+                shutil.copystat(dirpath, out)
+            except OSError: pass
+
+    def copy_file(self, src, dst):
+        if self.cancelled.is_set():
+            raise JobCancelled()
+        self.current = dst
+        if os.path.islink(src):
+            try:
+                if os.path.lexists(dst):
+                    os.unlink(dst)
+                os.symlink(os.readlink(src), dst)
+            except OSError as e:
+                # vfat and exFAT have no symlinks
+                print(f"[Jobs] Skipping link {src}: {e}", flush=True)
+            self.files_done += 1
+            return
+        try:
+            with open(src, 'rb', buffering=0) as fin, open(dst, 'wb') as fout:
+                self.method = self.copy_data(fin, fout)
+        except BaseException:
+            try:
+                os.unlink(dst)
+            except OSError: pass
+            raise
+        try:
+            shutil.copystat(src, dst)
+        except OSError: pass     # Permissions on vfat, times on some FUSE mounts
+        self.files_done += 1
+
+    def copy_data(self, fin, fout):
+        src, dst = fin.fileno(), fout.fileno()
+        if os.fstat(src).st_dev == os.fstat(dst).st_dev:
+            try:
+                fcntl.ioctl(dst, FICLONE, src)
+                self.advance(os.fstat(dst).st_size)
+                return 'reflink'
+            except OSError: pass
+        done = 0
+        if hasattr(os, 'copy_file_range'):
+            try:
+                while True:
+                    n = os.copy_file_range(src, dst, JOB_CHUNK)
+                    if not n:
+                        return 'copy_file_range'
+                    done += n
+                    self.advance(n)
+            except OSError as e:
+                # Cross-filesystem on older kernels, FUSE, vfat: fall back unless we're midway
+                if done or e.errno not in (errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP,
+                                           errno.ENOTSUP, errno.EBADF, errno.EIO):
+                    raise
+        buf = bytearray(JOB_BUFFER)
+        view = memoryview(buf)
+        while True:
+            n = fin.readinto(buf)
+            if not n:
+                return 'buffered'
+            fout.write(view[:n])
+            self.advance(n)
+
+class JobQueue:
+    """Runs jobs on JOB_WORKERS threads with at most JOB_PER_DEVICE per source device, so
+    jobs reading a slow USB stick wait for each other instead of holding every worker."""
+
+    def __init__(self):
+        self.jobs = OrderedDict()    # id -> Job, oldest first
+        self.pending = []
+        self.active = 0
+        self.per_device = {}         # st_dev -> jobs running
+        self.lock = threading.Lock()
+        self.pool = ThreadPoolExecutor(JOB_WORKERS, thread_name_prefix='job')
+
+    def submit(self, job):
+        with self.lock:
+            self.jobs[job.id] = job
+            self.pending.append(job)
+            finished = [j.id for j in self.jobs.values() if j.finished]
+            for job_id in finished[:max(0, len(finished) - JOB_KEEP)]:
+                del self.jobs[job_id]
+        job.publish(True)
+        self.dispatch()
+
+    def dispatch(self):
+        with self.lock:
+            for job in list(self.pending):
+                if self.active >= JOB_WORKERS:
+                    break
+                if self.per_device.get(job.device, 0) >= JOB_PER_DEVICE:
+                    continue
+                self.pending.remove(job)
+                self.active += 1
+                self.per_device[job.device] = self.per_device.get(job.device, 0) + 1
+                self.pool.submit(self.work, job)
+
+    def work(self, job):
+        try:
+            job.run()
+        finally:
+            with self.lock:
+                self.active -= 1
+                self.per_device[job.device] -= 1
+                if not self.per_device[job.device]:
+                    del self.per_device[job.device]
+            self.dispatch()
+
+    def cancel(self, job_id):
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is None:
+                return None
+            job.cancelled.set()
+            queued = job in self.pending
+            if queued:
+                self.pending.remove(job)
+                job.state, job.finished = 'cancelled', time.time()
+        if queued:
+            job.publish(True)
+        return job
+
+    def get(self, job_id):
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def list(self):
+        with self.lock:
+            return [job.status() for job in self.jobs.values()]
+
+JOBS = JobQueue()
+
+try:
+    LIBC = ctypes.CDLL(None, use_errno=True)
+except OSError:
+    LIBC = None
+
+def inotify_init(flags=0):
+    # inotify fd via libc, or -1 where it isn't available
+    if LIBC is None or not hasattr(LIBC, 'inotify_init1'):
+        return -1
+    fd = LIBC.inotify_init1(os.O_CLOEXEC | flags)
+    if fd < 0:
+        print(f"[inotify] init failed: {os.strerror(ctypes.get_errno())}", flush=True)
+    return fd
+
+def fs_type(path):
+    # Filesystem type of the mount holding path, from the longest matching mount point
+    best, fstype = '', None
+    try:
+        with open('/proc/self/mountinfo') as f:
+            for line in f:
+                fields, _, rest = line.partition(' - ')
+                mnt = fields.split()[4].replace('\\040', ' ')
+                if (path == mnt or path.startswith(mnt.rstrip('/') + '/')) and len(mnt) >= len(best):
+                    best, fstype = mnt, rest.split()[0]
+    except OSError:
+        pass
+    return fstype
+
+def scan_dir(path, follow_symlinks=True):
+    # One stat per entry: DirEntry caches it, and is_dir/size both come from it
+    entries = []
+    with os.scandir(path) as it:
+        for entry in it:
+            if entry.name.startswith(UPLOAD_PREFIX):
+                continue  # In-progress resumable upload
+            try:
+                st = entry.stat(follow_symlinks=follow_symlinks)
+            except OSError:
+                try:
+                    st = entry.stat(follow_symlinks=False)  # Dangling symlink
+                except OSError:
+                    continue
+            is_dir = stat.S_ISDIR(st.st_mode)
+            entries.append({
+                'name': entry.name,
+                'isDir': is_dir,
+                'size': 0 if is_dir else st.st_size,
+                'mtime': int(st.st_mtime),
+            })
+    return entries
+
+SORT_KEYS = {
+    'name': lambda e: e['name'].lower(),
+    'size': lambda e: e['size'],
+    'mtime': lambda e: e['mtime'],
+}
+
+class Listing:
+    def __init__(self, entries, mtime_ns, scanned, seq, watched):
+        self.entries = entries
+        self.mtime_ns = mtime_ns
+        self.scanned = scanned
+        self.seq = seq           # DirCache.changes[path] when the scan started
+        self.watched = watched
+        self.orders = {}         # (sort, order) -> (entries, name -> index)
+        self.json = None         # json_body(entries), built on first unpaged request
+
+    def ordered(self, sort, order):
+        cached = self.orders.get((sort, order))
+        if cached is None:
+            # Folders first, then the requested key, ties broken by name
+            entries = sorted(self.entries, key=lambda e: e['name'])
+            entries.sort(key=SORT_KEYS[sort], reverse=(order == 'desc'))
+            entries.sort(key=lambda e: not e['isDir'])
+            cached = entries, {e['name']: i for i, e in enumerate(entries)}
+            self.orders[(sort, order)] = cached
+        return cached
+
+class DirCache:
+    """Directory listings, dropped on inotify events where the filesystem reports them
+    and revalidated by directory mtime (plus a short TTL) everywhere else."""
+
+    IN_MASK = (0x2 | 0x4 | 0x8 | 0x40 | 0x80 | 0x100 | 0x200 | 0x400 | 0x800  # modify .. move_self
+               | 0x1000000)                                                  # IN_ONLYDIR
+    IN_Q_OVERFLOW = 0x4000
+    IN_IGNORED = 0x8000
+    EVENT = struct.Struct('iIII')
+
+    def __init__(self, max_dirs=DIR_CACHE_DIRS):
+        self.max_dirs = max_dirs
+        self.listings = OrderedDict()
+        self.changes = {}        # path -> inotify event count
+        self.watches = {}        # path -> wd
+        self.paths = {}          # wd -> path
+        self.lock = threading.Lock()
+        self.hits = self.misses = 0
+        self.inotify = -1        # Until start(): listings use mtime checks
+
+    def start(self):
+        self.inotify = inotify_init()
+        if self.inotify >= 0:
+            threading.Thread(target=self.watch_loop, daemon=True).start()
+        else:
+            print("[Files] inotify unavailable, listings use mtime checks", flush=True)
+
+    def get(self, path):
+        st = os.stat(path)
+        now = time.time()
+        with self.lock:
+            listing = self.listings.get(path)
+            if listing and self.fresh(path, listing, st, now):
+                self.listings.move_to_end(path)
+                self.hits += 1
+                return listing
+            self.misses += 1
+        # Watch before scanning so a change during the scan is not lost, and scan outside
+        # the lock so one slow 9p folder doesn't hold up every other listing
+        watched = self.watch(path)
+        with self.lock:
+            seq = self.changes.get(path, 0)
+        entries = scan_dir(path)
+        listing = Listing(entries, st.st_mtime_ns, now, seq, watched)
+        with self.lock:
+            self.listings[path] = listing
+            self.listings.move_to_end(path)
+            while len(self.listings) > self.max_dirs:
+                old, _ = self.listings.popitem(last=False)
+                self.unwatch(old)
+        return listing
+
+    def fresh(self, path, listing, st, now):
+        if listing.mtime_ns != st.st_mtime_ns:
+            return False
+        if listing.watched:
+            return self.changes.get(path, 0) == listing.seq and path in self.watches
+        return now - listing.scanned < DIR_CACHE_TTL and listing.scanned - st.st_mtime > MTIME_SLACK
+
+    def invalidate(self, path):
+        with self.lock:
+            self.listings.pop(path, None)
+
+    def watch(self, path):
+        if self.inotify < 0 or fs_type(os.path.realpath(path)) not in INOTIFY_FSTYPES:
+            return False
+        with self.lock:
+            if path in self.watches:
+                return True
+        wd = LIBC.inotify_add_watch(self.inotify, os.fsencode(path), self.IN_MASK)
+        if wd < 0:
+            return False  # ENOSPC (max_user_watches) or permissions: fall back to mtime
+        with self.lock:
+            self.watches[path] = wd
+            self.paths[wd] = path
+        return True
+
+    def unwatch(self, path):
+        # Caller holds the lock
+        wd = self.watches.pop(path, None)
+        if wd is not None:
+            self.paths.pop(wd, None)
+            self.changes.pop(path, None)
+            LIBC.inotify_rm_watch(self.inotify, wd)
+
+    def watch_loop(self):
+        while True:
+            try:
+                buf = os.read(self.inotify, 64 * 1024)
+            except OSError as e:
+                print(f"[Files] inotify read failed: {e}", flush=True)
+                return
+            changed, touched = set(), set()
+            with self.lock:
+                pos = 0
+                while pos + self.EVENT.size <= len(buf):
+                    wd, mask, _, name_len = self.EVENT.unpack_from(buf, pos)
+                    pos += self.EVENT.size + name_len
+                    paths = list(self.watches) if mask & self.IN_Q_OVERFLOW else [self.paths.get(wd)]
+                    for path in paths:
+                        if path is None:
+                            continue
+                        self.changes[path] = self.changes.get(path, 0) + 1
+                        touched.add(path)
+                        listing = self.listings.get(path)
+                        # Announce only the first change since the listing was served; the
+                        # client re-lists, and the next change after that is announced again
+                        if listing and self.changes[path] == listing.seq + 1:
+                            changed.add(path)
+                    path = self.paths.get(wd)
+                    if path is None or mask & self.IN_Q_OVERFLOW:
+                        continue
+                    if mask & self.IN_IGNORED:
+                        # Directory removed or unmounted: the kernel dropped the watch
+                        self.watches.pop(path, None)
+                        self.paths.pop(wd, None)
+            for path in touched:
+                SEARCH.touch(path)
+            for path in changed:
+                EVENTS.publish('dir', path=path)
+
+DIR_CACHE = DirCache()
+
+def dir_entries(path):
+    # Cached listing of a scan root such as /media, or [] if it isn't there
+    try:
+        return DIR_CACHE.get(path).entries
+    except (FileNotFoundError, NotADirectoryError):
+        return []
+
+def human_size(n):
+    # lsblk-style sizes: 497M, 1.5G, 256G
+    for unit in 'BKMGTP':
+        if n < 1024 or unit == 'P':
+            return f"{n}B" if unit == 'B' else f"{n:.1f}".rstrip('0').rstrip('.') + unit
+        n /= 1024
+
+def read_file(path, default=''):
+    try:
+        with open(path) as f:
+            return f.read().strip()
+    except OSError:
+        return default
+
+def udev_unescape(name):
+    # udev writes bytes that are unsafe in a file name as \xNN and leaves UTF-8 alone;
+    # unicode_escape would read the UTF-8 bytes as Latin-1 and mangle 'Fotos Müller'
+    raw = re.sub(rb'\\x([0-9a-fA-F]{2})', lambda m: bytes([int(m.group(1), 16)]), os.fsencode(name))
+    return raw.decode('utf-8', 'replace')
+
+def read_block_devices():
+    """The block device tree in lsblk -J shape (name, size, type, rm, mountpoint, label, children)."""
+    mounts = {}                  # "major:minor" -> first mount point
+    with open('/proc/self/mountinfo') as f:
+        for line in f:
+            fields = line.split()
+            mounts.setdefault(fields[2], fields[4].replace('\\040', ' '))
+    sizes = {}                   # name -> bytes; /proc/partitions counts 1 KiB blocks
+    with open('/proc/partitions') as f:
+        for line in f:
+            fields = line.split()
+            if len(fields) == 4 and fields[2].isdigit():
+                sizes[fields[3]] = int(fields[2]) * 1024
+    labels = {}                  # Only where udev maintains /dev/disk/by-label
+    try:
+        for label in os.listdir('/dev/disk/by-label'):
+            target = os.path.basename(os.path.realpath(os.path.join('/dev/disk/by-label', label)))
+            labels[target] = udev_unescape(label)
+    except OSError:
+        pass
+
+    def device(name, path, dev_type, removable):
+        size = sizes.get(name)
+        if size is None:
+            size = int(read_file(os.path.join(path, 'size'), '0') or 0) * 512
+        return {
+            'name': name,
+            'size': human_size(size),
+            'type': dev_type,
+            'rm': removable,
+            'mountpoint': mounts.get(read_file(os.path.join(path, 'dev'))),
+            'label': labels.get(name),
+            'bytes': size,
+        }
+
+    tree = []
+    for entry in sorted(os.listdir('/sys/block')):
+        base = os.path.join('/sys/block', entry)
+        name = entry.replace('!', '/')
+        if name.startswith(('loop', 'ram')) and sizes.get(name, 0) == 0:
+            continue  # Unused loop devices, as lsblk hides them
+        dev_type = ('loop' if name.startswith('loop') else 'rom' if name.startswith('sr')
+                    else 'lvm' if name.startswith('dm-') else 'raid' if name.startswith('md') else 'disk')
+        removable = read_file(os.path.join(base, 'removable')) == '1'
+        disk = device(name, base, dev_type, removable)
+        children = [device(part.replace('!', '/'), os.path.join(base, part), 'part', removable)
+                    for part in sorted(os.listdir(base))
+                    if os.path.exists(os.path.join(base, part, 'partition'))]
+        if children:
+            disk['children'] = children
+        tree.append(disk)
+    return tree
+
+class DeviceWatcher:
+    """In-memory block device table, rescanned when the mount table changes (epoll on
+    mountinfo), a block uevent arrives (netlink) or /dev changes (inotify), with a slow
+    periodic resync for containers where none of those fire. Every change bumps
+    the version and lands in a short feed that clients can ask about with ?since=."""
+
+    NETLINK_KOBJECT_UEVENT = 15
+    IN_DEV_MASK = 0x100 | 0x200 | 0x4   # IN_CREATE | IN_DELETE | IN_ATTRIB
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.tree = []
+        self.flat = {}           # name -> device, disks and partitions
+        self.version = int(time.time())  # Seeded from the clock so versions from before a restart read as stale
+        self.feed = deque(maxlen=DEVICE_FEED_MAX)   # {version, action, name}
+        self.scanned = False
+
+    def snapshot(self):
+        if not self.scanned:
+            self.refresh()   # First call, or a process that never started the watcher
+        with self.lock:
+            return self.version, {'blockdevices': self.tree}
+
+    def changes_since(self, since):
+        with self.lock:
+            if since == self.version:
+                return self.version, []
+            if since > self.version or not self.feed or self.feed[0]['version'] > since + 1:
+                return self.version, None   # Too old (or from before a restart): refetch everything
+            return self.version, [c for c in self.feed if c['version'] > since]
+
+    def record(self, action, name):
+        # A change that isn't visible in the kernel's tables, e.g. a host drive toggled in MOUNTED_PATHS
+        with self.lock:
+            self.version += 1
+            self.feed.append({'version': self.version, 'action': action, 'name': name})
+            version = self.version
+        EVENTS.publish('device', action=action, name=name, mountpoint=None, version=version)
+
+    def refresh(self):
+        try:
+            # What lsblk used to cost on every /api/usbs; now once per change
+            with METRICS.timer('vesta_device_scan_duration_seconds'):
+                tree = read_block_devices()
+        except OSError as e:
+            print(f"[Devices] Scan failed: {e}", flush=True)
+            return
+        flat = {}
+        for disk in tree:
+            flat[disk['name']] = disk
+            for part in disk.get('children', []):
+                flat[part['name']] = part
+        with self.lock:
+            old = self.flat
+            changes = ([('add', n) for n in flat if n not in old] +
+                       [('remove', n) for n in old if n not in flat])
+            for n in flat:
+                if n in old and {**flat[n], 'children': None} != {**old[n], 'children': None}:
+                    if flat[n]['mountpoint'] != old[n]['mountpoint']:
+                        changes.append(('mount' if flat[n]['mountpoint'] else 'unmount', n))
+                    else:
+                        changes.append(('change', n))
+            if not self.scanned:
+                changes = []  # The initial table is the starting version, not a change
+            self.tree, self.flat, self.scanned = tree, flat, True
+            if changes:
+                self.version += 1
+                for action, name in changes:
+                    self.feed.append({'version': self.version, 'action': action, 'name': name})
+            version = self.version
+        for action, name in changes:
+            print(f"[Devices] {action} {name}", flush=True)
+            device = flat.get(name) or old.get(name)
+            EVENTS.publish('device', action=action, name=name, mountpoint=device.get('mountpoint'), version=version)
+
+    def start(self):
+        self.refresh()
+        threading.Thread(target=self.run, daemon=True).start()
+
+    def run(self):
+        ep = select.epoll()
+        sources = {}
+
+        mountinfo = open('/proc/self/mountinfo', 'rb')
+        mountinfo.read()
+        ep.register(mountinfo.fileno(), select.EPOLLPRI | select.EPOLLERR)
+        sources[mountinfo.fileno()] = 'mounts'
+
+        try:
+            uevents = socket.socket(socket.AF_NETLINK, socket.SOCK_DGRAM, self.NETLINK_KOBJECT_UEVENT)
+            uevents.bind((0, 1))
+            uevents.setblocking(False)
+            ep.register(uevents.fileno(), select.EPOLLIN)
+            sources[uevents.fileno()] = 'uevent'
+        except (OSError, AttributeError) as e:
+            uevents = None
+            print(f"[Devices] No uevent socket ({e}), relying on /dev and mount events", flush=True)
+
+        dev_watch = inotify_init(os.O_NONBLOCK)
+        if dev_watch >= 0 and LIBC.inotify_add_watch(dev_watch, b'/dev', self.IN_DEV_MASK) >= 0:
+            ep.register(dev_watch, select.EPOLLIN)
+            sources[dev_watch] = 'dev'
+
+        while True:
+            events = ep.poll(DEVICE_RESYNC)
+            if events:
+                time.sleep(DEVICE_SETTLE)
+                events += ep.poll(0)
+            relevant = not events     # Periodic resync
+            for fd, _ in events:
+                source = sources[fd]
+                if source == 'mounts':
+                    mountinfo.seek(0)
+                    mountinfo.read()  # Re-arms the poll
+                    relevant = True
+                elif source == 'uevent':
+                    while True:
+                        try:
+                            msg = uevents.recv(65536)
+                        except BlockingIOError:
+                            break
+                        relevant |= b'SUBSYSTEM=block' in msg
+                else:
+                    try:
+                        while os.read(fd, 65536):
+                            pass
+                    except BlockingIOError:
+                        pass
+                    relevant = True
+            if relevant:
+                self.refresh()
+
+DEVICES = DeviceWatcher()
+
+class SearchIndex:
+    """Name and metadata of everything under ALLOWED_ROOTS in SQLite, so search is a query
+    instead of a walk. One crawler thread keeps it current: a folder is rescanned only when
+    its mtime moved since it was indexed, folders reported by dir_changed/inotify are
+    rescanned shortly after, and a full mtime-diff pass runs every SEARCH_RESCAN. WAL mode
+    lets queries read the last committed state while the crawler writes."""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS dirs (path TEXT PRIMARY KEY, mtime_ns INTEGER) WITHOUT ROWID;
+        CREATE TABLE IF NOT EXISTS files (
+            dir TEXT, name TEXT, lname TEXT, is_dir INTEGER, size INTEGER, mtime INTEGER,
+            PRIMARY KEY (dir, name)) WITHOUT ROWID;
+        CREATE INDEX IF NOT EXISTS files_lname ON files (lname);
+    """
+
+    def __init__(self, db_path=SEARCH_DB):
+        self.db_path = db_path
+        self.local = threading.local()
+        self.touched = set()
+        self.cond = threading.Condition()
+        self.running = False
+        self.indexing = False
+        self.last_pass = None     # (started, seconds, dirs scanned, dirs unchanged)
+
+    def connect(self):
+        db = sqlite3.connect(self.db_path, isolation_level=None, timeout=30)
+        db.execute('PRAGMA journal_mode=WAL')
+        db.execute('PRAGMA synchronous=NORMAL')
+        return db
+
+    def db(self):
+        # One connection per API thread; sqlite3 connections can't be shared between them
+        db = getattr(self.local, 'db', None)
+        if db is None:
+            db = self.local.db = self.connect()
+        return db
+
+    def start(self):
+        try:
+            os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+            self.connect().executescript(self.SCHEMA)
+        except (OSError, sqlite3.Error) as e:
+            print(f"[Search] Index disabled, can't open {self.db_path}: {e}", flush=True)
+            self.db_path = None
+            return
+        self.running = True
+        threading.Thread(target=self.run, daemon=True).start()
+
+    def touch(self, path):
+        if not self.running:
+            return
+        with self.cond:
+            self.touched.add(path)
+            self.cond.notify()
+
+    def run(self):
+        db = self.connect()
+        next_pass = 0
+        while True:
+            with self.cond:
+                if not self.touched:
+                    self.cond.wait(max(0, next_pass - time.time()))
+            if self.touched and time.time() < next_pass:
+                time.sleep(SEARCH_SETTLE)
+                with self.cond:
+                    touched, self.touched = self.touched, set()
+                self.crawl(db, sorted(touched), full=False)
+            if time.time() >= next_pass:
+                t0 = time.time()
+                self.indexing = True
+                scanned, unchanged = self.crawl(db, [r for r in ALLOWED_ROOTS if os.path.isdir(r)], full=True)
+                self.indexing = False
+                self.last_pass = (t0, round(time.time() - t0, 1), scanned, unchanged)
+                print(f"[Search] Pass took {self.last_pass[1]}s: {scanned} folders rescanned, "
+                      f"{unchanged} unchanged", flush=True)
+                next_pass = time.time() + SEARCH_RESCAN
+
+    def crawl(self, db, paths, full):
+        # Depth-first from paths. Unchanged folders reuse their indexed subfolder list; a
+        # full pass descends into all of them, a hint only into ones not indexed yet.
+        stack = list(reversed(paths))
+        forced = set(paths) if not full else set()
+        scanned = unchanged = pending = 0
+        db.execute('BEGIN')
+        try:
+            while stack:
+                path = stack.pop()
+                try:
+                    st = os.lstat(path)
+                except OSError:
+                    self.drop(db, path)
+                    continue
+                if not stat.S_ISDIR(st.st_mode):
+                    continue
+                row = db.execute('SELECT mtime_ns FROM dirs WHERE path = ?', (path,)).fetchone()
+                if row and row[0] == st.st_mtime_ns and path not in forced:
+                    unchanged += 1
+                    subdirs = [os.path.join(path, n) for (n,) in
+                               db.execute('SELECT name FROM files WHERE dir = ? AND is_dir = 1', (path,))]
+                else:
+                    scanned += 1
+                    subdirs = self.scan(db, path, st)
+                for sub in sorted(subdirs, reverse=True):
+                    if sub in ALLOWED_ROOTS:
+                        continue     # Indexed as a root of its own
+                    if full or not db.execute('SELECT 1 FROM dirs WHERE path = ?', (sub,)).fetchone():
+                        stack.append(sub)
+                pending += 1
+                if pending >= SEARCH_BATCH:
+                    # Commit so queries see progress, and let API threads have the GIL
+                    db.execute('COMMIT')
+                    pending = 0
+                    time.sleep(0)
+                    db.execute('BEGIN')
+        finally:
+            db.execute('COMMIT')
+        return scanned, unchanged
+
+    def scan(self, db, path, st):
+        try:
+            entries = scan_dir(path, follow_symlinks=False)
+        except OSError:
+            entries = []
+        names = {e['name']: e['isDir'] for e in entries}
+        for name, was_dir in db.execute('SELECT name, is_dir FROM files WHERE dir = ?', (path,)).fetchall():
+            if was_dir and not names.get(name):
+                self.drop(db, os.path.join(path, name))
+        db.execute('DELETE FROM files WHERE dir = ?', (path,))
+        db.executemany('INSERT INTO files VALUES (?, ?, ?, ?, ?, ?)',
+                       [(path, e['name'], e['name'].lower(), e['isDir'], e['size'], e['mtime']) for e in entries])
+        db.execute('INSERT OR REPLACE INTO dirs VALUES (?, ?)', (path, st.st_mtime_ns))
+        return [os.path.join(path, e['name']) for e in entries if e['isDir']]
+
+    def drop(self, db, path):
+        # A folder and everything indexed under it ('0' is the character after '/')
+        for table, column in (('files', 'dir'), ('dirs', 'path')):
+            db.execute(f'DELETE FROM {table} WHERE {column} = ? OR ({column} >= ? AND {column} < ?)',
+                       (path, path + '/', path + '0'))
+        parent, name = os.path.split(path)
+        db.execute('DELETE FROM files WHERE dir = ? AND name = ?', (parent, name))
+
+    def search(self, q, mode, scope, include_dirs, limit):
+        # Case-insensitive. Prefix and globs with a literal head use the lname index;
+        # substring scans the names. Rows come straight from the cursor as they match.
+        q = q.lower()
+        where, args = [], []
+        literal = q
+        if mode == 'substring':
+            where.append('instr(lname, ?) > 0')
+            args.append(q)
+            literal = ''
+        elif mode == 'glob':
+            where.append('lname GLOB ?')
+            args.append(q)
+            literal = q[:min([q.index(c) for c in '*?[' if c in q] or [len(q)])]
+        if literal:
+            where.append('lname >= ? AND lname < ?')
+            args += [literal, literal + '\U0010ffff']
+        if scope != '/':
+            where.append('(dir = ? OR (dir >= ? AND dir < ?))')
+            args += [scope, scope + '/', scope + '0']
+        if not include_dirs:
+            where.append('is_dir = 0')
+        cursor = self.db().execute(
+            f'SELECT dir, name, is_dir, size, mtime FROM files WHERE {" AND ".join(where)} LIMIT ?', args + [limit])
+        for d, name, is_dir, size, mtime in cursor:
+            yield {'name': name, 'path': os.path.join(d, name), 'isDir': bool(is_dir), 'size': size, 'mtime': mtime}
+
+    def stats(self):
+        db = self.db()
+        return {
+            'files': db.execute('SELECT count(*) FROM files').fetchone()[0],
+            'dirs': db.execute('SELECT count(*) FROM dirs').fetchone()[0],
+            'indexing': self.indexing,
+            'lastPass': self.last_pass and dict(zip(('started', 'seconds', 'scanned', 'unchanged'), self.last_pass)),
+        }
+
+SEARCH = SearchIndex()
+
+def thumb_worker_init():
+    # Cold thumbnails only get CPU nothing else wants, so they never slow the VNC server
+    try:
+        os.sched_setscheduler(0, os.SCHED_IDLE, os.sched_param(0))
+    except (AttributeError, OSError):
+        os.nice(19)
+
+def thumb_kind(path):
+    ext = os.path.splitext(path)[1].lower()
+    if ext in THUMB_IMAGE_TYPES and Image is not None:
+        return 'image'
+    if ext == '.pdf' and shutil.which('pdftoppm'):
+        return 'pdf'
+    if ext in THUMB_VIDEO_TYPES and shutil.which('ffmpeg'):
+        return 'video'
+    return None
+
+def make_thumbnail(path, out, size):
+    # Runs in a pool process: writes a JPEG no larger than size x size to out (which ends
+    # in .jpg) and returns True, or False when the file can't be previewed
+    try:
+        kind = thumb_kind(path)
+        if kind == 'image':
+            with Image.open(path) as im:
+                im.draft('RGB', (size, size))  # JPEG: let the decoder scale down by 1/2..1/8
+                im = ImageOps.exif_transpose(im)
+                im.thumbnail((size, size))
+                im.convert('RGB').save(out, 'JPEG', quality=THUMB_QUALITY)
+            return True
+        if kind == 'pdf':
+            subprocess.run(['pdftoppm', '-jpeg', '-f', '1', '-l', '1', '-scale-to', str(size), '-singlefile',
+                            path, out[:-4]], capture_output=True, timeout=THUMB_TIMEOUT, check=True)
+            return os.path.getsize(out) > 0
+        if kind == 'video':
+            # A few seconds in skips black intro frames; short clips fall back to the first frame
+            for seek in ('3', '0'):
+                subprocess.run(['ffmpeg', '-v', 'error', '-y', '-ss', seek, '-i', path, '-frames:v', '1',
+                                '-vf', f'scale={size}:{size}:force_original_aspect_ratio=decrease',
+                                '-f', 'image2', '-c:v', 'mjpeg', out], capture_output=True, timeout=THUMB_TIMEOUT)
+                if os.path.exists(out) and os.path.getsize(out) > 0:
+                    return True
+    except Exception as e:
+        print(f"[Thumbs] {path}: {e}", flush=True)
+    return False
+
+class Thumbnailer:
+    """Thumbnails made by a small pool of idle-priority processes and cached on disk, named
+    by a hash of (path, mtime, size, pixels) so an edited file simply misses. Files that
+    can't be previewed are cached as empty entries. Past THUMB_CACHE_BYTES the least
+    recently used go; hits bump the file mtime so recency survives restarts."""
+
+    def __init__(self, root=THUMB_CACHE_DIR, budget=THUMB_CACHE_BYTES):
+        self.root = root
+        self.budget = budget
+        self.entries = OrderedDict()   # key -> bytes on disk, least recently used first
+        self.total = 0
+        self.pending = {}              # key -> [Future for callers, pool future, callers waiting]
+        self.lock = threading.Lock()
+        self.pool = None
+        self.hits = self.made = self.failed = 0
+
+    def start(self):
+        # Workers come from a forkserver, not a fork of this process: the pool starts them
+        # on demand, from whichever request thread submits, and a fork then could copy a
+        # lock some other thread holds
+        try:
+            os.makedirs(self.root, exist_ok=True)
+            found = []
+            for dirpath, _, names in os.walk(self.root):
+                for name in names:
+                    path = os.path.join(dirpath, name)
+                    if name.count('.') != 1:
+                        os.unlink(path)  # Half-written by a previous run
+                        continue
+                    st = os.stat(path)
+                    found.append((st.st_mtime, name[:-4], st.st_size))
+        except OSError as e:
+            print(f"[Thumbs] Disabled, can't use {self.root}: {e}", flush=True)
+            return
+        with self.lock:
+            for _, key, size in sorted(found):
+                self.entries[key] = size
+                self.total += size
+            self.evict()
+        self.pool = self.new_pool()
+        self.pool.submit(int).result()  # Starts the forkserver now rather than on the first thumbnail
+
+    def new_pool(self):
+        return ProcessPoolExecutor(THUMB_WORKERS, mp_context=multiprocessing.get_context('forkserver'),
+                                   initializer=thumb_worker_init)
+
+    def replace_pool(self, broken):
+        # A worker killed mid-job (say OOM on a huge image) breaks the whole pool for good;
+        # the first to notice swaps in a new one. Caller holds the lock.
+        if self.pool is not broken:
+            return
+        print("[Thumbs] Worker pool broke, starting a new one", flush=True)
+        METRICS.inc('vesta_thumbnail_pool_restarts_total')
+        self.pool = self.new_pool()
+        broken.shutdown(wait=False, cancel_futures=True)
+
+    def file(self, key):
+        return os.path.join(self.root, key[:2], key + '.jpg')
+
+    def get(self, path, size):
+        # (key, Future resolving to the cache file, empty if there is no preview), or None
+        # for file types that never have one. Concurrent requests share one generation.
+        if self.pool is None or thumb_kind(path) is None:
+            return None
+        st = os.stat(path)
+        if not stat.S_ISREG(st.st_mode):
+            return None
+        key = hashlib.sha1(f'{path}\0{st.st_mtime_ns}\0{st.st_size}\0{size}'.encode()).hexdigest()
+        with self.lock:
+            hit = key in self.entries
+            if hit:
+                self.entries.move_to_end(key)
+                self.hits += 1
+            elif key in self.pending:
+                self.pending[key][2] += 1
+                return key, self.pending[key][0]
+            else:
+                done = Future()
+                tmp = os.path.join(self.root, f'{key}.{os.urandom(4).hex()}.jpg')
+                pool = self.pool
+                try:
+                    work = pool.submit(make_thumbnail, path, tmp, size)
+                except BrokenProcessPool:
+                    self.replace_pool(pool)
+                    pool = self.pool
+                    work = pool.submit(make_thumbnail, path, tmp, size)
+                self.pending[key] = [done, work, 1]
+        if not hit:
+            # Outside the lock: the callback runs right here if the work is already done
+            work.add_done_callback(lambda w, started=time.monotonic(): self.finish(key, tmp, w, done, started, pool))
+            return key, done
+        done = Future()
+        done.set_result(self.file(key))
+        try:
+            os.utime(self.file(key))
+        except OSError: pass
+        return key, done
+
+    def cancel(self, key):
+        # A caller of get() went away; the queued generation is dropped once nobody
+        # else is waiting for it either
+        with self.lock:
+            entry = self.pending.get(key)
+            if entry is None:
+                return
+            entry[2] -= 1
+            if entry[2] > 0:
+                return
+        entry[1].cancel()
+
+    def finish(self, key, tmp, work, done, started, pool):
+        broken = not work.cancelled() and isinstance(work.exception(), BrokenProcessPool)
+        if work.cancelled() or broken:
+            # Not cached: the file itself may be fine, it's the worker that died
+            with self.lock:
+                self.pending.pop(key, None)
+                if broken:
+                    self.replace_pool(pool)
+            try:
+                os.unlink(tmp)
+            except OSError: pass
+            done.set_result(None)
+            return
+        final = self.file(key)
+        ok = work.exception() is None and work.result()
+        # Queued plus generation time, pdftoppm and ffmpeg included
+        METRICS.observe('vesta_thumbnail_duration_seconds', time.monotonic() - started,
+                        result='made' if ok else 'failed')
+        try:
+            os.makedirs(os.path.dirname(final), exist_ok=True)
+            if ok:
+                os.replace(tmp, final)
+            else:
+                open(final, 'wb').close()
+            size = os.path.getsize(final)
+        except OSError as e:
+            print(f"[Thumbs] Can't cache {final}: {e}", flush=True)
+            size = None
+        try:
+            os.unlink(tmp)
+        except OSError: pass
+        with self.lock:
+            self.pending.pop(key, None)
+            if size is not None:
+                self.total += size - self.entries.get(key, 0)
+                self.entries[key] = size
+                self.evict()
+            if ok:
+                self.made += 1
+            else:
+                self.failed += 1
+        done.set_result(final if size is not None else None)
+
+    def evict(self):
+        # Caller holds the lock
+        while self.total > self.budget and self.entries:
+            key, size = self.entries.popitem(last=False)
+            self.total -= size
+            try:
+                os.unlink(self.file(key))
+            except OSError: pass
+
+THUMBS = Thumbnailer()
+
+def collect_metrics():
+    # Read at scrape time from counters the caches and queues keep anyway
+    return [
+        ('vesta_cache_hits_total', 'counter', {'cache': 'listing'}, DIR_CACHE.hits),
+        ('vesta_cache_misses_total', 'counter', {'cache': 'listing'}, DIR_CACHE.misses),
+        ('vesta_cache_entries', 'gauge', {'cache': 'listing'}, len(DIR_CACHE.listings)),
+        ('vesta_cache_hits_total', 'counter', {'cache': 'thumbnail'}, THUMBS.hits),
+        ('vesta_cache_misses_total', 'counter', {'cache': 'thumbnail'}, THUMBS.made + THUMBS.failed),
+        ('vesta_cache_entries', 'gauge', {'cache': 'thumbnail'}, len(THUMBS.entries)),
+        ('vesta_cache_bytes', 'gauge', {'cache': 'thumbnail'}, THUMBS.total),
+        ('vesta_cache_hits_total', 'counter', {'cache': 'delta_signature'}, SIGNATURES.hits),
+        ('vesta_cache_misses_total', 'counter', {'cache': 'delta_signature'}, SIGNATURES.misses),
+        ('vesta_cache_entries', 'gauge', {'cache': 'delta_signature'}, len(SIGNATURES.signatures)),
+        ('vesta_cache_bytes', 'gauge', {'cache': 'delta_signature'}, SIGNATURES.total),
+        ('vesta_cache_hits_total', 'counter', {'cache': 'json'}, JSON_CACHE.hits),
+        ('vesta_cache_misses_total', 'counter', {'cache': 'json'}, JSON_CACHE.misses),
+        ('vesta_cache_entries', 'gauge', {'cache': 'json'}, len(JSON_CACHE.bodies)),
+        ('vesta_cache_bytes', 'gauge', {'cache': 'json'}, JSON_CACHE.total),
+        ('vesta_thumbnails_pending', 'gauge', {}, len(THUMBS.pending)),
+        ('vesta_uploads_in_progress', 'gauge', {}, len(UPLOADS)),
+        ('vesta_jobs', 'gauge', {'state': 'running'}, JOBS.active),
+        ('vesta_jobs', 'gauge', {'state': 'queued'}, len(JOBS.pending)),
+        ('vesta_event_subscribers', 'gauge', {}, EVENTS.subscribers),
+        ('vesta_search_indexing', 'gauge', {}, int(bool(SEARCH.indexing))),
+        ('vesta_access_log_dropped_total', 'counter', {}, ACCESS_LOG.dropped),
+    ]
+
+METRICS.collectors.append(collect_metrics)
+
+def encode_cursor(name, offset):
+    return base64.urlsafe_b64encode(json.dumps([name, offset]).encode()).decode()
+
+def decode_cursor(cursor):
+    name, offset = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    return str(name), int(offset)
+
 class USBHandler(http.server.BaseHTTPRequestHandler):
+    route = 'other'              # Metrics label: the matched route, so unknown paths share one series
+    started = None
+    status = 0
+
     def log_message(self, format, *args):
-        # Override to flush logs immediately
-        print("%s - - [%s] %s\n" % (self.client_address[0], self.log_date_time_string(), format % args), flush=True)
+        ACCESS_LOG.put({'time': time.time(), 'client': self.client_address[0], 'message': format % args})
+
+    def log_request(self, code='-', size='-'):
+        pass  # Written by record_request once the response is done, with its duration
+
+    def send_response(self, code, message=None):
+        self.status = code
+        super().send_response(code, message)
+
+    def parse_request(self):
+        # Timed from here, not from accept: a keep-alive socket may idle between requests
+        if not super().parse_request():
+            return False
+        self.started = time.monotonic()
+        self.status = 0
+        self.route = 'other'
+        METRICS.gauge('vesta_http_requests_in_flight', 1)
+        return True
+
+    def handle_one_request(self):
+        self.started = None
+        try:
+            super().handle_one_request()
+        finally:
+            if self.started is not None:
+                self.record_request()
+
+    def record_request(self):
+        elapsed = time.monotonic() - self.started
+        METRICS.gauge('vesta_http_requests_in_flight', -1)
+        METRICS.inc('vesta_http_requests_total', route=self.route, method=self.command, status=self.status)
+        METRICS.observe('vesta_http_request_duration_seconds', elapsed, route=self.route, method=self.command)
+        ACCESS_LOG.request({'time': time.time(), 'client': self.client_address[0], 'method': self.command,
+                            'path': self.path, 'status': self.status, 'ms': round(elapsed * 1000, 1)})
 
     def send_json_error(self, code, message):
         try:
@@ -49,10 +1961,8 @@ class USBHandler(http.server.BaseHTTPRequestHandler):
             pass
 
     def end_headers(self):
-        self.send_header('Access-Control-Allow-Origin', '*')
-        self.send_header('Access-Control-Allow-Methods', 'GET, POST, OPTIONS')
-        self.send_header('Access-Control-Allow-Headers', 'X-Requested-With, Content-Type, X-File-Name')
-        self.send_header('Access-Control-Allow-Private-Network', 'true')
+        for name, value in CORS_HEADERS:
+            self.send_header(name, value)
         super().end_headers()
 
     def do_OPTIONS(self):
@@ -62,33 +1972,61 @@ class USBHandler(http.server.BaseHTTPRequestHandler):
     def do_GET(self):
         try:
             parsed_path = urllib.parse.urlparse(self.path)
-            path = parsed_path.path
+            path = self.route = parsed_path.path
             query = urllib.parse.parse_qs(parsed_path.query)
 
             if path == '/api/usbs':
                 self.list_usbs()
             elif path == '/api/ping':
                 self.send_response(200)
+                self.end_headers()
                 self.wfile.write(b'pong')
             elif path == '/api/debug':
                 self.debug_info()
             elif path == '/api/files':
-                self.list_files(query.get('path', ['/root/Desktop'])[0])
+                self.list_files(query.get('path', ['/root/Desktop'])[0], query)
             elif path == '/api/download':
-                self.download_file(query.get('path', [''])[0])
+                paths = query.get('path', [''])
+                if len(paths) > 1 or 'format' in query or (self.is_path_safe(paths[0]) and os.path.isdir(paths[0])):
+                    self.download_archive(paths, query)
+                else:
+                    self.download_file(paths[0])
             elif path == '/api/import':
                 self.import_file(query.get('path', [''])[0])
+            elif path == '/api/jobs':
+                self.job_status(query.get('id', [None])[0])
+            elif path == '/api/search':
+                self.search_files(query)
+            elif path == '/api/thumb':
+                self.thumbnail(query.get('path', [''])[0], query.get('size', [THUMB_SIZE])[0])
+            elif path == '/api/search/status':
+                self.send_json(SEARCH.stats() if SEARCH.db_path else {'error': "Search index unavailable"})
             elif path == '/api/settings':
                 self.get_settings()
             elif path == '/api/list_usb_devices':
                 self.list_usb_devices()
+            elif path == '/api/devices':
+                self.device_changes(query.get('since', [None])[0])
+            elif path == '/api/events':
+                self.stream_events(parse_event_id(query.get('since', [self.headers.get('Last-Event-ID')])[0]))
+            elif path == '/api/events/poll':
+                self.poll_events(parse_event_id(query.get('since', [None])[0]), query.get('timeout', [EVENT_POLL_TIMEOUT])[0])
             elif path == '/api/mount_usb':
                 self.mount_usb(query.get('device', [''])[0])
             elif path == '/api/unmount_usb':
                 self.unmount_usb(query.get('device', [''])[0])
             elif path == '/api/power':
                 self.power_action(query.get('action', [''])[0])
+            elif path == '/api/upload/status':
+                self.upload_status(query.get('id', [''])[0])
+            elif path == '/api/delta/signature':
+                self.delta_signature(query.get('path', [''])[0], query.get('block', [None])[0])
+            elif path == '/api/stat':
+                self.stat_path(query.get('path', [''])[0])
+            elif path == '/metrics':
+                self.send_metrics()
             else:
+                self.route = 'other'
                 self.send_error(404, "Not Found")
         except Exception as e:
             print(f"Error handling GET {self.path}: {e}", flush=True)
@@ -97,18 +2035,41 @@ class USBHandler(http.server.BaseHTTPRequestHandler):
     def do_POST(self):
         try:
             parsed_path = urllib.parse.urlparse(self.path)
-            path = parsed_path.path
+            path = self.route = parsed_path.path
             query = urllib.parse.parse_qs(parsed_path.query)
 
             if path == '/api/upload':
                 self.upload_file(query.get('path', ['/root/Desktop'])[0])
+            elif path == '/api/upload/init':
+                self.upload_init(query.get('path', ['/root/Desktop'])[0])
+            elif path == '/api/upload/chunk':
+                self.upload_chunk(query.get('id', [''])[0], query.get('offset', ['0'])[0])
+            elif path == '/api/upload/complete':
+                self.upload_complete(query.get('id', [''])[0])
+            elif path == '/api/upload/cancel':
+                self.upload_cancel(query.get('id', [''])[0])
+            elif path == '/api/jobs':
+                self.job_submit()
+            elif path == '/api/jobs/cancel':
+                self.job_cancel(query.get('id', [''])[0])
+            elif path == '/api/thumbs':
+                self.thumbnails()
             elif path == '/api/settings':
                 self.update_settings()
             elif path == '/api/password':
                 self.update_password()
             elif path == '/api/password_disable':
                 self.disable_password()
+            elif path == '/api/delta/apply':
+                self.delta_apply(query.get('path', [''])[0], query)
+            elif path == '/api/mkdir':
+                self.make_dir(query.get('path', [''])[0], query.get('parents', ['0'])[0] != '0')
+            elif path == '/api/delete':
+                self.delete_path(query.get('path', [''])[0])
+            elif path == '/api/batch':
+                self.batch()
             else:
+                self.route = 'other'
                 self.send_error(404, "Not Found")
         except Exception as e:
              print(f"Error handling POST {self.path}: {e}", flush=True)
@@ -132,12 +2093,10 @@ class USBHandler(http.server.BaseHTTPRequestHandler):
             })
             seen_mounts.add('/root')
             
-            # 2. Linux approach: lsblk
+            # 2. Linux approach: block device table (see DeviceWatcher)
             try:
-                # Use -a to see all, including unmounted if possible
-                result = subprocess.run(['lsblk', '-J', '-o', 'NAME,MOUNTPOINT,RM,SIZE,TYPE,LABEL'], capture_output=True, text=True, timeout=5)
-                if result.returncode == 0 and result.stdout.strip():
-                    data = json.loads(result.stdout)
+                _, data = DEVICES.snapshot()
+                if data:
                     def process_device(dev):
                         mountpoint = dev.get('mountpoint')
                         if mountpoint and mountpoint not in seen_mounts:
@@ -156,175 +2115,986 @@ class USBHandler(http.server.BaseHTTPRequestHandler):
                     for device in data.get('blockdevices', []):
                         process_device(device)
             except Exception as e:
-                print(f"lsblk failed: {e}", flush=True)
+                print(f"Device table failed: {e}", flush=True)
+
+            # 3. Windows/WSL drives (/mnt)
+            try:
+                for entry in dir_entries('/.host_raw'):
+                    item = entry['name']
+                    if len(item) == 1 and item.isalpha():
+                        mpath = os.path.join('/.host_raw', item)
+                        if mpath not in seen_mounts:
+                            # ONLY show if explicitly mounted
+                            if mpath in MOUNTED_PATHS or SETTINGS.get('usb_passthrough'):
+                                storage['host'].append({
+                                    'name': f"host_{item}",
+                                    'label': f"Host {item.upper()}: Drive",
+                                    'mountpoint': mpath,
+                                    'size': 'Managed by Host'
+                                })
+                                seen_mounts.add(mpath)
+            except Exception as e:
+                print(f"/mnt scan failed: {e}", flush=True)
+
+            # 4. Docker Desktop Windows mounts (/host_mnt)
+            try:
+                for entry in dir_entries('/host_mnt'):
+                    item = entry['name']
+                    mpath = os.path.join('/host_mnt', item)
+                    if mpath not in seen_mounts:
+                       if mpath in MOUNTED_PATHS or SETTINGS.get('usb_passthrough'):
+                            storage['host'].append({
+                                'name': f"host_{item}",
+                                'label': f"Docker Host {item.upper()}:",
+                                'mountpoint': mpath,
+                                'size': 'Managed by Host'
+                            })
+                            seen_mounts.add(mpath)
+            except Exception as e:
+                pass
+
+            # 5. /media (Traditional Linux USB)
+            try:
+                for entry in dir_entries('/media'):
+                    item = entry['name']
+                    mpath = os.path.join('/media', item)
+                    if entry['isDir'] and mpath not in seen_mounts:
+                        storage['portable'].append({
+                            'name': item,
+                            'label': f"USB: {item}",
+                            'mountpoint': mpath,
+                            'size': 'Unknown'
+                        })
+                        seen_mounts.add(mpath)
+            except Exception as e:
+                print(f"/media scan failed: {e}", flush=True)
+
+            self.send_cached_json(*json_body(storage), headers=[('X-Devices-Version', DEVICES.version)])
+        except Exception as e:
+            self.send_json_error(500, f"Critical list_usbs failure: {str(e)}")
+
+    def debug_info(self):
+        try:
+            info = {}
+            try:
+                with METRICS.timer('vesta_subprocess_duration_seconds', cmd='lsblk'):
+                    info['lsblk'] = subprocess.run(['lsblk', '-a'], capture_output=True, text=True, timeout=5).stdout
+            except Exception as e: info['lsblk'] = f"Error: {e}"
+            info['devices'] = DEVICES.snapshot()[1]
+            info['mounted_paths'] = list(MOUNTED_PATHS)
+            info['settings'] = SETTINGS
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.end_headers()
+            self.wfile.write(json.dumps(info).encode())
+        except Exception as e:
+            self.send_json_error(500, str(e))
+
+    def is_path_safe(self, path):
+        # Allow common root directories and external storage. '..' is resolved first,
+        # and a root only covers itself and what is below it (/root, not /rootX)
+        path = os.path.normpath(path)
+        return any(path == root or path.startswith(root + '/') for root in ALLOWED_ROOTS)
+
+    def list_files(self, mountpath, query):
+        # Without limit/cursor: the whole folder as a plain array, as before.
+        # With them: {entries, total, offset, nextCursor}, sorted by sort=name|size|mtime
+        # and order=asc|desc, folders first. The cursor names the last entry sent, so
+        # paging stays in step when entries are added or removed in between.
+        if not self.is_path_safe(mountpath):
+             self.send_json_error(403, f"Forbidden: Accessing {mountpath} is not allowed.")
+             return
+        paged = 'limit' in query or 'cursor' in query
+        sort = query.get('sort', ['name'])[0]
+        order = query.get('order', ['asc'])[0]
+        try:
+            limit = min(int(query.get('limit', [LIST_PAGE_MAX])[0]), LIST_PAGE_MAX)
+            after, offset = decode_cursor(query['cursor'][0]) if 'cursor' in query else (None, 0)
+        except (TypeError, ValueError):
+            self.send_json_error(400, "Invalid limit or cursor")
+            return
+        if sort not in SORT_KEYS or order not in ('asc', 'desc') or limit < 1:
+            self.send_json_error(400, "Invalid sort, order or limit")
+            return
+        try:
+            try:
+                listing = DIR_CACHE.get(mountpath)
+            except (FileNotFoundError, NotADirectoryError):
+                listing = Listing([], 0, 0, 0, False)
+            if not paged:
+                if listing.json is None:
+                    listing.json = json_body(listing.entries)
+                self.send_cached_json(*listing.json)
+                return
+            entries, index = listing.ordered(sort, order)
+            start = index[after] + 1 if after in index else min(offset, len(entries))
+            page = entries[start:start + limit]
+            end = start + len(page)
+            self.send_cached_json(*json_body({
+                'entries': page,
+                'total': len(entries),
+                'offset': start,
+                'nextCursor': encode_cursor(page[-1]['name'], end) if end < len(entries) else None,
+            }))
+        except Exception as e:
+            self.send_json_error(500, str(e))
+
+    def download_file(self, filepath):
+        filepath = os.path.normpath(filepath)
+        if not self.is_path_safe(filepath):
+             self.send_json_error(403, "Forbidden")
+             return
+        if not os.path.exists(filepath) or os.path.isdir(filepath):
+            self.send_json_error(404, "File Not Found")
+            return
+        try:
+            with open(filepath, 'rb') as f:
+                st = os.fstat(f.fileno())
+                size = st.st_size
+                etag = f'"{st.st_mtime_ns:x}-{size:x}"'
+                validators = [('ETag', etag), ('Last-Modified', email.utils.formatdate(st.st_mtime, usegmt=True))]
+
+                if self.not_modified(etag, st.st_mtime):
+                    self.send_response(304)
+                    for name, value in validators:
+                        self.send_header(name, value)
+                    self.end_headers()
+                    return
+
+                ranges = None
+                if self.headers.get('Range') and self.if_range_matches(etag, st.st_mtime):
+                    ranges = parse_ranges(self.headers['Range'], size)
+                if ranges == []:
+                    self.send_response(416)
+                    self.send_header('Content-Range', f'bytes */{size}')
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+
+                self.send_response(206 if ranges else 200)
+                for name, value in validators:
+                    self.send_header(name, value)
+                self.send_header('Accept-Ranges', 'bytes')
+                self.send_header('Content-Disposition', f'attachment; filename="{os.path.basename(filepath)}"')
+                if not ranges:
+                    self.send_header('Content-Type', 'application/octet-stream')
+                    self.send_header('Content-Length', str(size))
+                    self.end_headers()
+                    self.send_file_range(f, 0, size)
+                elif len(ranges) == 1:
+                    start, end = ranges[0]
+                    self.send_header('Content-Type', 'application/octet-stream')
+                    self.send_header('Content-Range', f'bytes {start}-{end}/{size}')
+                    self.send_header('Content-Length', str(end - start + 1))
+                    self.end_headers()
+                    self.send_file_range(f, start, end - start + 1)
+                else:
+                    boundary = os.urandom(12).hex()
+                    heads = [(f'\r\n--{boundary}\r\nContent-Type: application/octet-stream\r\n'
+                              f'Content-Range: bytes {start}-{end}/{size}\r\n\r\n').encode()
+                             for start, end in ranges]
+                    tail = f'\r\n--{boundary}--\r\n'.encode()
+                    length = sum(len(h) for h in heads) + sum(e - s + 1 for s, e in ranges) + len(tail)
+                    self.send_header('Content-Type', f'multipart/byteranges; boundary={boundary}')
+                    self.send_header('Content-Length', str(length))
+                    self.end_headers()
+                    for head, (start, end) in zip(heads, ranges):
+                        self.wfile.write(head)
+                        self.send_file_range(f, start, end - start + 1)
+                    self.wfile.write(tail)
+        except Exception: pass
+
+    def download_archive(self, paths, query):
+        # A folder, or several path= entries, as one zip/tar built while it is sent.
+        # zip deflates each file unless compress=0 or it is already compressed; tgz
+        # gzips the whole tar. The size isn't known up front, so HTTP/1.1 clients get
+        # chunked encoding and HTTP/1.0 clients read until the connection closes.
+        fmt = query.get('format', ['zip'])[0]
+        if fmt not in ARCHIVE_FORMATS:
+            self.send_json_error(400, f"Unknown format: {fmt}")
+            return
+        roots = []
+        for p in paths:
+            p = os.path.normpath(p)
+            if not self.is_path_safe(p):
+                self.send_json_error(403, "Forbidden")
+                return
+            if not os.path.exists(p):
+                self.send_json_error(404, f"Not Found: {p}")
+                return
+            if p not in roots:
+                roots.append(p)
+
+        name = query.get('name', [os.path.basename(roots[0]) if len(roots) == 1 else 'download'])[0]
+        name = name.replace('"', '').replace('/', '_') or 'download'
+        out = self.start_stream(ARCHIVE_FORMATS[fmt], [
+            ('Content-Disposition', f'attachment; filename="{name}.{"tar.gz" if fmt == "tgz" else fmt}"')])
+        try:
+            if fmt == 'zip':
+                write_zip(out, roots, query.get('compress', ['1'])[0] != '0')
+            else:
+                write_tar(out, roots, fmt == 'tgz')
+            out.close()
+        except Exception as e:
+            # Client went away or a file failed mid-read; without the final chunk the
+            # client sees a truncated download rather than a silently short archive
+            print(f"[Archive] Aborted {', '.join(roots)}: {e}", flush=True)
+            self.close_connection = True
+        finally:
+            METRICS.inc('vesta_download_bytes_total', out.sent, kind='archive')
+
+    def start_stream(self, content_type, headers=()):
+        # 200 with a body of unknown length: chunked for HTTP/1.1 clients, read until
+        # the connection closes for HTTP/1.0 ones. Returns the ChunkedWriter to fill.
+        chunked = self.request_version == 'HTTP/1.1'
+        if chunked:
+            self.protocol_version = 'HTTP/1.1'
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        for name, value in headers:
+            self.send_header(name, value)
+        self.send_header('Cache-Control', 'no-store')
+        if chunked:
+            self.send_header('Transfer-Encoding', 'chunked')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        return ChunkedWriter(self.wfile, chunked)
+
+    def search_files(self, query):
+        # One JSON object per line (/api/files entries plus 'path'), flushed as rows come
+        # off the index, then {"done": true, "count", "truncated", "indexing"}
+        q = query.get('q', [''])[0]
+        mode = query.get('mode', ['substring'])[0]
+        scope = os.path.normpath(query.get('path', ['/'])[0])
+        try:
+            limit = min(int(query.get('limit', [SEARCH_LIMIT])[0]), SEARCH_LIMIT_MAX)
+        except ValueError:
+            limit = 0
+        if not q or mode not in SEARCH_MODES or limit < 1:
+            self.send_json_error(400, "Invalid q, mode or limit")
+            return
+        if scope != '/' and not self.is_path_safe(scope):
+            self.send_json_error(403, "Forbidden")
+            return
+        if SEARCH.db_path is None:
+            self.send_json_error(503, "Search index unavailable")
+            return
+        out = self.start_stream('application/x-ndjson')
+        count, truncated = 0, False
+        try:
+            for entry in SEARCH.search(q, mode, scope, query.get('dirs', ['1'])[0] != '0', limit + 1):
+                if count == limit:
+                    truncated = True
+                    break
+                out.write(json.dumps(entry).encode() + b'\n')
+                count += 1
+                if count in (1, 50) or count % 500 == 0:
+                    out.flush()
+            out.write(json.dumps({'done': True, 'count': count, 'truncated': truncated,
+                                  'indexing': SEARCH.indexing}).encode() + b'\n')
+            out.close()
+        except Exception as e:
+            print(f"[Search] {q!r} aborted: {e}", flush=True)
+            self.close_connection = True
+
+    def thumb_size(self, value):
+        try:
+            return min(max(int(value), 16), THUMB_SIZE_MAX)
+        except (TypeError, ValueError):
+            return THUMB_SIZE
+
+    def thumbnail(self, filepath, size):
+        # One thumbnail as image/jpeg; the ETag is the cache key, so revalidation is a stat
+        filepath = os.path.normpath(filepath)
+        if not self.is_path_safe(filepath):
+            self.send_json_error(403, "Forbidden")
+            return
+        try:
+            found = THUMBS.get(filepath, self.thumb_size(size))
+        except OSError:
+            found = None
+        except BrokenProcessPool:
+            self.send_json_error(503, "Thumbnail workers unavailable")
+            return
+        if found is None:
+            self.send_json_error(404, "No thumbnail")
+            return
+        key, done = found
+        etag = f'"{key}"'
+        if etag_in(self.headers.get('If-None-Match', ''), etag):
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            return
+        try:
+            result = done.result(timeout=THUMB_WAIT)
+        except FuturesTimeout:
+            # A stuck pdftoppm or a long queue: don't hold this handler thread any longer
+            THUMBS.cancel(key)
+            self.send_json_error(503, "Thumbnail not ready")
+            return
+        try:
+            with open(result, 'rb') as f:
+                data = f.read()
+        except (OSError, TypeError):
+            data = b''
+        if not data:
+            self.send_json_error(404, "No thumbnail")
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'image/jpeg')
+        self.send_header('Content-Length', str(len(data)))
+        self.send_header('ETag', etag)
+        self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+        self.wfile.write(data)
 
-            # 3. Windows/WSL drives (/mnt)
+    def thumbnails(self):
+        # Body: {"paths": [...], "size": px}. A page of files in one request: one NDJSON line
+        # per path, {"path", "thumb": data URL or null}, cached ones first and the rest as
+        # the pool finishes them. Types that never have a preview answer null right away.
+        try:
+            d = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+            paths = [str(p) for p in d.get('paths', [])][:THUMB_BATCH_MAX]
+            size = self.thumb_size(d.get('size', THUMB_SIZE))
+        except (TypeError, ValueError, AttributeError):
+            self.send_json_error(400, "Invalid")
+            return
+        out = self.start_stream('application/x-ndjson')
+        waiting = {}
+        try:
+            for p in paths:
+                try:
+                    path = os.path.normpath(p)  # Answered under the path as sent
+                    found = THUMBS.get(path, size) if self.is_path_safe(path) else None
+                except (OSError, BrokenProcessPool):
+                    found = None
+                if found is None:
+                    out.write(json.dumps({'path': p, 'thumb': None}).encode() + b'\n')
+                else:
+                    waiting.setdefault(found[1], []).append((p, found[0]))
+            out.flush()
             try:
-                if os.path.exists('/.host_raw'):
-                    for item in os.listdir('/.host_raw'):
-                        if len(item) == 1 and item.isalpha():
-                            mpath = os.path.join('/.host_raw', item)
-                            if os.path.exists(mpath) and mpath not in seen_mounts:
-                                # ONLY show if explicitly mounted
-                                if mpath in MOUNTED_PATHS or SETTINGS.get('usb_passthrough'):
-                                    storage['host'].append({
-                                        'name': f"host_{item}",
-                                        'label': f"Host {item.upper()}: Drive",
-                                        'mountpoint': mpath,
-                                        'size': 'Managed by Host'
-                                    })
-                                    seen_mounts.add(mpath)
-            except Exception as e:
-                print(f"/mnt scan failed: {e}", flush=True)
+                for done in as_completed(list(waiting), timeout=THUMB_WAIT):
+                    self.send_thumb(out, done, waiting.pop(done))
+            except FuturesTimeout:
+                # Whatever is still queued answers null; the client can ask again later
+                for callers in waiting.values():
+                    for p, key in callers:
+                        THUMBS.cancel(key)
+                        out.write(json.dumps({'path': p, 'thumb': None}).encode() + b'\n')
+                waiting.clear()
+            out.close()
+        except Exception as e:
+            print(f"[Thumbs] Batch aborted: {e}", flush=True)
+            self.close_connection = True
+            for callers in waiting.values():
+                for _, key in callers:
+                    THUMBS.cancel(key)
 
-            # 4. Docker Desktop Windows mounts (/host_mnt)
-            try:
-                if os.path.exists('/host_mnt'):
-                    for item in os.listdir('/host_mnt'):
-                        mpath = os.path.join('/host_mnt', item)
-                        if os.path.exists(mpath) and mpath not in seen_mounts:
-                           if mpath in MOUNTED_PATHS or SETTINGS.get('usb_passthrough'):
-                                storage['host'].append({
-                                    'name': f"host_{item}",
-                                    'label': f"Docker Host {item.upper()}:",
-                                    'mountpoint': mpath,
-                                    'size': 'Managed by Host'
-                                })
-                                seen_mounts.add(mpath)
-            except Exception as e:
-                pass
+    def send_thumb(self, out, done, callers):
+        # One finished generation -> an NDJSON line for each path in the batch that asked for it
+        try:
+            with open(done.result(), 'rb') as f:
+                data = f.read()
+        except (OSError, TypeError):
+            data = b''
+        thumb = 'data:image/jpeg;base64,' + base64.b64encode(data).decode() if data else None
+        for p, _ in callers:
+            out.write(json.dumps({'path': p, 'thumb': thumb}).encode() + b'\n')
+        out.flush()
 
-            # 5. /media (Traditional Linux USB)
+    def stat_path(self, path):
+        # One /api/files entry (plus 'path') for a single file or folder
+        path = os.path.normpath(path)
+        if not self.is_path_safe(path):
+            self.send_json_error(403, "Forbidden")
+            return
+        try:
             try:
-                if os.path.exists('/media'):
-                    for item in os.listdir('/media'):
-                        mpath = os.path.join('/media', item)
-                        if os.path.isdir(mpath) and mpath not in seen_mounts:
-                            storage['portable'].append({
-                                'name': item,
-                                'label': f"USB: {item}",
-                                'mountpoint': mpath,
-                                'size': 'Unknown'
-                            })
-                            seen_mounts.add(mpath)
-            except Exception as e:
-                print(f"/media scan failed: {e}", flush=True)
+                st = os.stat(path)
+            except FileNotFoundError:
+                st = os.lstat(path)  # Dangling symlink
+        except FileNotFoundError:
+            self.send_json_error(404, "Not Found")
+            return
+        is_dir = stat.S_ISDIR(st.st_mode)
+        self.send_json({'path': path, 'name': os.path.basename(path), 'isDir': is_dir,
+                        'size': 0 if is_dir else st.st_size, 'mtime': int(st.st_mtime)})
 
-            self.send_response(200)
-            self.send_header('Content-Type', 'application/json')
-            self.end_headers()
-            self.wfile.write(json.dumps(storage).encode())
+    def make_dir(self, path, parents=False):
+        path = os.path.normpath(path)
+        if not self.is_path_safe(path) or path in ALLOWED_ROOTS:
+            self.send_json_error(403, "Forbidden")
+            return
+        try:
+            if parents:
+                os.makedirs(path, exist_ok=True)
+            else:
+                os.mkdir(path)
+        except FileExistsError:
+            self.send_json_error(409, "Already exists")
+            return
+        except FileNotFoundError:
+            self.send_json_error(404, "Folder Not Found")
+            return
+        except OSError as e:
+            self.send_json_error(500, str(e))
+            return
+        dir_changed(os.path.dirname(path))
+        self.send_json({'status': 'ok', 'path': path}, 201)
+
+    def delete_path(self, path):
+        # Files and symlinks are unlinked, folders removed with everything in them.
+        # Roots and mount points are refused: unmount a drive instead of emptying it.
+        path = os.path.normpath(path)
+        if not self.is_path_safe(path) or path in ALLOWED_ROOTS or os.path.ismount(path):
+            self.send_json_error(403, "Forbidden")
+            return
+        try:
+            if os.path.isdir(path) and not os.path.islink(path):
+                shutil.rmtree(path)
+                DIR_CACHE.invalidate(path)
+            else:
+                os.unlink(path)
+        except FileNotFoundError:
+            self.send_json_error(404, "Not Found")
+            return
+        except OSError as e:
+            self.send_json_error(500, str(e))
+            return
+        dir_changed(os.path.dirname(path))
+        self.send_json({'status': 'ok', 'path': path})
+
+    def batch(self):
+        # Body: {"ops": [{"op": "list", "path": ..., "id": optional}, ...]}. One NDJSON line
+        # per op as it finishes, {"id", "op", "status", "body"[, "etag"]}, then {"done": true}.
+        # Ops run on BATCH_POOL; a write waits for earlier ops on an overlapping path, so
+        # [delete x, list parent] still lists after the delete.
+        try:
+            d = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+            ops = d['ops']
+            if not isinstance(ops, list) or not 0 < len(ops) <= BATCH_MAX_OPS:
+                raise ValueError
+            for op in ops:
+                if op['op'] not in BATCH_OPS or not isinstance(op.get('path', ''), str):
+                    raise ValueError
+        except (TypeError, ValueError, KeyError, AttributeError):
+            self.send_json_error(400, f"Invalid: expected {{\"ops\": [...]}} with up to {BATCH_MAX_OPS} of {', '.join(BATCH_OPS)}")
+            return
+        paths = [batch_paths(op) for op in ops]
+        after = [[j for j in range(i) if batch_conflict(ops[i], paths[i], ops[j], paths[j])]
+                 for i in range(len(ops))]
+        out = self.start_stream('application/x-ndjson')
+        running, finished = {}, set()
+        try:
+            queued = list(range(len(ops)))
+            while queued or running:
+                for i in [i for i in queued if all(j in finished for j in after[i])]:
+                    queued.remove(i)
+                    running[BATCH_POOL.submit(BatchCall(self, ops[i]).run)] = i
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    i = running.pop(future)
+                    finished.add(i)
+                    out.write(json.dumps({'id': ops[i].get('id', i), 'op': ops[i]['op'],
+                                          **future.result()}).encode() + b'\n')
+                out.flush()
+            out.write(json.dumps({'done': True, 'count': len(ops)}).encode() + b'\n')
+            out.close()
         except Exception as e:
-            self.send_json_error(500, f"Critical list_usbs failure: {str(e)}")
+            print(f"[Batch] Aborted: {e}", flush=True)
+            self.close_connection = True
+            for future in running:
+                future.cancel()
 
-    def debug_info(self):
+    def not_modified(self, etag, mtime):
+        # If-None-Match wins over If-Modified-Since when both are sent
+        if self.headers.get('If-None-Match'):
+            return etag_in(self.headers['If-None-Match'], etag)
+        since = http_date(self.headers.get('If-Modified-Since'))
+        return since is not None and int(mtime) <= since
+
+    def if_range_matches(self, etag, mtime):
+        # A stale If-Range means the client's partial copy is useless: send the whole file
+        validator = self.headers.get('If-Range')
+        if not validator:
+            return True
+        if validator.startswith(('"', 'W/')):
+            return etag_in(validator, etag, weak=False)
+        return http_date(validator) == int(mtime)
+
+    def send_file_range(self, f, offset, count):
+        # Zero-copy from the page cache when possible, then plain reads for whatever is left
+        wanted = count
         try:
-            info = {}
+            if USE_SENDFILE:
+                sent = self.sendfile(f, offset, count)
+                offset += sent
+                count -= sent
+            f.seek(offset)
+            while count > 0:
+                chunk = f.read(min(count, COPY_CHUNK))
+                if not chunk: break
+                self.wfile.write(chunk)
+                count -= len(chunk)
+        finally:
+            METRICS.inc('vesta_download_bytes_total', wanted - count, kind='file')
+
+    def sendfile(self, f, offset, count):
+        # Bytes sent; stops early if the file can't be sendfile'd or shrank underneath us
+        self.wfile.flush()
+        total = 0
+        while total < count:
             try:
-                info['lsblk'] = subprocess.run(['lsblk', '-a'], capture_output=True, text=True, timeout=5).stdout
-            except Exception as e: info['lsblk'] = f"Error: {e}"
-            info['mounted_paths'] = list(MOUNTED_PATHS)
-            info['settings'] = SETTINGS
+                sent = os.sendfile(self.connection.fileno(), f.fileno(), offset + total, count - total)
+            except OSError as e:
+                if e.errno in (errno.EINVAL, errno.ENOSYS, errno.EOPNOTSUPP):
+                    break
+                raise
+            if not sent: break
+            total += sent
+        return total
+
+    def upload_file(self, dest_path):
+        if not self.is_path_safe(dest_path):
+             self.send_json_error(403, "Forbidden")
+             return
+        filename = self.headers.get('X-File-Name', 'uploaded_file')
+        if filename in ('', '.', '..') or os.path.basename(filename) != filename:
+            self.send_json_error(400, "Invalid file name")
+            return
+        full_path = os.path.join(os.path.normpath(dest_path), filename)
+        if not self.is_path_safe(full_path):
+            self.send_json_error(403, "Forbidden")
+            return
+        try:
+            content_length = int(self.headers['Content-Length'])
+            remaining = content_length
+            try:
+                with open(full_path, 'wb') as f:
+                    while remaining > 0:
+                        chunk = self.rfile.read(min(remaining, 65536))
+                        if not chunk: break
+                        f.write(chunk)
+                        remaining -= len(chunk)
+            finally:
+                METRICS.inc('vesta_upload_bytes_total', content_length - remaining, kind='file')
+            dir_changed(dest_path)
             self.send_response(200)
-            self.send_header('Content-Type', 'application/json')
             self.end_headers()
-            self.wfile.write(json.dumps(info).encode())
+            self.wfile.write(b"Upload Successful")
         except Exception as e:
             self.send_json_error(500, str(e))
 
-    def is_path_safe(self, path):
-        # Allow common root directories and external storage
-        allowed_prefixes = ['/root', '/media', '/.host_raw', '/host_mnt', '/mnt/browser']
-        return any(path.startswith(p) for p in allowed_prefixes)
+    def send_json(self, data, code=200):
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.end_headers()
+        self.wfile.write(json.dumps(data).encode())
 
-    def list_files(self, mountpath):
-        if not self.is_path_safe(mountpath):
-             self.send_json_error(403, f"Forbidden: Accessing {mountpath} is not allowed.")
-             return
-        try:
-            files = []
-            if os.path.exists(mountpath):
-                for item in os.listdir(mountpath):
-                    ipath = os.path.join(mountpath, item)
-                    files.append({
-                        'name': item,
-                        'isDir': os.path.isdir(ipath),
-                        'size': os.path.getsize(ipath) if not os.path.isdir(ipath) else 0
-                    })
+    def send_cached_json(self, body, etag, headers=()):
+        # For the polled endpoints: a client sending back the ETag of what it already has
+        # gets a 304 and no body. no-cache makes browsers revalidate that way on every
+        # fetch(); bodies past JSON_COMPRESS_MIN go out br/gzip-encoded from JSON_CACHE
+        if etag_in(self.headers.get('If-None-Match', ''), etag[2:]):
+            self.send_response(304)
+        else:
+            encoding = accept_encoding(self.headers.get('Accept-Encoding')) if len(body) >= JSON_COMPRESS_MIN else None
+            if encoding:
+                body = JSON_CACHE.get(etag, encoding, body)
             self.send_response(200)
             self.send_header('Content-Type', 'application/json')
-            self.end_headers()
-            self.wfile.write(json.dumps(files).encode())
-        except Exception as e:
-            self.send_json_error(500, str(e))
+            self.send_header('Content-Length', str(len(body)))
+            if encoding:
+                self.send_header('Content-Encoding', encoding)
+        self.send_header('ETag', etag)
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Vary', 'Accept-Encoding')
+        for name, value in headers:
+            self.send_header(name, str(value))
+        self.end_headers()
+        if self.status == 200:
+            self.wfile.write(body)
 
-    def download_file(self, filepath):
-        if not self.is_path_safe(filepath):
+    def send_metrics(self):
+        body = METRICS.render().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def upload_init(self, dest_dir):
+        # Body: {"name": str, "size": int, "sha256": optional hex digest checked on completion}
+        dest_dir = os.path.normpath(dest_dir)
+        if not self.is_path_safe(dest_dir):
              self.send_json_error(403, "Forbidden")
              return
-        if not os.path.exists(filepath) or os.path.isdir(filepath):
-            self.send_json_error(404, "File Not Found")
+        try:
+            d = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+            name = os.path.basename(str(d.get('name', '')))
+            size = int(d.get('size', -1))
+            sha256 = d.get('sha256')
+        except (TypeError, ValueError):
+            self.send_json_error(400, "Invalid")
+            return
+        if name in ('', '.', '..') or name.startswith(UPLOAD_PREFIX) or size < 0:
+            self.send_json_error(400, "Invalid name or size")
+            return
+        dest = os.path.join(dest_dir, name)
+        if not self.is_path_safe(dest):
+            self.send_json_error(403, "Forbidden")
+            return
+        if not os.path.isdir(dest_dir):
+            self.send_json_error(404, "Folder Not Found")
+            return
+        try:
+            st = os.statvfs(dest_dir)
+            if st.f_bavail * st.f_frsize < size:
+                self.send_json_error(507, "Not enough free space")
+                return
+            upload = Upload(os.urandom(16).hex(), dest, size,
+                            sha256.lower() if sha256 else None)
+        except OSError as e:
+            self.send_json_error(500, str(e))
+            return
+        with UPLOADS_LOCK:
+            UPLOADS[upload.id] = upload
+        print(f"[Upload] {upload.id}: {upload.dest} ({size} bytes)", flush=True)
+        self.send_json({'id': upload.id, 'chunkSize': UPLOAD_CHUNK, 'parallel': UPLOAD_PARALLEL})
+
+    def find_upload(self, upload_id):
+        upload = UPLOADS.get(upload_id)
+        if upload is None:
+            self.send_json_error(404, "Unknown upload")
+        return upload
+
+    def upload_chunk(self, upload_id, offset):
+        # Body: the bytes at [offset, offset + Content-Length). Chunks may arrive in any order,
+        # in parallel, and be re-sent; only bytes that reached the file are recorded.
+        upload = self.find_upload(upload_id)
+        if upload is None:
+            return
+        try:
+            offset = int(offset)
+            length = int(self.headers['Content-Length'])
+        except (TypeError, ValueError):
+            self.send_json_error(400, "Invalid offset or length")
+            return
+        if offset < 0 or length < 0 or offset + length > upload.size:
+            self.send_json_error(400, "Chunk outside the file")
+            return
+        with upload.lock:
+            if upload.finished:
+                self.send_json_error(409, "Upload already completed")
+                return
+            upload.writers += 1
+            upload.touched = time.time()
+        written = 0
+        try:
+            while written < length:
+                chunk = self.rfile.read(min(length - written, 65536))
+                if not chunk: break
+                view = memoryview(chunk)
+                while view:
+                    n = os.pwrite(upload.fd, view, offset + written)
+                    view = view[n:]
+                    written += n
+        except Exception as e:
+            print(f"[Upload] {upload.id}: chunk at {offset} failed after {written} bytes: {e}", flush=True)
+        finally:
+            METRICS.inc('vesta_upload_bytes_total', written, kind='chunk')
+            with upload.lock:
+                upload.add_range(offset, offset + written)
+                upload.writers -= 1
+                upload.touched = time.time()
+                cancelled = upload.finished and not upload.writers
+            if cancelled:
+                upload.discard()
+        if written < length:
+            self.send_json_error(400, f"Incomplete chunk: {written} of {length} bytes")
+            return
+        with upload.lock:
+            status = upload.status()
+            report = not status['missing'] or time.time() - upload.reported >= UPLOAD_PROGRESS_INTERVAL
+        if report:
+            upload.publish('active')
+        self.send_json({'received': status['received'], 'complete': not status['missing']})
+
+    def upload_status(self, upload_id):
+        upload = self.find_upload(upload_id)
+        if upload is None:
+            return
+        with upload.lock:
+            upload.touched = time.time()
+            status = upload.status()
+        self.send_json(status)
+
+    def upload_complete(self, upload_id):
+        upload = self.find_upload(upload_id)
+        if upload is None:
+            return
+        with upload.lock:
+            if upload.writers or upload.missing():
+                status = upload.status()
+                self.send_json({'error': "Upload incomplete", 'missing': status['missing']}, 409)
+                return
+            upload.finished = True
+        with UPLOADS_LOCK:
+            UPLOADS.pop(upload.id, None)
+        try:
+            os.fsync(upload.fd)
+            os.close(upload.fd)
+            upload.fd = -1
+            if upload.sha256 and file_sha256(upload.temp) != upload.sha256:
+                upload.discard()
+                upload.publish('failed')
+                self.send_json_error(422, "Checksum mismatch")
+                return
+            os.replace(upload.temp, upload.dest)
+        except Exception as e:
+            upload.discard()
+            upload.publish('failed')
+            self.send_json_error(500, str(e))
+            return
+        print(f"[Upload] {upload.id}: completed {upload.dest}", flush=True)
+        upload.publish('complete')
+        dir_changed(os.path.dirname(upload.dest))
+        self.send_json({'status': 'ok', 'path': upload.dest})
+
+    def delta_signature(self, path, block=None):
+        # DELTA_HEADER (size, mtime_ns, block) then a DELTA_RECORD per block of the file as it
+        # is now. Streamed as the file is read; the client starts matching on the first bytes.
+        path = os.path.normpath(path)
+        if not self.is_path_safe(path):
+            self.send_json_error(403, "Forbidden")
+            return
+        if block and not self.delta_block_ok(block):
+            return
+        if not self.delta_target_ok(path):
             return
         try:
+            f = open(path, 'rb')
+        except FileNotFoundError:
+            self.send_json_error(404, "File Not Found")
+            return
+        with f:
+            st = os.fstat(f.fileno())
+            block = int(block) if block else delta_block(st.st_size)
+            count = -(-st.st_size // block)
+            key = (path, st.st_size, st.st_mtime_ns, block)
+            sig = SIGNATURES.get(key)
             self.send_response(200)
             self.send_header('Content-Type', 'application/octet-stream')
-            self.send_header('Content-Disposition', f'attachment; filename="{os.path.basename(filepath)}"')
-            self.send_header('Content-Length', str(os.path.getsize(filepath)))
+            self.send_header('Content-Length', str(DELTA_HEADER.size + count * DELTA_RECORD.size))
+            self.send_header('Cache-Control', 'no-store')
             self.end_headers()
-            with open(filepath, 'rb') as f:
-                shutil.copyfileobj(f, self.wfile)
-        except Exception: pass
+            if sig is not None:
+                self.wfile.write(sig)
+                return
+            sig = bytearray(DELTA_HEADER.pack(st.st_size, st.st_mtime_ns, block))
+            sent = 0
+            with METRICS.timer('vesta_delta_signature_duration_seconds'):
+                for _ in range(count):
+                    data = f.read(block)
+                    # A file shrinking underneath us gets weak sum 0, which no block can have
+                    sig += DELTA_RECORD.pack(zlib.adler32(data), hashlib.sha256(data).digest()) if data \
+                        else bytes(DELTA_RECORD.size)
+                    if len(sig) - sent >= STREAM_CHUNK:
+                        self.wfile.write(sig[sent:])
+                        sent = len(sig)
+            self.wfile.write(sig[sent:])
+            after = os.fstat(f.fileno())
+            if (after.st_size, after.st_mtime_ns) == (st.st_size, st.st_mtime_ns):
+                SIGNATURES.put(key, bytes(sig))
 
-    def upload_file(self, dest_path):
-        if not self.is_path_safe(dest_path):
-             self.send_json_error(403, "Forbidden")
-             return
+    def delta_block_ok(self, block):
+        # Block sizes the server itself would choose; 0 or a negative one only failed later
         try:
-            content_length = int(self.headers['Content-Length'])
-            filename = self.headers.get('X-File-Name', 'uploaded_file')
-            full_path = os.path.join(dest_path, filename)
-            with open(full_path, 'wb') as f:
-                remaining = content_length
-                while remaining > 0:
-                    chunk = self.rfile.read(min(remaining, 65536))
-                    if not chunk: break
-                    f.write(chunk)
-                    remaining -= len(chunk)
-            self.send_response(200)
-            self.end_headers()
-            self.wfile.write(b"Upload Successful")
-        except Exception as e:
+            ok = DELTA_BLOCK_MIN <= int(block) <= DELTA_BLOCK_MAX
+        except ValueError:
+            ok = False
+        if not ok:
+            self.send_json_error(400, f"Block size must be {DELTA_BLOCK_MIN} to {DELTA_BLOCK_MAX} bytes")
+        return ok
+
+    def delta_target_ok(self, path):
+        # Deltas apply to regular files only; a folder would open fine and fail mid-copy
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            self.send_json_error(404, "File Not Found")
+            return False
+        if not stat.S_ISREG(st.st_mode):
+            self.send_json_error(400, "Not a regular file")
+            return False
+        return True
+
+    def delta_apply(self, path, query):
+        # Body: DELTA_REF and DELTA_LITERAL instructions that build the new file from blocks
+        # of the current one. base=size:mtime_ns:block names the signature they were made
+        # against; 412 if the file has changed since. Built in a temp file next to it, then
+        # renamed over it, so readers see the old file or the new one and never a mix.
+        path = os.path.normpath(path)
+        if not self.is_path_safe(path):
+            self.send_json_error(403, "Forbidden")
+            return
+        try:
+            size, mtime_ns, block = (int(v) for v in query.get('base', [''])[0].split(':'))
+            remaining = int(self.headers['Content-Length'])
+        except (TypeError, ValueError):
+            self.send_json_error(400, "Invalid base or Content-Length")
+            return
+        if not self.delta_block_ok(block) or not self.delta_target_ok(path):
+            self.close_connection = True
+            return
+        sha256 = query.get('sha256', [None])[0]
+        try:
+            base = os.open(path, os.O_RDONLY)
+        except FileNotFoundError:
+            self.send_json_error(404, "File Not Found")
+            return
+        temp = os.path.join(os.path.dirname(path), UPLOAD_PREFIX + os.urandom(8).hex())
+        reused = literal = 0
+        try:
+            st = os.fstat(base)
+            if (st.st_size, st.st_mtime_ns) != (size, mtime_ns):
+                self.send_json_error(412, "File changed since its signature was taken")
+                self.close_connection = True
+                return
+
+            def read(n):
+                nonlocal remaining
+                data = self.rfile.read(n) if 0 < n <= remaining else b''
+                if len(data) != n:
+                    raise ValueError("Truncated delta")
+                remaining -= n
+                return data
+
+            out = os.open(temp, os.O_WRONLY | os.O_CREAT | os.O_EXCL, stat.S_IMODE(st.st_mode))
+            try:
+                while remaining:
+                    op = read(1)
+                    if op == b'B':
+                        _, first, n = DELTA_REF.unpack(op + read(DELTA_REF.size - 1))
+                        offset = first * block
+                        if not n or offset >= size:
+                            raise ValueError("Block reference past the end of the file")
+                        length = min(n * block, size - offset)
+                        copy_range(base, out, offset, length)
+                        reused += length
+                    elif op == b'L':
+                        _, n = DELTA_LITERAL.unpack(op + read(DELTA_LITERAL.size - 1))
+                        if n > DELTA_LITERAL_MAX:
+                            raise ValueError("Literal too long")
+                        literal += n
+                        while n:
+                            chunk = read(min(n, COPY_CHUNK))
+                            os.write(out, chunk)
+                            n -= len(chunk)
+                    else:
+                        raise ValueError("Unknown instruction")
+                os.fsync(out)
+            finally:
+                os.close(out)
+                METRICS.inc('vesta_upload_bytes_total', literal, kind='delta')
+            if sha256 and file_sha256(temp) != sha256:
+                self.send_json_error(422, "Checksum mismatch")
+                return
+            os.replace(temp, path)
+            METRICS.inc('vesta_delta_reused_bytes_total', reused)
+        except ValueError as e:
+            self.send_json_error(400, f"Invalid delta: {e}")
+            self.close_connection = True
+            return
+        except OSError as e:
             self.send_json_error(500, str(e))
+            self.close_connection = True
+            return
+        finally:
+            os.close(base)
+            if os.path.lexists(temp):
+                os.unlink(temp)
+        print(f"[Upload] Delta {path}: {reused} bytes reused, {literal} sent", flush=True)
+        dir_changed(os.path.dirname(path))
+        self.send_json({'status': 'ok', 'path': path, 'size': reused + literal, 'reused': reused, 'literal': literal})
+
+    def upload_cancel(self, upload_id):
+        with UPLOADS_LOCK:
+            upload = UPLOADS.pop(upload_id, None)
+        if upload is None:
+            self.send_json_error(404, "Unknown upload")
+            return
+        upload.cancel()
+        upload.publish('cancelled')
+        self.send_json({'status': 'ok'})
 
     def import_file(self, source_path):
-        # ... logic as before ...
-        pass # Simplified for brevity, user didn't ask for import but if needed I'll re-add.
-        # Actually I should properly reimplement it since it was there.
-        try:
-            if not self.is_path_safe(source_path):
-                 self.send_json_error(403, "Forbidden")
-                 return
-            if not os.path.exists(source_path) or os.path.isdir(source_path):
-                self.send_json_error(404, "File Not Found")
+        # Copies into the Desktop as a background job; progress arrives as 'job' events.
+        # The job creates the Desktop if it is missing, once the source has checked out
+        self.start_job('copy', [source_path], '/root/Desktop', overwrite=True, make_dest=True)
+
+    def start_job(self, op, sources, dest, overwrite=False, make_dest=False):
+        if op not in ('copy', 'move') or not sources:
+            self.send_json_error(400, "Invalid job")
+            return
+        sources = [os.path.normpath(p).rstrip('/') or '/' for p in sources]
+        dest = os.path.normpath(dest)
+        if not all(self.is_path_safe(p) for p in sources + [dest]):
+            self.send_json_error(403, "Forbidden")
+            return
+        missing = [p for p in sources if not os.path.lexists(p)]
+        if missing:
+            self.send_json_error(404, f"Not Found: {missing[0]}")
+            return
+        if not os.path.isdir(dest) and not (make_dest and not os.path.lexists(dest)):
+            self.send_json_error(404, "Folder Not Found")
+            return
+        real_dest = os.path.realpath(dest) + os.sep
+        for p in sources:
+            if os.path.isdir(p) and real_dest.startswith(os.path.realpath(p) + os.sep):
+                self.send_json_error(400, f"Cannot {op} {p} into itself")
                 return
-            filename = os.path.basename(source_path)
-            dest_path = os.path.join('/root/Desktop', filename)
-            shutil.copy2(source_path, dest_path)
-            self.send_response(200)
-            self.end_headers()
-            self.wfile.write(json.dumps({'status': 'ok'}).encode())
-        except Exception as e:
-            self.send_json_error(500, str(e))
+            if op == 'move' and os.path.dirname(p) == dest:
+                self.send_json_error(400, f"{p} is already in {dest}")
+                return
+        job = Job(os.urandom(8).hex(), op, sources, dest, overwrite, make_dest)
+        JOBS.submit(job)
+        self.send_json(job.status(), 202)
+
+    def job_submit(self):
+        # Body: {"op": "copy"|"move", "sources": [paths], "dest": folder, "overwrite": false}
+        try:
+            d = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+            sources = [str(p) for p in d.get('sources', [])]
+            self.start_job(str(d.get('op', 'copy')), sources, str(d.get('dest', '')), bool(d.get('overwrite')))
+        except (TypeError, ValueError, AttributeError):
+            self.send_json_error(400, "Invalid")
+
+    def job_status(self, job_id):
+        if job_id is None:
+            self.send_json(JOBS.list())
+            return
+        job = JOBS.get(job_id)
+        if job is None:
+            self.send_json_error(404, "Unknown job")
+            return
+        self.send_json(job.status())
+
+    def job_cancel(self, job_id):
+        if JOBS.cancel(job_id) is None:
+            self.send_json_error(404, "Unknown job")
+            return
+        self.send_json({'status': 'ok'})
 
     def list_usb_devices(self):
         try:
             devices = []
             # 1. Hardware
             try:
-                result = subprocess.run(['lsblk', '-J', '-o', 'NAME,SIZE,TYPE,MOUNTPOINT,RM,LABEL'],
-                                      capture_output=True, text=True, timeout=5)
-                if result.returncode == 0 and result.stdout.strip():
-                    data = json.loads(result.stdout)
+                _, data = DEVICES.snapshot()
+                if data:
                     for device in data.get('blockdevices', []):
                         if (device.get('rm') in ['1', True]) and device.get('type') == 'disk':
                             dev_info = {
@@ -347,7 +3117,7 @@ class USBHandler(http.server.BaseHTTPRequestHandler):
             for scan_path in ['/.host_raw', '/host_mnt']:
                 if os.path.exists(scan_path):
                     try:
-                        for item in os.listdir(scan_path):
+                        for item in [e['name'] for e in dir_entries(scan_path)]:
                             if len(item) == 1 and item.isalpha() and item.lower() != 'c':
                                 mpath = os.path.join(scan_path, item)
                                 # Check if already in MOUNTED_PATHS
@@ -362,13 +3132,61 @@ class USBHandler(http.server.BaseHTTPRequestHandler):
                                 })
                     except: pass
             
-            self.send_response(200)
-            self.send_header('Content-Type', 'application/json')
-            self.end_headers()
-            self.wfile.write(json.dumps({'devices': devices}).encode())
+            self.send_cached_json(*json_body({'devices': devices}),
+                                  headers=[('X-Devices-Version', DEVICES.version)])
         except Exception as e:
             self.send_json_error(500, str(e))
 
+    def device_changes(self, since):
+        # Without since: the device table and its version. With since: what changed after
+        # that version, or reset if the feed no longer reaches back that far.
+        if since is None:
+            version, tree = DEVICES.snapshot()
+            self.send_json({'version': version, **tree})
+            return
+        try:
+            version, changes = DEVICES.changes_since(int(since))
+        except ValueError:
+            self.send_json_error(400, "Invalid version")
+            return
+        if changes is None:
+            self.send_json({'version': version, 'reset': True})
+        else:
+            self.send_json({'version': version, 'changes': changes})
+
+    def stream_events(self, since):
+        # Server-Sent Events. The threaded server spends a thread per subscriber here;
+        # under --async this route is served on the event loop instead (see serve_events).
+        if not EVENTS.subscribe():
+            self.send_json_error(503, "Too many event subscribers")
+            return
+        try:
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/event-stream')
+            self.send_header('Cache-Control', 'no-cache')
+            self.end_headers()
+            seq, chunk = sse_start(since)
+            self.wfile.write(chunk)
+            while True:
+                EVENTS.wait(seq, EVENT_KEEPALIVE)
+                seq, chunk = sse_next(seq)
+                self.wfile.write(chunk)
+        except OSError:
+            pass  # Client went away
+        finally:
+            EVENTS.unsubscribe()
+
+    def poll_events(self, since, timeout):
+        # Long-poll fallback for clients without EventSource
+        try:
+            timeout = min(float(timeout), EVENT_POLL_TIMEOUT)
+        except ValueError:
+            self.send_json_error(400, "Invalid timeout")
+            return
+        if since is not None:
+            EVENTS.wait(since, timeout)
+        self.send_json(poll_result(since))
+
     def mount_usb(self, device):
         try:
             if not device:
@@ -384,6 +3202,7 @@ class USBHandler(http.server.BaseHTTPRequestHandler):
                         break
                 if found_path:
                     MOUNTED_PATHS.add(found_path)
+                    DEVICES.record('mount', device)
                     
                     # Create User-Visible Symlink in /media/USB_DRIVE
                     try:
@@ -419,7 +3238,8 @@ class USBHandler(http.server.BaseHTTPRequestHandler):
             device_path = f'/dev/{device}'
             if not os.path.exists(device_path) and not device.endswith('1'):
                  device_path += '1'
-            subprocess.run(['mount', device_path, mount_point], capture_output=True)
+            with METRICS.timer('vesta_subprocess_duration_seconds', cmd='mount'):
+                subprocess.run(['mount', device_path, mount_point], capture_output=True)
             self.send_response(200)
             self.send_header('Content-Type', 'application/json')
             self.end_headers()
@@ -445,6 +3265,7 @@ class USBHandler(http.server.BaseHTTPRequestHandler):
                 if found_path:
                     if found_path in MOUNTED_PATHS:
                         MOUNTED_PATHS.remove(found_path)
+                        DEVICES.record('unmount', device)
                     
                     # Cleanup Symlink
                     try:
@@ -470,7 +3291,8 @@ class USBHandler(http.server.BaseHTTPRequestHandler):
             mount_point = '/media/USB_DRIVE'
             # Note: This is simplified, assumes only one hardware mount can exist at a time in /media/USB_DRIVE
             # In a more complex setup, we'd track partitions.
-            result = subprocess.run(['umount', mount_point], capture_output=True, text=True)
+            with METRICS.timer('vesta_subprocess_duration_seconds', cmd='umount'):
+                result = subprocess.run(['umount', mount_point], capture_output=True, text=True)
             if result.returncode == 0:
                 self.send_response(200)
                 self.send_header('Content-Type', 'application/json')
@@ -520,10 +3342,7 @@ class USBHandler(http.server.BaseHTTPRequestHandler):
             self.send_json_error(500, str(e))
 
     def get_settings(self):
-        self.send_response(200)
-        self.send_header('Content-Type', 'application/json')
-        self.end_headers()
-        self.wfile.write(json.dumps(SETTINGS).encode())
+        self.send_cached_json(*json_body(SETTINGS))
 
     def update_settings(self):
         try:
@@ -568,7 +3387,297 @@ class USBHandler(http.server.BaseHTTPRequestHandler):
         except Exception as e:
             self.send_json_error(500, str(e))
 
+def batch_paths(op):
+    # Paths an operation reads or changes, normalized the way the handlers see them
+    if op['op'] == 'import':
+        return [os.path.normpath(op.get('path', '')), '/root/Desktop']
+    return [os.path.normpath(op['path'])] if 'path' in op else []
+
+def batch_conflict(op, paths, earlier, earlier_paths):
+    # Reads never wait on reads; anything involving a write waits when one path contains the other
+    if op['op'] not in BATCH_WRITES and earlier['op'] not in BATCH_WRITES:
+        return False
+    return any(a == b or a.startswith(b.rstrip('/') + '/') or b.startswith(a.rstrip('/') + '/')
+               for a in paths for b in earlier_paths)
+
+BATCH_POOL = ThreadPoolExecutor(BATCH_WORKERS, thread_name_prefix='batch')
+
+class BatchCall(USBHandler):
+    """One /api/batch operation run through the ordinary route method, with the
+    response captured instead of written to a socket."""
+
+    def __init__(self, parent, op):
+        # Skip BaseRequestHandler.__init__, which would read from a socket
+        self.client_address = parent.client_address
+        self.server = None
+        self.request = None
+        self.command = 'GET'
+        self.request_version = 'HTTP/1.1'
+        self.op = op
+        self.headers = http.client.HTTPMessage()
+        if op.get('etag'):
+            self.headers['If-None-Match'] = str(op['etag'])
+        self.response_headers = {}
+        self.wfile = io.BytesIO()
+
+    def send_response(self, code, message=None):
+        self.status = code
+
+    def send_header(self, keyword, value):
+        self.response_headers[keyword] = value
+
+    def end_headers(self):
+        pass
+
+    def run(self):
+        op, path = self.op['op'], self.op.get('path', '')
+        with METRICS.timer('vesta_batch_op_duration_seconds', op=op):
+            try:
+                if op == 'list':
+                    query = {k: [str(self.op[k])] for k in ('limit', 'cursor', 'sort', 'order') if k in self.op}
+                    self.list_files(path, query)
+                elif op == 'stat':
+                    self.stat_path(path)
+                elif op == 'mkdir':
+                    self.make_dir(path, bool(self.op.get('parents')))
+                elif op == 'delete':
+                    self.delete_path(path)
+                elif op == 'import':
+                    self.import_file(path)
+                elif op == 'drives':
+                    self.list_usbs()
+                elif op == 'devices':
+                    self.list_usb_devices()
+                elif op == 'settings':
+                    self.get_settings()
+            except Exception as e:
+                self.status = 500
+                self.wfile = io.BytesIO(json.dumps({'error': str(e)}).encode())
+        METRICS.inc('vesta_batch_ops_total', op=op, status=self.status)
+        result = {'status': self.status, 'body': None}
+        body = self.wfile.getvalue()
+        if body:
+            try:
+                result['body'] = json.loads(body)
+            except ValueError:
+                result['body'] = body.decode(errors='replace')
+        if 'ETag' in self.response_headers:
+            result['etag'] = self.response_headers['ETag']
+        return result
+
+
+# --- Asyncio server ---
+# The event loop owns every socket and reads request headers itself, so idle
+# keep-open tabs and slow clients cost no thread. Each parsed request is then
+# run through the same USBHandler routes on a bounded pool; the handler's
+# rfile/wfile hop back to the loop, so bodies stream in both directions with
+# the socket's backpressure instead of being buffered whole.
+
+class LoopReader:
+    """rfile for a handler on a worker thread: the already-read request head, then the socket."""
+
+    def __init__(self, loop, reader, head):
+        self.loop = loop
+        self.reader = reader
+        self.head = io.BytesIO(head)
+
+    def _run(self, coro):
+        return asyncio.run_coroutine_threadsafe(asyncio.wait_for(coro, IO_TIMEOUT), self.loop).result()
+
+    async def _read(self, n):
+        if n < 0:
+            return await self.reader.read()
+        try:
+            return await self.reader.readexactly(n)
+        except asyncio.IncompleteReadError as e:
+            return e.partial
+
+    def read(self, n=-1):
+        data = self.head.read(n)
+        if n < 0:
+            return data + self._run(self._read(-1))
+        if len(data) < n:
+            data += self._run(self._read(n - len(data)))
+        return data
+
+    def readline(self, limit=-1):
+        line = self.head.readline(limit)
+        if line.endswith(b'\n') or len(line) == limit:
+            return line
+        return line + self._run(self.reader.readline())
+
+
+class LoopWriter:
+    """wfile for a handler on a worker thread: writes are queued on the loop and drained every DRAIN_BYTES."""
+
+    def __init__(self, loop, writer):
+        self.loop = loop
+        self.writer = writer
+        self.buffer = bytearray()
+        self.undrained = 0
+
+    def _drain(self):
+        self.undrained = 0
+        asyncio.run_coroutine_threadsafe(asyncio.wait_for(self.writer.drain(), IO_TIMEOUT), self.loop).result()
+
+    def _push(self, data):
+        self.loop.call_soon_threadsafe(self.writer.write, data)
+        self.undrained += len(data)
+        if self.undrained >= DRAIN_BYTES:
+            self._drain()
+
+    def write(self, data):
+        if not self.buffer and len(data) >= STREAM_CHUNK:
+            # Large body chunks go straight out without an extra copy
+            self._push(bytes(data))
+            return len(data)
+        self.buffer += data
+        if len(self.buffer) >= STREAM_CHUNK:
+            self.flush()
+        return len(data)
+
+    def flush(self):
+        if self.buffer:
+            data = bytes(self.buffer)
+            self.buffer.clear()
+            self._push(data)
+        if self.undrained:
+            self._drain()
+
+    def sendfile(self, f, offset, count):
+        # loop.sendfile uses os.sendfile on the transport's socket, with its own fallback
+        self.flush()
+        total = 0
+        while total < count:
+            n = min(count - total, SENDFILE_CHUNK)
+            timeout = IO_TIMEOUT + n / SENDFILE_MIN_RATE
+            sent = asyncio.run_coroutine_threadsafe(
+                asyncio.wait_for(self.loop.sendfile(self.writer.transport, f, offset + total, n), timeout),
+                self.loop).result()
+            if not sent: break
+            total += sent
+        return total
+
+
+class AsyncUSBHandler(USBHandler):
+    """USBHandler driven by the asyncio server instead of socketserver."""
+    loop = None
+
+    def __init__(self, loop, reader, writer, head):
+        # Skip BaseRequestHandler.__init__, which would read from a socket
+        self.client_address = writer.get_extra_info('peername') or ('unknown', 0)
+        self.server = None
+        self.request = None
+        self.rfile = LoopReader(loop, reader, head)
+        self.wfile = LoopWriter(loop, writer)
+        self.close_connection = True
+
+    def sendfile(self, f, offset, count):
+        return self.wfile.sendfile(f, offset, count)
+
+    def handle(self):
+        try:
+            self.handle_one_request()
+            self.wfile.flush()
+        except (ConnectionError, asyncio.TimeoutError):
+            pass
+
+
+def raw_response(status, headers, body=b''):
+    lines = [f'HTTP/1.0 {status}'] + [f'{k}: {v}' for k, v in headers + CORS_HEADERS]
+    return ('\r\n'.join(lines) + '\r\n\r\n').encode() + body
+
+
+async def serve_events(writer, path, query, headers):
+    # /api/events and /api/events/poll straight on the loop: an idle subscriber is a
+    # parked future and a socket, not a thread
+    if path == '/api/events/poll':
+        since = parse_event_id(query.get('since', [None])[0])
+        try:
+            timeout = min(float(query.get('timeout', [EVENT_POLL_TIMEOUT])[0]), EVENT_POLL_TIMEOUT)
+        except ValueError:
+            timeout = EVENT_POLL_TIMEOUT
+        if since is not None:
+            await EVENTS.wait_async(since, timeout)
+        body = json.dumps(poll_result(since)).encode()
+        writer.write(raw_response('200 OK', [('Content-Type', 'application/json'),
+                                             ('Content-Length', str(len(body)))], body))
+        await writer.drain()
+        return
+
+    if not EVENTS.subscribe():
+        body = json.dumps({'error': "Too many event subscribers"}).encode()
+        writer.write(raw_response('503 Service Unavailable', [('Content-Type', 'application/json')], body))
+        return
+    try:
+        seq, chunk = sse_start(parse_event_id(query.get('since', [headers.get('Last-Event-ID')])[0]))
+        writer.write(raw_response('200 OK', [('Content-Type', 'text/event-stream'),
+                                             ('Cache-Control', 'no-cache')], chunk))
+        while True:
+            await asyncio.wait_for(writer.drain(), IO_TIMEOUT)
+            await EVENTS.wait_async(seq, EVENT_KEEPALIVE)
+            seq, chunk = sse_next(seq)
+            writer.write(chunk)
+    finally:
+        EVENTS.unsubscribe()
+
+
+async def handle_connection(reader, writer, executor):
+    loop = asyncio.get_running_loop()
+    try:
+        head = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), HEADER_TIMEOUT)
+        request_line, _, rest = head.partition(b'\r\n')
+        parts = request_line.decode('latin-1').split()
+        if len(parts) == 3 and parts[0] == 'GET':
+            target = urllib.parse.urlparse(parts[1])
+            if target.path in ('/api/events', '/api/events/poll'):
+                headers = http.client.parse_headers(io.BytesIO(rest))
+                await serve_events(writer, target.path, urllib.parse.parse_qs(target.query), headers)
+                return
+        handler = AsyncUSBHandler(loop, reader, writer, head)
+        await loop.run_in_executor(executor, handler.handle)
+    except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, asyncio.TimeoutError, ConnectionError):
+        pass
+    finally:
+        writer.close()
+        try:
+            await writer.wait_closed()
+        except Exception:
+            pass
+
+
+async def serve_async(port):
+    AsyncUSBHandler.loop = EVENTS.loop = asyncio.get_running_loop()
+    executor = ThreadPoolExecutor(ASYNC_WORKERS, thread_name_prefix='usb-api')
+    server = await asyncio.start_server(
+        lambda r, w: handle_connection(r, w, executor), '0.0.0.0', port, backlog=512)
+    async with server:
+        await server.serve_forever()
+
+
 if __name__ == '__main__':
-    print(f"Starting File Manager on port {PORT}...", flush=True)
-    server = http.server.ThreadingHTTPServer(('0.0.0.0', PORT), USBHandler)
-    server.serve_forever()
+    parser = argparse.ArgumentParser(description='VestaVNC USB / File Manager API')
+    parser.add_argument('--port', type=int, default=PORT)
+    parser.add_argument('--async', dest='use_async', action='store_true',
+                        help='serve from an asyncio event loop with a bounded handler pool')
+    parser.add_argument('--no-sendfile', dest='sendfile', action='store_false',
+                        help='copy downloads through userspace instead of sendfile(2)')
+    parser.add_argument('--search-db', default=SEARCH_DB,
+                        help='SQLite file for the search index (outside the indexed roots)')
+    args = parser.parse_args()
+    USE_SENDFILE = args.sendfile
+    THUMBS.start()
+    DIR_CACHE.start()
+    ACCESS_LOG.start()
+    threading.Thread(target=gc_uploads, daemon=True).start()
+    DEVICES.start()
+    SEARCH.db_path = args.search_db
+    SEARCH.start()
+
+    if args.use_async:
+        print(f"Starting File Manager (asyncio) on port {args.port}...", flush=True)
+        asyncio.run(serve_async(args.port))
+    else:
+        print(f"Starting File Manager on port {args.port}...", flush=True)
+        server = http.server.ThreadingHTTPServer(('0.0.0.0', args.port), USBHandler)
+        server.serve_forever()
@@ -1,148 +1,985 @@
-
 import os
+import re
 import sys
+import http
+import queue
+import bisect
 import errno
+import random
 import logging
+import logging.handlers
 import asyncio
 import websockets
 import threading
 import json
 import time
+import base64
+import struct
+import ctypes
+import itertools
+import urllib.parse
+import concurrent.futures
+from collections import OrderedDict
 from fuse import FUSE, FuseOSError, Operations
 
 # Configuration
 MOUNT_POINT = '/mnt/browser'
 WS_PORT = 6084
+REQUEST_TIMEOUT = 10  # seconds a FUSE op waits for the browser
+SESSION_GRACE = 30    # seconds a dropped session stays mounted awaiting a reconnect
+DEFAULT_SESSION = 'browser'  # for UI bundles that do not send ?session=
+# Safe to resend when the socket drops mid-request
+IDEMPOTENT_METHODS = ('GETATTR', 'READDIR', 'READ')
+
+# Binary frame protocol for data operations (READ/WRITE).
+# Metadata ops stay JSON; file contents travel as raw bytes behind a fixed
+# big-endian header instead of base64 inside JSON:
+#
+#   version u8 | opcode u8 | aux u16 | id u32 | offset u64 | length u32
+#
+# Requests: aux = byte length of the UTF-8 path that follows the header,
+#           then the payload (WRITE data). length = bytes to read / write.
+# Replies:  opcode | OP_REPLY, aux = status (0 or an errno value),
+#           length = bytes returned (READ) or written (WRITE), then payload.
+FRAME_VERSION = 1
+FRAME_HEADER = struct.Struct('!BBHIQI')
+OP_READ = 0x01
+OP_WRITE = 0x02
+OP_REPLY = 0x80
+MAX_FRAME_SIZE = 16 * 1024 * 1024
+
+# Metadata cache. Explorer-style clients stat every entry they show, so
+# getattr/readdir answers are kept for a short TTL. Raise the TTL for fewer
+# round trips, lower it if changes made in the browser must show up sooner.
+ATTR_CACHE_TTL = 2.0        # seconds
+NEGATIVE_CACHE_TTL = 1.0    # seconds an ENOENT answer is remembered
+ATTR_CACHE_ENTRIES = 8192
+DIR_CACHE_ENTRIES = 1024
+CACHE_STATS_INTERVAL = 60   # seconds between hit/miss log lines
+
+# File contents are cached in fixed blocks keyed by (path, block index).
+# Sequential readers get an adaptive read-ahead window that doubles on every
+# sequential read and is fetched in the background, so large copies are
+# limited by bandwidth instead of one browser round trip per kernel read.
+BLOCK_SIZE = 128 * 1024
+BLOCK_CACHE_BYTES = 64 * 1024 * 1024
+BLOCK_CACHE_TTL = 30.0      # seconds
+READAHEAD_MIN = 512 * 1024
+READAHEAD_MAX = 8 * 1024 * 1024      # 0 disables read-ahead
+PREFETCH_REQUEST = 1024 * 1024       # bytes per background READ
 
-# Logging
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+# Write-back: small kernel writes are merged per handle and sent as one
+# WRITE when the buffer fills, ages out, or on flush/fsync/release.
+WRITEBACK_CHUNK = 1024 * 1024        # flush a handle at this size; 0 = write-through
+WRITEBACK_MAX_AGE = 1.0              # seconds dirty data may sit in a buffer
+WRITEBACK_MAX_BYTES = 32 * 1024 * 1024   # across handles; beyond it writes go straight through
+
+# Metrics, served as Prometheus text at http://host:6084/metrics, and
+# per-operation log lines: slow or failed FUSE ops are always logged, the
+# rest sampled, so the log shows typical traffic without costing the hot path.
+METRIC_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)  # seconds
+OP_LOG_SAMPLE = 0.001       # fraction of ordinary FUSE ops logged
+OP_LOG_SLOW = 1.0           # seconds; slower ops are always logged
+
+# Logging: records are queued and written by a listener thread, so a FUSE
+# or event-loop thread never waits on the log file.
+log_queue = queue.SimpleQueue()
+log_output = logging.StreamHandler()
+log_output.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+logging.basicConfig(level=logging.INFO, handlers=[logging.handlers.QueueHandler(log_queue)])
+logging.handlers.QueueListener(log_queue, log_output).start()
 logger = logging.getLogger(__name__)
 
-# Global WebSocket connection
-connected_ws = None
-ws_lock = threading.Lock()
+def metric_labels(labels):
+    # Same escaping as usb_manager.py: paths may hold quotes, backslashes or newlines
+    if not labels:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in labels)
+    return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(labels, escaped)) + '}'
+
+class Metrics:
+    """Counters and latency histograms in the Prometheus text format. Thread safe.
+
+    Values other parts of the bridge already track (cache hit counts, open
+    sessions) are read by collectors when /metrics is scraped.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}    # (name, labels) -> value
+        self.histograms = {}  # (name, labels) -> [count per bucket..., +Inf, sum, count]
+        self.collectors = []  # callables returning [(name, type, {labels}, value)]
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, seconds, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        bucket = bisect.bisect_left(METRIC_BUCKETS, seconds)
+        with self.lock:
+            h = self.histograms.get(key)
+            if h is None:
+                h = self.histograms[key] = [0] * (len(METRIC_BUCKETS) + 3)
+            h[bucket] += 1
+            h[-2] += seconds
+            h[-1] += 1
+
+    def render(self):
+        families = {}  # name -> (type, [(suffix, labels, value)])
+        with self.lock:
+            for (name, labels), value in self.counters.items():
+                families.setdefault(name, ('counter', []))[1].append(('', labels, value))
+            for (name, labels), h in self.histograms.items():
+                rows = families.setdefault(name, ('histogram', []))[1]
+                total = 0
+                for le, n in zip(METRIC_BUCKETS + ('+Inf',), h):
+                    total += n
+                    rows.append(('_bucket', labels + (('le', le),), total))
+                rows.append(('_sum', labels, round(h[-2], 6)))
+                rows.append(('_count', labels, h[-1]))
+        for collect in self.collectors:
+            for name, kind, labels, value in collect():
+                families.setdefault(name, (kind, []))[1].append(('', tuple(sorted(labels.items())), value))
+        lines = []
+        for name in sorted(families):
+            kind, rows = families[name]
+            lines.append(f'# TYPE {name} {kind}')
+            lines.extend(f'{name}{suffix}{metric_labels(labels)} {value}' for suffix, labels, value in rows)
+        return '\n'.join(lines) + '\n'
+
+metrics = Metrics()
+
+class BrowserConnection:
+    """One browser socket."""
+    def __init__(self, websocket):
+        self.ws = websocket
+        # RPC multiplexing: every request gets a unique id and its own future,
+        # and the connection handler (the only reader) resolves them by id.
+        self.pending = {}  # id -> asyncio.Future; only touched on ws_loop
+        # Flipped on by the browser's HELLO; older UI bundles speak JSON only.
+        # Kept per socket: a reconnect may come from a different bundle.
+        self.binary_frames = False
+
+class BrowserSession:
+    """A browser exposing one folder, mounted at MOUNT_POINT/<id>.
+
+    Outlives its socket: a browser that reconnects with the same id gets
+    the same session back, and idempotent requests caught by the drop are
+    resent on the new socket.
+    """
+    def __init__(self, session_id):
+        self.id = session_id
+        self.prefix = '/' + session_id
+        self.conn = None  # current BrowserConnection, swapped on reconnect
+        self.online = asyncio.Event()
+        self.expiry = None  # TimerHandle that drops the session after SESSION_GRACE
+
+    @property
+    def binary_frames(self):
+        """Whether the current socket speaks binary frames."""
+        conn = self.conn
+        return conn is not None and conn.binary_frames
+
+    def local_path(self, path):
+        """Browser-side path -> FUSE path."""
+        return self.prefix if path == '/' else self.prefix + path
+
+    def remote_path(self, path):
+        """FUSE path -> path inside the browser's folder."""
+        return path[len(self.prefix):] or '/'
+
+class TTLCache:
+    """Bounded LRU map whose entries expire after a TTL. Thread safe.
+
+    With max_bytes set, values are sized with len() and least recently used
+    entries are evicted to keep the total within that budget.
+    """
+    def __init__(self, name, max_entries, ttl, max_bytes=None):
+        self.name = name
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.entries = OrderedDict()  # key -> (expires_at, value)
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _size(self, value):
+        return len(value) if self.max_bytes else 0
+
+    def _remove(self, key):
+        _, value = self.entries.pop(key)
+        self.bytes -= self._size(value)
+
+    def get(self, key):
+        """Return (True, value) for a fresh entry, (False, None) otherwise."""
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                if entry[0] > now:
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    return True, entry[1]
+                self._remove(key)
+            self.misses += 1
+            return False, None
+
+    def peek(self, key):
+        """Fresh value or None, without touching LRU order or counters."""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                return entry[1]
+            return None
+
+    def put(self, key, value, ttl=None):
+        expires = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self.lock:
+            if key in self.entries:
+                self._remove(key)
+            self.entries[key] = (expires, value)
+            self.bytes += self._size(value)
+            while len(self.entries) > self.max_entries or (self.max_bytes and self.bytes > self.max_bytes):
+                self._remove(next(iter(self.entries)))
+
+    def pop(self, key):
+        with self.lock:
+            if key in self.entries:
+                self._remove(key)
+
+    def discard(self, match):
+        """Drop every entry whose key satisfies match(key)."""
+        with self.lock:
+            for key in [k for k in self.entries if match(k)]:
+                self._remove(key)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.bytes = 0
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            stats = {
+                'entries': len(self.entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 3) if lookups else 0.0,
+            }
+            if self.max_bytes:
+                stats['bytes'] = self.bytes
+            return stats
+
+# getattr answers (None = cached ENOENT) and readdir name lists, keyed by path
+attr_cache = TTLCache('attr', ATTR_CACHE_ENTRIES, ATTR_CACHE_TTL)
+dir_cache = TTLCache('dir', DIR_CACHE_ENTRIES, ATTR_CACHE_TTL)
+# File contents, keyed by (path, block index). b'' marks end of file.
+block_cache = TTLCache('block', BLOCK_CACHE_BYTES // 4096, BLOCK_CACHE_TTL, max_bytes=BLOCK_CACHE_BYTES)
+
+def invalidate_blocks(path):
+    block_cache.discard(lambda key: key[0] == path)
+
+def invalidate_session(session):
+    """Forget everything cached under a session's mount."""
+    def under(path):
+        return path == session.prefix or path.startswith(session.prefix + '/')
+    attr_cache.discard(under)
+    dir_cache.discard(under)
+    block_cache.discard(lambda key: under(key[0]))
+
+def invalidate_path(path):
+    """Forget cached metadata and contents for path and the listing of its parent."""
+    attr_cache.pop(path)
+    dir_cache.pop(path)
+    dir_cache.pop(os.path.dirname(path) or '/')
+    invalidate_blocks(path)
+
+# Session registry: id -> BrowserSession. Only mutated on ws_loop; FUSE
+# threads route with plain dict lookups (atomic under the GIL), so the hot
+# path takes no lock.
+sessions = {}
+
+# itertools.count is atomic under the GIL, so FUSE threads draw ids lock-free.
+# Binary headers carry the id as u32, so it wraps well before overflowing.
+request_ids = itertools.count(1)
+
+def next_request_id():
+    return next(request_ids) % 0xFFFFFFFF + 1
+
+class FramePayload:
+    """READ reply data still sitting inside the received WebSocket frame.
+
+    fusepy copies read results into the kernel buffer with ctypes.memmove,
+    which honours _as_parameter_, so the bytes go from the frame to FUSE
+    without being sliced out first. The block cache holds these too: each
+    cached block keeps its whole frame alive.
+    """
+    __slots__ = ('frame', 'start', 'view', '_as_parameter_')
+
+    def __init__(self, frame, start, end=None):
+        self.frame = frame
+        self.start = start
+        self.view = memoryview(frame)[start:end]
+        base = ctypes.cast(ctypes.c_char_p(frame), ctypes.c_void_p).value
+        self._as_parameter_ = ctypes.c_void_p(base + start)
+
+    def __len__(self):
+        return len(self.view)
+
+    def slice(self, lo, hi):
+        """Bytes lo..hi of this payload, still pointing into the frame."""
+        hi = min(hi, len(self.view))
+        return FramePayload(self.frame, self.start + lo, self.start + hi)
+
+    def __bytes__(self):
+        return bytes(self.view)
+
+def check_response(response):
+    """Raise the FUSE error carried by a JSON reply, if any."""
+    if 'error' in response:
+        err = response['error']
+        if err == 'ENOENT': raise FuseOSError(errno.ENOENT)
+        if err == 'EACCES': raise FuseOSError(errno.EACCES)
+        raise FuseOSError(errno.EIO)
+
+def pack_frame(opcode, request_id, path, offset, length, payload=b''):
+    path_bytes = path.encode('utf-8')
+    header = FRAME_HEADER.pack(FRAME_VERSION, opcode, len(path_bytes), request_id, offset, length)
+    return b''.join((header, path_bytes, payload))
+
+class OpenFile:
+    """State kept per FUSE file handle."""
+    def __init__(self, path):
+        self.path = path
+        # Sequential read detection for read-ahead
+        self.next_offset = 0
+        self.readahead = 0
+        # Write-back buffer: one contiguous dirty range starting at buffer_offset
+        self.lock = threading.Lock()
+        self.buffer = bytearray()
+        self.buffer_offset = 0
+        self.buffered_since = 0.0
+        self.error = None  # errno of a failed background flush, reported once
+
+    def track_read(self, offset, length):
+        """Return the read-ahead window: grown on sequential reads, reset on seeks."""
+        # Threaded FUSE can deliver neighbouring reads slightly out of order
+        if self.next_offset - self.readahead - BLOCK_SIZE <= offset <= self.next_offset + BLOCK_SIZE:
+            self.readahead = min(max(self.readahead * 2, READAHEAD_MIN), READAHEAD_MAX)
+            self.next_offset = max(self.next_offset, offset + length)
+        else:
+            self.readahead = 0
+            self.next_offset = offset + length
+        return self.readahead
 
 class BrowserFS(Operations):
     def __init__(self):
-        self.files = {}
-        self.attr_cache = {}
+        self.files = {}  # fh -> OpenFile
+        self.handle_ids = itertools.count(1)
+        self.attr_cache = attr_cache
+        self.dir_cache = dir_cache
+        self.block_cache = block_cache
+        self.inflight = {}  # (path, block) -> concurrent Future of a background fetch
+        self.dirty_bytes = 0  # buffered across all handles
+        self.dirty_lock = threading.Lock()
 
-    def _get_ws(self):
-        with ws_lock:
-            return connected_ws
+    def __call__(self, op, *args):
+        # Every FUSE callback passes through here: time it per op, count the
+        # bytes moved by read/write, and log slow, failed or sampled calls.
+        start = time.monotonic()
+        error = None
+        try:
+            result = super().__call__(op, *args)
+            if op == 'read' and result is not None:
+                metrics.inc('vesta_fuse_bytes_total', len(result), op='READ')
+            elif op == 'write':
+                # Older write paths return None rather than the count: all of buf was taken
+                metrics.inc('vesta_fuse_bytes_total', len(args[1]) if result is None else result, op='WRITE')
+            return result
+        except FuseOSError as e:
+            error = errno.errorcode.get(e.errno, str(e.errno))
+            metrics.inc('vesta_fuse_op_errors_total', op=op.upper(), error=error)
+            raise
+        finally:
+            elapsed = time.monotonic() - start
+            metrics.observe('vesta_fuse_op_duration_seconds', elapsed, op=op.upper())
+            if elapsed >= OP_LOG_SLOW or (error and error != 'ENOENT') or random.random() < OP_LOG_SAMPLE:
+                record = {'op': op.upper(), 'path': args[0] if args else None, 'ms': round(elapsed * 1000, 1)}
+                if error:
+                    record['error'] = error
+                logger.info(f"FUSE {json.dumps(record)}")
 
-    def _request(self, method, path, **kwargs):
-        ws = self._get_ws()
-        if not ws:
+    def init(self, path):
+        threading.Thread(target=self._writeback_loop, daemon=True).start()
+
+    def _route(self, path):
+        """Session owning a FUSE path (/<session id>/...)."""
+        session = sessions.get(path.split('/', 2)[1])
+        if session is None or not ws_loop:
+            raise FuseOSError(errno.ENOENT)
+        return session
+
+    def _wait(self, coro, label):
+        # FUSE runs multithreaded, so several requests can be in flight at once.
+        # Each thread blocks on its own future while the WS loop does the I/O.
+        future = asyncio.run_coroutine_threadsafe(coro, ws_loop)
+        try:
+            return future.result(timeout=REQUEST_TIMEOUT + 1)
+        except FuseOSError:
+            raise
+        except ConnectionError:
             raise FuseOSError(errno.ENOTCONN)
-        
-        request_id = str(int(time.time() * 1000))
+        except (asyncio.TimeoutError, concurrent.futures.TimeoutError):
+            future.cancel()
+            metrics.inc('vesta_browser_rpc_timeouts_total')
+            logger.error(f"Request timed out: {label}")
+            raise FuseOSError(errno.EIO)
+        except Exception as e:
+            logger.error(f"Request failed: {e}")
+            raise FuseOSError(errno.EIO)
+
+    def _call(self, session, request_id, message, label, idempotent):
+        return self._wait(self._send_receive(session, request_id, message, idempotent), label)
+
+    def _request(self, method, path, **kwargs):
+        session = self._route(path)
+        request_id = next_request_id()
         payload = {
             'id': request_id,
             'method': method,
-            'path': path,
+            'path': session.remote_path(path),
             **kwargs
         }
+        response = self._call(session, request_id, json.dumps(payload), f"{method} {path}",
+                              method in IDEMPOTENT_METHODS)
+        check_response(response)
+        return response.get('data')
 
-        # Determine if this needs to be synchronous (blocking)
-        # FUSE operations are blocking. We need to send to WS and wait for response.
-        # Since we are in a thread (FUSE thread), we can block.
-        # But we need to use the asyncio loop of the WS thread? 
-        # Easier: The WS server runs in a separate thread/loop. We just need to signal it.
-        # ... Wait, websockets lib is async. Calling from sync FUSE thread is tricky.
-        
-        # Simplified approach: Use a queue or future to wait for response.
-        future = asyncio.run_coroutine_threadsafe(self._async_send_receive(ws, payload), ws_loop)
-        try:
-            response = future.result(timeout=10) # 10s timeout
-            if 'error' in response:
-                err = response['error']
-                if err == 'ENOENT': raise FuseOSError(errno.ENOENT)
-                if err == 'EACCES': raise FuseOSError(errno.EACCES)
-                raise FuseOSError(errno.EIO)
-            return response.get('data')
-        except Exception as e:
-            logger.error(f"Request failed: {e}")
-            raise FuseOSError(errno.EIO)
+    def _request_frame(self, session, opcode, path, offset, length, payload=b''):
+        request_id = next_request_id()
+        frame = pack_frame(opcode, request_id, session.remote_path(path), offset, length, payload)
+        status, length, data = self._call(session, request_id, frame, f"op {opcode} {path}",
+                                          opcode == OP_READ)
+        if status:
+            raise FuseOSError(status)
+        return length, data
+
+    async def _send_receive(self, session, request_id, message, idempotent):
+        """Send on the session's current socket; idempotent requests ride out reconnects."""
+        deadline = ws_loop.time() + REQUEST_TIMEOUT
+        while True:
+            remaining = deadline - ws_loop.time()
+            if remaining <= 0:
+                raise asyncio.TimeoutError()
+            conn = session.conn
+            if conn is None:
+                if not idempotent:
+                    raise ConnectionError("browser disconnected")
+                try:
+                    await asyncio.wait_for(session.online.wait(), remaining)
+                except asyncio.TimeoutError:
+                    raise ConnectionError("browser did not reconnect")
+                continue
+            if isinstance(message, bytes) and not conn.binary_frames:
+                # Resent after a reconnect whose HELLO has not arrived yet (or
+                # came from a JSON-only bundle, in which case this times out)
+                await asyncio.sleep(0.1)
+                continue
+            try:
+                return await self._async_send_receive(conn, request_id, message, remaining)
+            except ConnectionError:
+                if not idempotent:
+                    raise
+                if session.conn is conn:
+                    # Socket died but its handler has not detached it yet
+                    await asyncio.sleep(0.1)
+
+    async def _fetch_range(self, session, path, offset, length):
+        request_id = next_request_id()
+        remote = session.remote_path(path)
+        if session.binary_frames:
+            frame = pack_frame(OP_READ, request_id, remote, offset, length)
+            status, _, data = await self._send_receive(session, request_id, frame, True)
+            if status:
+                raise FuseOSError(status)
+            return data
+
+        # Legacy peer: response['data'] is a base64 string
+        message = json.dumps({'id': request_id, 'method': 'READ', 'path': remote, 'length': length, 'offset': offset})
+        response = await self._send_receive(session, request_id, message, True)
+        check_response(response)
+        return base64.b64decode(response.get('data') or '')
 
-    async def _async_send_receive(self, ws, payload):
-        await ws.send(json.dumps(payload))
-        response = await ws.recv()
-        return json.loads(response)
+    async def _fetch_blocks(self, session, path, first, count):
+        """Fetch `count` blocks starting at block `first` in one READ and cache them."""
+        data = await self._fetch_range(session, path, first * BLOCK_SIZE, count * BLOCK_SIZE)
+        if not isinstance(data, FramePayload):
+            data = FramePayload(data, 0)
+        blocks = []
+        for start in range(0, len(data), BLOCK_SIZE):
+            # Views into the reply frame, not copies; the cache sizes them with len()
+            block = data.slice(start, start + BLOCK_SIZE)
+            self.block_cache.put((path, first + len(blocks)), block)
+            blocks.append(block)
+        if len(data) < count * BLOCK_SIZE and len(data) % BLOCK_SIZE == 0:
+            self.block_cache.put((path, first + len(blocks)), b'')
+        return blocks
+
+    def _cached_block(self, path, index):
+        key = (path, index)
+        hit, block = self.block_cache.get(key)
+        if hit:
+            return block
+        future = self.inflight.get(key)
+        if future is not None:
+            # Already being prefetched: wait for it rather than asking twice
+            try:
+                future.result(timeout=REQUEST_TIMEOUT + 1)
+            except Exception:
+                return None
+            return self.block_cache.peek(key)
+        return None
+
+    def _is_known(self, path, index):
+        key = (path, index)
+        return key in self.inflight or self.block_cache.peek(key) is not None
+
+    def _load_blocks(self, session, path, first, last):
+        """Blocks first..last from cache or the browser, stopping at end of file."""
+        blocks = []
+        index = first
+        while index <= last:
+            block = self._cached_block(path, index)
+            if block is None:
+                # Fetch the whole run of missing blocks with one request
+                run = 1
+                while index + run <= last and not self._is_known(path, index + run):
+                    run += 1
+                fetched = self._wait(self._fetch_blocks(session, path, index, run), f"READ {path}")
+                blocks.extend(fetched)
+                if len(fetched) < run or len(fetched[-1]) < BLOCK_SIZE:
+                    break
+                index += run
+                continue
+            blocks.append(block)
+            if len(block) < BLOCK_SIZE:
+                break
+            index += 1
+        return blocks
+
+    def _prefetch(self, session, path, first, count):
+        """Start background fetches for blocks first..first+count-1 not yet known."""
+        attrs = self.attr_cache.peek(path)
+        if attrs and 'st_size' in attrs:
+            count = min(count, -(-attrs['st_size'] // BLOCK_SIZE) - first)
+        per_request = max(PREFETCH_REQUEST // BLOCK_SIZE, 1)
+        index, end = first, first + count
+        while index < end:
+            if self._is_known(path, index):
+                index += 1
+                continue
+            run = 1
+            while run < per_request and index + run < end and not self._is_known(path, index + run):
+                run += 1
+            keys = [(path, i) for i in range(index, index + run)]
+            future = asyncio.run_coroutine_threadsafe(self._fetch_blocks(session, path, index, run), ws_loop)
+            for key in keys:
+                self.inflight[key] = future
+            future.add_done_callback(lambda f, keys=keys: self._prefetch_done(f, keys))
+            index += run
+
+    def _prefetch_done(self, future, keys):
+        for key in keys:
+            if self.inflight.get(key) is future:
+                del self.inflight[key]
+
+    async def _async_send_receive(self, conn, request_id, message, timeout=REQUEST_TIMEOUT):
+        future = ws_loop.create_future()
+        conn.pending[request_id] = future
+        try:
+            try:
+                await conn.ws.send(message)
+            except websockets.ConnectionClosed:
+                raise ConnectionError("browser disconnected")
+            return await asyncio.wait_for(future, timeout)
+        finally:
+            conn.pending.pop(request_id, None)
+            if future.done() and not future.cancelled():
+                future.exception()  # failed by a disconnect while we were still sending
 
     # --- Filesystem Operations ---
 
     def getattr(self, path, fh=None):
-        # Cache root
-        if path == '/':
+        # Mount root and one directory per browser session are local
+        if path == '/' or path.count('/') == 1:
+            if path != '/':
+                self._route(path)
             return dict(st_mode=(0o40777), st_nlink=2, st_size=0, st_ctime=time.time(), st_mtime=time.time(), st_atime=time.time())
-        
-        # Check cache/remote
-        # Optimization: We can't query browser for every getattr, it's too slow (Explorer spams this).
-        # Strategy: Rely on readdir to populate a temporary cache or just fetch on demand.
-        # For MVP: Fetch on demand.
-        
-        data = self._request('GETATTR', path)
+
+        self._flush_path(path)
+        hit, attrs = self.attr_cache.get(path)
+        if hit:
+            if attrs is None:
+                raise FuseOSError(errno.ENOENT)
+            return attrs
+
+        # A fresh listing of the parent that lacks this name is as good as ENOENT
+        parent, name = os.path.split(path)
+        hit, names = self.dir_cache.get(parent or '/')
+        if hit and name not in names:
+            raise FuseOSError(errno.ENOENT)
+
+        try:
+            data = self._request('GETATTR', path)
+        except FuseOSError as e:
+            if e.errno == errno.ENOENT:
+                self.attr_cache.put(path, None, NEGATIVE_CACHE_TTL)
+            raise
         if not data:
+            self.attr_cache.put(path, None, NEGATIVE_CACHE_TTL)
             raise FuseOSError(errno.ENOENT)
-            
+
+        self.attr_cache.put(path, data)
         return data
 
     def readdir(self, path, fh):
-        entries = ['.', '..']
-        data = self._request('READDIR', path)
-        if data:
-            entries.extend(data)
-        return entries
+        if path == '/':
+            return ['.', '..', *list(sessions)]
+
+        hit, names = self.dir_cache.get(path)
+        if not hit:
+            names = {}  # ordered, with O(1) membership for the getattr check
+            # Newer browsers send {name, st_mode, st_size, ...} per entry so the
+            # getattr storm that follows a listing is served from the cache.
+            for entry in self._request('READDIR', path) or []:
+                if isinstance(entry, dict):
+                    name = entry.pop('name')
+                    self.attr_cache.put(os.path.join(path, name), entry)
+                else:
+                    name = entry
+                names[name] = None
+            self.dir_cache.put(path, names)
+        return ['.', '..', *names]
+
+    # --- Write-back ---
+
+    def _reserve_dirty(self, size):
+        with self.dirty_lock:
+            if self.dirty_bytes + size > WRITEBACK_MAX_BYTES:
+                return False
+            self.dirty_bytes += size
+            return True
+
+    def _release_dirty(self, size):
+        with self.dirty_lock:
+            self.dirty_bytes -= size
+
+    def _write_through(self, path, buf, offset):
+        session = self._route(path)
+        try:
+            if session.binary_frames:
+                written, _ = self._request_frame(session, OP_WRITE, path, offset, len(buf), buf)
+            else:
+                b64_data = base64.b64encode(buf).decode('utf-8')
+                written = self._request('WRITE', path, data=b64_data, offset=offset)
+        finally:
+            # Size, mtime and contents changed
+            self.attr_cache.pop(path)
+            invalidate_blocks(path)
+        return written
+
+    def _flush_locked(self, handle):
+        """Send the handle's dirty range. Caller holds handle.lock."""
+        if not handle.buffer:
+            return
+        data, offset = handle.buffer, handle.buffer_offset
+        handle.buffer = bytearray()
+        self._release_dirty(len(data))
+        written = self._write_through(handle.path, data, offset)
+        if written != len(data):
+            raise FuseOSError(errno.EIO)
+
+    def _flush_handle(self, handle):
+        """Flush and report any error a background flush left behind."""
+        with handle.lock:
+            self._flush_locked(handle)
+            if handle.error:
+                err, handle.error = handle.error, None
+                raise FuseOSError(err)
+
+    def _flush_path(self, path):
+        # Other handles' dirty data must land before path is read or stat'ed
+        if not self.dirty_bytes:
+            return
+        for handle in list(self.files.values()):
+            if handle.path == path and handle.buffer:
+                with handle.lock:
+                    self._flush_locked(handle)
+
+    def _writeback_loop(self):
+        while True:
+            time.sleep(WRITEBACK_MAX_AGE / 2)
+            now = time.monotonic()
+            for handle in list(self.files.values()):
+                if not handle.buffer or now - handle.buffered_since < WRITEBACK_MAX_AGE:
+                    continue
+                if not handle.lock.acquire(blocking=False):
+                    continue  # a FUSE thread is on it
+                try:
+                    self._flush_locked(handle)
+                except FuseOSError as e:
+                    # Nobody to return this to now; surface it on fsync/flush
+                    handle.error = e.errno
+                    logger.error(f"Write-back of {handle.path} failed: {e}")
+                finally:
+                    handle.lock.release()
 
     def open(self, path, flags):
-        # We don't maintain open handles in browser, just stateless read/write
+        fh = next(self.handle_ids)
+        self.files[fh] = OpenFile(path)
+        return fh
+
+    def flush(self, path, fh):
+        # Called on every close(); its result is what close() returns
+        handle = self.files.get(fh)
+        if handle:
+            self._flush_handle(handle)
+        return 0
+
+    def fsync(self, path, datasync, fh):
+        handle = self.files.get(fh)
+        if handle:
+            self._flush_handle(handle)
+        return 0
+
+    def release(self, path, fh):
+        handle = self.files.pop(fh, None)
+        if handle:
+            # The kernel ignores release errors; flush() already reported to close()
+            try:
+                self._flush_handle(handle)
+            except FuseOSError as e:
+                logger.error(f"Dropping dirty data for {path}: {e}")
         return 0
 
     def read(self, path, length, offset, fh):
-        data = self._request('READ', path, length=length, offset=offset)
-        if data:
-             # Expecting base64 or bytes? Let's assume hex or similar for JSON safety? 
-             # Or raw bytes if WS supports it. JSON is easiest for text, but images need encoding.
-             # Protocol: response['data'] is base64 encoded string.
-             import base64
-             return base64.b64decode(data)
-        return b''
+        session = self._route(path)
+        self._flush_path(path)
+        handle = self.files.get(fh)
+        window = min(handle.track_read(offset, length), BLOCK_CACHE_BYTES // 2) if handle else 0
+
+        first = offset // BLOCK_SIZE
+        last = (offset + length - 1) // BLOCK_SIZE
+        blocks = self._load_blocks(session, path, first, last)
+        if window and blocks and len(blocks[-1]) == BLOCK_SIZE:
+            self._prefetch(session, path, last + 1, window // BLOCK_SIZE)
+
+        # Slice the requested range out of the blocks
+        chunks = []
+        start = offset - first * BLOCK_SIZE
+        end = start + length
+        pos = 0
+        for block in blocks:
+            lo, hi = max(start - pos, 0), min(end - pos, len(block))
+            if lo < hi:
+                chunks.append((block, lo, hi))
+            pos += len(block)
+        if not chunks:
+            return b''
+        if len(chunks) == 1:
+            # Single block: hand fusepy a pointer into its frame, no copy
+            block, lo, hi = chunks[0]
+            return block.slice(lo, hi)
+        return b''.join(block.view[lo:hi] for block, lo, hi in chunks)
 
     def write(self, path, buf, offset, fh):
-         # Unsupported for read-only MVP first? 
-         # Let's add write support.
-         import base64
-         b64_data = base64.b64encode(buf).decode('utf-8')
-         written = self._request('WRITE', path, data=b64_data, offset=offset)
-         return written
+        handle = self.files.get(fh)
+        if handle is None or not WRITEBACK_CHUNK:
+            return self._write_through(path, buf, offset)
+
+        with handle.lock:
+            if handle.error:
+                err, handle.error = handle.error, None
+                raise FuseOSError(err)
+            start = offset - handle.buffer_offset
+            if handle.buffer and not 0 <= start <= len(handle.buffer):
+                # Not adjacent to (or inside) the dirty range: send that first
+                self._flush_locked(handle)
+            if not handle.buffer:
+                handle.buffer_offset = offset
+                handle.buffered_since = time.monotonic()
+                start = 0
+                # Readers flush us first, so dropping stale state once per
+                # dirty range is enough
+                self.attr_cache.pop(path)
+                invalidate_blocks(path)
+
+            growth = max(start + len(buf) - len(handle.buffer), 0)
+            if not self._reserve_dirty(growth):
+                # Over the memory cap: stop buffering and write synchronously
+                self._flush_locked(handle)
+                return self._write_through(path, buf, offset)
+            handle.buffer[start:start + len(buf)] = buf
+
+            if len(handle.buffer) >= WRITEBACK_CHUNK:
+                self._flush_locked(handle)
+        return len(buf)
 
     def create(self, path, mode, fi=None):
-        self._request('CREATE', path)
-        return 0
+        if path.count('/') == 1:
+            # The top level only holds session directories
+            raise FuseOSError(errno.EACCES)
+        try:
+            self._request('CREATE', path)
+        finally:
+            # Drop the negative entry and the parent listing either way
+            invalidate_path(path)
+        return self.open(path, os.O_WRONLY)
 
 # --- WebSocket Server ---
 
 ws_loop = None
+fs = None  # the mounted BrowserFS, for metrics
+
+def dispatch_binary(conn, frame):
+    if len(frame) < FRAME_HEADER.size:
+        logger.warning("Dropping short binary frame from browser")
+        return
+    version, opcode, status, request_id, _, length = FRAME_HEADER.unpack_from(frame)
+    if version != FRAME_VERSION or not opcode & OP_REPLY:
+        logger.warning(f"Dropping binary frame (version {version}, opcode {opcode:#x})")
+        return
+    future = conn.pending.get(request_id)
+    if future is None or future.done():
+        return
+    data = FramePayload(frame, FRAME_HEADER.size) if len(frame) > FRAME_HEADER.size else b''
+    future.set_result((status, length, data))
+
+def dispatch_message(session, conn, message):
+    if isinstance(message, bytes):
+        dispatch_binary(conn, message)
+        return
+    try:
+        msg = json.loads(message)
+        request_id = msg.get('id')
+    except (ValueError, AttributeError):
+        logger.warning("Dropping malformed frame from browser")
+        return
+    if msg.get('type') == 'HELLO':
+        conn.binary_frames = bool(msg.get('binary')) and msg.get('frameVersion') == FRAME_VERSION
+        logger.info(f"Session {session.id}: {'binary' if conn.binary_frames else 'json'} frames")
+        return
+    if msg.get('type') == 'INVALIDATE':
+        # Pushed by the browser when files change on its side
+        for path in msg.get('paths') or []:
+            invalidate_path(session.local_path(path))
+        return
+    future = conn.pending.get(request_id)
+    if future is None or future.done():
+        # Late answer to a request that already timed out
+        return
+    future.set_result(msg)
+
+def fail_pending(conn):
+    for future in list(conn.pending.values()):
+        if not future.done():
+            future.set_exception(ConnectionError("browser disconnected"))
+
+def parse_session_id(request_path):
+    query = urllib.parse.parse_qs(urllib.parse.urlparse(request_path).query)
+    session_id = query.get('session', [DEFAULT_SESSION])[0]
+    # It becomes a directory name under MOUNT_POINT
+    session_id = re.sub(r'[^A-Za-z0-9._-]', '_', session_id)[:64].lstrip('.')
+    return session_id or DEFAULT_SESSION
+
+def expire_session(session):
+    if session.conn is None and sessions.get(session.id) is session:
+        del sessions[session.id]
+        invalidate_session(session)
+        logger.info(f"Session {session.id} expired")
 
 async def handler(websocket):
-    global connected_ws
-    with ws_lock:
-        connected_ws = websocket
-    
-    logger.info("Browser Connected!")
+    session_id = parse_session_id(websocket.path)
+    session = sessions.get(session_id)
+    if session is None:
+        session = sessions[session_id] = BrowserSession(session_id)
+        logger.info(f"Browser Connected! Session {session_id} at {MOUNT_POINT}{session.prefix}")
+    else:
+        logger.info(f"Browser Reconnected! Session {session_id} resumed")
+        if session.expiry:
+            session.expiry.cancel()
+            session.expiry = None
+
+    conn = BrowserConnection(websocket)
+    previous, session.conn = session.conn, conn
+    session.online.set()
+    # The folder may have changed while we were away
+    invalidate_session(session)
+    if previous is not None:
+        # Same session opened twice (e.g. a duplicated tab): the newest socket wins
+        await previous.ws.close()
+
     try:
-        await websocket.wait_closed()
+        # Single reader: route every response to the future waiting on its id
+        async for message in websocket:
+            dispatch_message(session, conn, message)
+    except websockets.ConnectionClosed:
+        pass
     finally:
-        with ws_lock:
-            if connected_ws == websocket:
-                connected_ws = None
-        logger.info("Browser Disconnected")
+        if session.conn is conn:
+            session.conn = None
+            session.online.clear()
+            session.expiry = ws_loop.call_later(SESSION_GRACE, expire_session, session)
+        fail_pending(conn)
+        logger.info(f"Browser Disconnected (session {session_id})")
+
+def collect_metrics():
+    # Runs on ws_loop (from /metrics), the only thread touching conn.pending
+    samples = [
+        ('vesta_browser_sessions', 'gauge', {}, len(sessions)),
+        ('vesta_browser_rpcs_in_flight', 'gauge', {},
+         sum(len(s.conn.pending) for s in list(sessions.values()) if s.conn)),
+        ('vesta_prefetches_in_flight', 'gauge', {}, len(set(map(id, fs.inflight.values()))) if fs else 0),
+        ('vesta_writeback_dirty_bytes', 'gauge', {}, fs.dirty_bytes if fs else 0),
+    ]
+    for cache in (attr_cache, dir_cache, block_cache):
+        stats = cache.stats()
+        samples += [
+            ('vesta_cache_hits_total', 'counter', {'cache': cache.name}, stats['hits']),
+            ('vesta_cache_misses_total', 'counter', {'cache': cache.name}, stats['misses']),
+            ('vesta_cache_entries', 'gauge', {'cache': cache.name}, stats['entries']),
+        ]
+    samples.append(('vesta_cache_bytes', 'gauge', {'cache': block_cache.name}, block_cache.bytes))
+    return samples
+
+metrics.collectors.append(collect_metrics)
+
+async def serve_metrics(path, request_headers):
+    # Plain GET /metrics answers Prometheus text instead of upgrading to a WebSocket
+    if urllib.parse.urlparse(path).path == '/metrics':
+        return http.HTTPStatus.OK, [('Content-Type', 'text/plain; version=0.0.4')], metrics.render().encode()
+    return None
+
+async def log_cache_stats():
+    last = None
+    while True:
+        await asyncio.sleep(CACHE_STATS_INTERVAL)
+        stats = {cache.name: cache.stats() for cache in (attr_cache, dir_cache, block_cache)}
+        if stats != last:
+            logger.info(f"Metadata cache: {json.dumps(stats)}")
+            last = stats
 
 async def start_server():
     global ws_loop
     ws_loop = asyncio.get_running_loop()
-    async with websockets.serve(handler, "0.0.0.0", WS_PORT):
+    asyncio.create_task(log_cache_stats())
+    # File data is mostly incompressible; permessage-deflate only burns CPU here
+    async with websockets.serve(handler, "0.0.0.0", WS_PORT, max_size=MAX_FRAME_SIZE, compression=None,
+                                process_request=serve_metrics):
         await asyncio.Future()  # run forever
 
 def run_server_thread():
@@ -153,13 +990,14 @@ def run_server_thread():
 if __name__ == '__main__':
     if not os.path.exists(MOUNT_POINT):
         os.makedirs(MOUNT_POINT, exist_ok=True)
-    
+
     # Start WS Server in background thread
     t = threading.Thread(target=run_server_thread, daemon=True)
     t.start()
 
     logger.info(f"Starting FUSE on {MOUNT_POINT}...")
+    fs = BrowserFS()
     try:
-        FUSE(BrowserFS(), MOUNT_POINT, nothreads=True, foreground=True, allow_other=True)
+        FUSE(fs, MOUNT_POINT, nothreads=False, foreground=True, allow_other=True)
     except Exception as e:
         logger.error(f"FUSE Error: {e}")
@@ -0,0 +1,87 @@
+"""Unit tests for browser_mount.py's pure helpers.
+
+Run from this folder: python3 -m unittest test_browser_mount
+Needs fusepy and libfuse importable (browser_mount imports fuse at the top).
+"""
+import os
+import unittest
+
+try:
+    import browser_mount
+except (ImportError, OSError) as e:  # fusepy raises OSError when libfuse is missing
+    browser_mount = None
+    reason = f"browser_mount not importable: {e}"
+else:
+    reason = ''
+
+
+@unittest.skipIf(browser_mount is None, reason)
+class TTLCacheBytesTest(unittest.TestCase):
+    """max_bytes mode, as used by the block cache."""
+
+    def cache(self, max_bytes=100, max_entries=100):
+        return browser_mount.TTLCache('test', max_entries, 60, max_bytes=max_bytes)
+
+    def test_evicts_least_recently_used_to_fit_budget(self):
+        c = self.cache()
+        c.put('a', b'x' * 40)
+        c.put('b', b'x' * 40)
+        c.get('a')                  # b is now the oldest
+        c.put('c', b'x' * 40)
+        self.assertEqual(c.get('b'), (False, None))
+        self.assertTrue(c.get('a')[0])
+        self.assertTrue(c.get('c')[0])
+        self.assertEqual(c.bytes, 80)
+
+    def test_replacing_a_key_counts_only_the_new_value(self):
+        c = self.cache()
+        c.put('a', b'x' * 60)
+        c.put('a', b'x' * 10)
+        self.assertEqual(c.bytes, 10)
+        c.put('b', b'x' * 90)
+        self.assertEqual(c.bytes, 100)
+        self.assertTrue(c.get('a')[0])
+
+    def test_value_larger_than_budget_is_not_kept(self):
+        c = self.cache()
+        c.put('a', b'x' * 10)
+        c.put('big', b'x' * 101)
+        self.assertEqual(len(c.entries), 0)
+        self.assertEqual(c.bytes, 0)
+
+    def test_frame_slices_are_sized_by_length(self):
+        # Cached blocks are views into a larger reply frame; only the slice counts
+        frame = os.urandom(300)
+        block = browser_mount.FramePayload(frame, 100, 160)
+        c = self.cache()
+        c.put(('/f', 0), block)
+        self.assertEqual(c.bytes, 60)
+        self.assertEqual(bytes(block.slice(10, 1000)), frame[110:160])
+
+    def test_pop_discard_and_clear_release_bytes(self):
+        c = self.cache()
+        for i in range(4):
+            c.put(('/f', i), b'x' * 20)
+        c.pop(('/f', 0))
+        self.assertEqual(c.bytes, 60)
+        c.discard(lambda key: key[1] >= 2)
+        self.assertEqual(c.bytes, 20)
+        c.clear()
+        self.assertEqual(c.bytes, 0)
+
+    def test_entry_limit_still_applies(self):
+        c = self.cache(max_bytes=1000, max_entries=2)
+        for key in 'abc':
+            c.put(key, b'x')
+        self.assertEqual(list(c.entries), ['b', 'c'])
+        self.assertEqual(c.bytes, 2)
+
+    def test_stats_report_bytes(self):
+        c = self.cache()
+        c.put('a', b'x' * 7)
+        self.assertEqual(c.stats()['bytes'], 7)
+        self.assertNotIn('bytes', browser_mount.TTLCache('plain', 10, 60).stats())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -156,10 +156,13 @@ function App() {
         currentPath={usb.currentPath}
         loading={usb.loading}
         fetchFiles={usb.fetchFiles}
+        hasMore={usb.hasMore}
+        loadMore={usb.loadMore}
+        searchFiles={usb.searchFiles}
+        fetchThumbs={usb.fetchThumbs}
         downloadFile={usb.downloadFile}
         uploadFile={usb.uploadFile}
-        fetchDrives={usb.fetchDrives}
-        fetchAvailableDevices={usb.fetchAvailableDevices}
+        fetchDriveLists={usb.fetchDriveLists}
         mountDevice={usb.mountDevice}
         unmountDevice={usb.unmountDevice}
         error={usb.error}
@@ -6,9 +6,23 @@ import { useEffect, useState, useRef } from "react"
 
 // --- Browser Bridge (File System Access API) ---
 
+// Binary frames for READ/WRITE (must match browser_mount.py):
+// version u8 | opcode u8 | aux u16 | id u32 | offset u64 | length u32, big-endian.
+// Requests carry the UTF-8 path (aux bytes) then the payload; replies set
+// aux to a status/errno and carry the payload directly.
+const FRAME_VERSION = 1;
+const FRAME_HEADER_SIZE = 20;
+const OP_READ = 0x01;
+const OP_WRITE = 0x02;
+const OP_REPLY = 0x80;
+const STATUS_ENOENT = 2;
+const STATUS_EIO = 5;
+
 class BrowserFS {
     ws: WebSocket | null = null;
     rootHandle: FileSystemDirectoryHandle | null = null;
+    sessionId: string | null = null;
+    reconnectDelay = 1000;
     isConnected = false;
 
     constructor(onStatus: (status: boolean) => void) {
@@ -18,17 +32,35 @@ class BrowserFS {
     onStatus: (status: boolean) => void;
 
     async connect(handle: FileSystemDirectoryHandle) {
+        if (this.ws) {
+            // Switching folders: drop the old session without reconnecting it
+            this.ws.onclose = null;
+            this.ws.close();
+        }
         this.rootHandle = handle;
+        // Each picked folder is its own session, mounted at /mnt/browser/<sessionId>.
+        // The id is reused on reconnect so the bridge resumes the same mount.
+        this.sessionId = `${handle.name}-${Math.random().toString(36).slice(2, 8)}`.replace(/[^A-Za-z0-9._-]/g, '_');
+        this.reconnectDelay = 1000;
+        this.open();
+        this.watch(handle);
+    }
+
+    open() {
         const protocol = window.location.protocol === 'https:' ? 'wss' : 'ws';
         const host = window.location.hostname;
         // Port 6084 is hardcoded for browser bridge
-        const url = `${protocol}://${host}:6084`;
+        const url = `${protocol}://${host}:6084/?session=${encodeURIComponent(this.sessionId!)}`;
 
         console.log("Connecting Bridge to:", url);
         this.ws = new WebSocket(url);
+        this.ws.binaryType = 'arraybuffer';
 
         this.ws.onopen = () => {
             console.log("Bridge Connected");
+            // Opt in to raw binary data frames instead of base64-in-JSON
+            this.ws!.send(JSON.stringify({ type: 'HELLO', binary: true, frameVersion: FRAME_VERSION }));
+            this.reconnectDelay = 1000;
             this.isConnected = true;
             this.onStatus(true);
         };
@@ -38,6 +70,9 @@ class BrowserFS {
             this.isConnected = false;
             this.onStatus(false);
             this.ws = null;
+            // Come back under the same session id; the bridge retries reads caught by the drop
+            setTimeout(() => this.open(), this.reconnectDelay);
+            this.reconnectDelay = Math.min(this.reconnectDelay * 2, 10000);
         };
 
         this.ws.onerror = (e) => {
@@ -45,6 +80,10 @@ class BrowserFS {
         }
 
         this.ws.onmessage = async (event) => {
+            if (event.data instanceof ArrayBuffer) {
+                await this.handleFrame(event.data);
+                return;
+            }
             const msg = JSON.parse(event.data);
             const { id, method, path, ...args } = msg;
 
@@ -57,14 +96,7 @@ class BrowserFS {
                 if (method === 'GETATTR') {
                     // Check if file/dir exists
                     try {
-                        const h = await this.getHandle(relativePath);
-                        const kind = h.kind;
-                        // Stat mock
-                        result = {
-                            st_mode: kind === 'directory' ? 16877 : 33188, // 0o40755 : 0o100644
-                            st_size: kind === 'file' ? await (h as FileSystemFileHandle).getFile().then(f => f.size) : 4096,
-                            st_mtime: Date.now() / 1000
-                        };
+                        result = await this.stat(await this.getHandle(relativePath));
                     } catch (e) {
                         // Not found
                         this.respond(id, { error: 'ENOENT' });
@@ -72,12 +104,13 @@ class BrowserFS {
                     }
                 } else if (method === 'READDIR') {
                     const dir = await this.getHandle(relativePath) as FileSystemDirectoryHandle;
-                    const entries = [];
+                    const pending = [];
                     // @ts-ignore
-                    for await (const [name] of (dir as any).entries()) {
-                        entries.push(name);
+                    for await (const [name, handle] of (dir as any).entries()) {
+                        // Stat alongside the name so the bridge can cache it
+                        pending.push(this.stat(handle).then(st => ({ name, ...st })));
                     }
-                    result = entries;
+                    result = await Promise.all(pending);
                 } else if (method === 'READ') {
                     const fileHandle = await this.getHandle(relativePath) as FileSystemFileHandle;
                     const file = await fileHandle.getFile();
@@ -112,6 +145,72 @@ class BrowserFS {
         };
     }
 
+    async stat(h: FileSystemHandle) {
+        if (h.kind === 'directory') {
+            return { st_mode: 16877, st_size: 4096, st_mtime: Date.now() / 1000 }; // 0o40755
+        }
+        const file = await (h as FileSystemFileHandle).getFile();
+        return { st_mode: 33188, st_size: file.size, st_mtime: file.lastModified / 1000 }; // 0o100644
+    }
+
+    watch(handle: FileSystemDirectoryHandle) {
+        // Push changes made on this machine so the bridge drops stale cache entries
+        if (!('FileSystemObserver' in window)) return;
+        // @ts-ignore - FileSystemObserver is not in the DOM typings yet
+        const observer = new window.FileSystemObserver((records: any[]) => {
+            const paths = records.map(r => '/' + r.relativePathComponents.join('/'));
+            if (this.ws && this.ws.readyState === WebSocket.OPEN) {
+                this.ws.send(JSON.stringify({ type: 'INVALIDATE', paths }));
+            }
+        });
+        observer.observe(handle, { recursive: true }).catch((e: any) => console.warn("Bridge watch unavailable:", e));
+    }
+
+    async handleFrame(buffer: ArrayBuffer) {
+        const view = new DataView(buffer);
+        const opcode = view.getUint8(1);
+        const pathLength = view.getUint16(2);
+        const id = view.getUint32(4);
+        const offset = Number(view.getBigUint64(8));
+        const length = view.getUint32(16);
+        const path = new TextDecoder().decode(new Uint8Array(buffer, FRAME_HEADER_SIZE, pathLength));
+        const relativePath = path === '/' ? '' : path.substring(1);
+
+        try {
+            if (opcode === OP_READ) {
+                const fileHandle = await this.getHandle(relativePath) as FileSystemFileHandle;
+                const file = await fileHandle.getFile();
+                const data = await file.slice(offset, offset + length).arrayBuffer();
+                this.respondFrame(opcode, id, 0, offset, data.byteLength, data);
+            } else if (opcode === OP_WRITE) {
+                const data = new Uint8Array(buffer, FRAME_HEADER_SIZE + pathLength, length);
+                const fileHandle = await this.getHandle(relativePath) as FileSystemFileHandle;
+                const writable = await fileHandle.createWritable({ keepExistingData: true });
+                await writable.write({ type: 'write', position: offset, data: data });
+                await writable.close();
+                this.respondFrame(opcode, id, 0, offset, data.byteLength);
+            }
+        } catch (e: any) {
+            console.error("FS Frame Error:", e);
+            const status = e?.name === 'NotFoundError' ? STATUS_ENOENT : STATUS_EIO;
+            this.respondFrame(opcode, id, status, offset, 0);
+        }
+    }
+
+    respondFrame(opcode: number, id: number, status: number, offset: number, length: number, data?: ArrayBuffer) {
+        if (!this.ws || this.ws.readyState !== WebSocket.OPEN) return;
+        const frame = new Uint8Array(FRAME_HEADER_SIZE + (data ? data.byteLength : 0));
+        const view = new DataView(frame.buffer);
+        view.setUint8(0, FRAME_VERSION);
+        view.setUint8(1, opcode | OP_REPLY);
+        view.setUint16(2, status);
+        view.setUint32(4, id);
+        view.setBigUint64(8, BigInt(offset));
+        view.setUint32(16, length);
+        if (data) frame.set(new Uint8Array(data), FRAME_HEADER_SIZE);
+        this.ws.send(frame);
+    }
+
     respond(id: string, payload: any) {
         if (this.ws && this.ws.readyState === WebSocket.OPEN) {
             this.ws.send(JSON.stringify({ id, ...payload }));
@@ -154,20 +253,60 @@ interface FilesModalProps {
     currentPath: string;
     loading: boolean;
     fetchFiles: (path: string) => void;
+    hasMore: boolean;
+    loadMore: () => void;
+    searchFiles: (q: string, path: string, onEntries: (entries: FileEntry[]) => void, signal?: AbortSignal) => Promise<any>;
+    fetchThumbs: (paths: string[], onThumbs: (thumbs: Record<string, string | null>) => void, signal?: AbortSignal) => Promise<void>;
     downloadFile: (path: string) => void;
     uploadFile: (path: string, file: File) => void;
-    fetchDrives: () => Promise<{ portable: any[], host: any[], internal: any[] }>;
-    fetchAvailableDevices: () => Promise<{ devices: any[] }>;
+    fetchDriveLists: () => Promise<{ drives: { portable: any[], host: any[], internal: any[] }, devices: any[] }>;
     mountDevice: (device: string) => Promise<boolean>;
     unmountDevice: (device: string) => Promise<boolean>;
     error: string | null;
     baseUrl: string;
 }
 
-export function FilesModal({ open, onOpenChange, files, currentPath, loading, fetchFiles, downloadFile, uploadFile, fetchDrives, fetchAvailableDevices, mountDevice, unmountDevice, error, baseUrl }: FilesModalProps) {
+export function FilesModal({ open, onOpenChange, files, currentPath, loading, fetchFiles, hasMore, loadMore, searchFiles, fetchThumbs, downloadFile, uploadFile, fetchDriveLists, mountDevice, unmountDevice, error, baseUrl }: FilesModalProps) {
     const fileInput = useRef<HTMLInputElement>(null);
     const [drives, setDrives] = useState<{ portable: any[], host: any[], internal: any[] }>({ portable: [], host: [], internal: [] });
     const [available, setAvailable] = useState<any[]>([]);
+    const [uploads, setUploads] = useState<Record<string, { name: string, received: number, size: number }>>({});
+    const [jobs, setJobs] = useState<Record<string, { op: string, name: string, copied: number, total: number, rate: number }>>({});
+    const pathRef = useRef(currentPath);
+    pathRef.current = currentPath;
+    const [query, setQuery] = useState('');
+    const [results, setResults] = useState<FileEntry[] | null>(null);
+    const [thumbs, setThumbs] = useState<Record<string, string | null>>({});
+    const shown = results || files;
+
+    // Fresh set per folder, so edited files get new thumbnails when the folder is reopened
+    useEffect(() => setThumbs({}), [currentPath]);
+
+    // One thumbnail request per page of entries; paths already answered aren't asked again
+    useEffect(() => {
+        const wanted = shown.filter(f => !f.isDir && !(f.path in thumbs)).map(f => f.path);
+        if (!open || !wanted.length) return;
+        const abort = new AbortController();
+        fetchThumbs(wanted, (t) => setThumbs(prev => ({ ...prev, ...t })), abort.signal)
+            .catch(e => { if (e.name !== 'AbortError') console.error(e); });
+        return () => abort.abort();
+    }, [open, shown]);
+
+    // Search everything under the drive root that holds the open folder, as the user types
+    useEffect(() => {
+        if (!query) {
+            setResults(null);
+            return;
+        }
+        const abort = new AbortController();
+        const timer = setTimeout(() => {
+            setResults([]);
+            const scope = '/' + currentPath.split('/').filter(Boolean).slice(0, 2).join('/');
+            searchFiles(query, scope, (entries) => setResults(prev => [...(prev || []), ...entries]), abort.signal)
+                .catch(e => { if (e.name !== 'AbortError') console.error(e); });
+        }, 250);
+        return () => { clearTimeout(timer); abort.abort(); };
+    }, [query, currentPath]);
 
     // Bridge State
     const [bridgeStatus, setBridgeStatus] = useState(false);
@@ -181,11 +320,47 @@ export function FilesModal({ open, onOpenChange, files, currentPath, loading, fe
         }
     }, [open]);
 
+    // Server push instead of polling: hotplug/mounts reload the drive lists, a change in the
+    // open folder re-lists it. EventSource reconnects with Last-Event-ID by itself, and the
+    // server answers "reset" when it can no longer replay what was missed.
+    useEffect(() => {
+        if (!open) return;
+        const events = new EventSource(`${baseUrl}/events`);
+        events.addEventListener('device', () => loadDrives());
+        events.addEventListener('dir', (e) => {
+            if (JSON.parse((e as MessageEvent).data).path === pathRef.current) fetchFiles(pathRef.current);
+        });
+        events.addEventListener('upload', (e) => {
+            const u = JSON.parse((e as MessageEvent).data);
+            setUploads(prev => {
+                const next = { ...prev };
+                if (u.state === 'active') next[u.id] = { name: u.name, received: u.received, size: u.size };
+                else delete next[u.id];
+                return next;
+            });
+        });
+        events.addEventListener('job', (e) => {
+            const j = JSON.parse((e as MessageEvent).data);
+            setJobs(prev => {
+                const next = { ...prev };
+                if (j.state === 'queued' || j.state === 'running') {
+                    const name = j.sources.length === 1 ? j.sources[0].split('/').pop() : `${j.sources.length} items`;
+                    next[j.id] = { op: j.op, name, copied: j.copied, total: j.total, rate: j.rate };
+                } else delete next[j.id];
+                return next;
+            });
+        });
+        events.addEventListener('reset', () => {
+            loadDrives();
+            fetchFiles(pathRef.current);
+        });
+        return () => events.close();
+    }, [open, baseUrl]);
+
     const loadDrives = async () => {
-        const d = await fetchDrives();
-        const a = await fetchAvailableDevices();
-        setDrives(d);
-        setAvailable(a.devices || []);
+        const { drives, devices } = await fetchDriveLists();
+        setDrives(drives);
+        setAvailable(devices || []);
     };
 
     const handleMount = async (deviceParams: any) => {
@@ -250,6 +425,12 @@ export function FilesModal({ open, onOpenChange, files, currentPath, loading, fe
                             <ChevronLeft className="w-4 h-4" />
                         </Button>
                         <code className="text-xs flex-1 truncate text-muted-foreground px-2">{currentPath}</code>
+                        <input
+                            className="bg-black/30 rounded px-2 py-1 text-xs w-40 outline-none"
+                            placeholder="Search drive"
+                            value={query}
+                            onChange={(e) => setQuery(e.target.value)}
+                        />
                         <Button variant="ghost" size="icon" onClick={() => fetchFiles(currentPath)}>
                             <RefreshCw className={`w-4 h-4 ${loading ? 'animate-spin' : ''}`} />
                         </Button>
@@ -349,34 +530,51 @@ export function FilesModal({ open, onOpenChange, files, currentPath, loading, fe
                     </div>
 
                     {/* File List */}
-                    <div className="flex-1 overflow-y-auto border border-white/10 rounded-md bg-black/20">
-                        {files.map((file, i) => (
+                    <div
+                        className="flex-1 overflow-y-auto border border-white/10 rounded-md bg-black/20"
+                        onScroll={(e) => {
+                            // Fetch the next page before the user reaches the end of the list
+                            const el = e.currentTarget;
+                            if (!results && hasMore && el.scrollTop + el.clientHeight > el.scrollHeight - 400) loadMore();
+                        }}
+                    >
+                        {shown.map((file, i) => (
                             <div
                                 key={i}
                                 className="flex items-center justify-between p-3 hover:bg-accent/50 transition-colors border-b last:border-0 border-white/5 cursor-pointer group"
-                                onClick={() => file.isDir && fetchFiles(file.path)}
+                                onClick={() => { if (file.isDir) { setQuery(''); fetchFiles(file.path); } }}
                             >
                                 <div className="flex items-center gap-3">
-                                    {file.isDir ? <Folder className="w-5 h-5 text-blue-400" /> : <File className="w-5 h-5 text-gray-400" />}
-                                    <span className="text-sm text-foreground truncate max-w-[200px]">{file.name}</span>
+                                    {file.isDir ? <Folder className="w-5 h-5 text-blue-400" />
+                                        : thumbs[file.path] ? <img src={thumbs[file.path]!} className="w-8 h-8 object-cover rounded" loading="lazy" />
+                                        : <File className="w-5 h-5 text-gray-400" />}
+                                    <span className="text-sm text-foreground truncate max-w-[200px]" title={file.path}>{file.name}</span>
                                 </div>
 
                                 <div className="flex items-center gap-2">
                                     <span className="text-xs text-muted-foreground w-16 text-right whitespace-nowrap">{file.size}</span>
-                                    {!file.isDir && (
-                                        <Button
-                                            variant="ghost"
-                                            size="icon"
-                                            className="h-8 w-8 opacity-0 group-hover:opacity-100"
-                                            onClick={(e) => { e.stopPropagation(); downloadFile(file.path); }}
-                                        >
-                                            <Download className="w-4 h-4" />
-                                        </Button>
-                                    )}
+                                    {/* Folders come down as a zip streamed by the server */}
+                                    <Button
+                                        variant="ghost"
+                                        size="icon"
+                                        className="h-8 w-8 opacity-0 group-hover:opacity-100"
+                                        title={file.isDir ? "Download as .zip" : "Download"}
+                                        onClick={(e) => { e.stopPropagation(); downloadFile(file.path); }}
+                                    >
+                                        <Download className="w-4 h-4" />
+                                    </Button>
                                 </div>
                             </div>
                         ))}
-                        {files.length === 0 && !loading && (
+                        {!results && hasMore && (
+                            <div className="p-3 text-center text-xs text-muted-foreground cursor-pointer hover:bg-accent/50" onClick={loadMore}>
+                                {loading ? 'Loading…' : 'Load more'}
+                            </div>
+                        )}
+                        {results && results.length === 0 && (
+                            <div className="p-8 text-center text-muted-foreground text-sm">No matches</div>
+                        )}
+                        {!results && files.length === 0 && !loading && (
                             <div className="p-8 text-center text-muted-foreground text-sm">Empty directory</div>
                         )}
                     </div>
@@ -384,6 +582,15 @@ export function FilesModal({ open, onOpenChange, files, currentPath, loading, fe
 
                 <div className="p-2 border-t border-white/10 text-[10px] text-muted-foreground flex justify-between items-center bg-black/40">
                     <span>API: <code className="bg-black/40 px-1 rounded">{baseUrl}</code></span>
+                    {Object.values(uploads).map(u => (
+                        <span key={u.name}>Uploading {u.name}: {u.size ? Math.floor(100 * u.received / u.size) : 100}%</span>
+                    ))}
+                    {Object.entries(jobs).map(([id, j]) => (
+                        <span key={id}>
+                            {j.op === 'move' ? 'Moving' : 'Copying'} {j.name}: {j.total ? Math.floor(100 * j.copied / j.total) : 0}%
+                            {j.rate > 0 && ` (${(j.rate / 1e6).toFixed(1)} MB/s)`}
+                        </span>
+                    ))}
                     {error && <span className="text-red-400 font-bold bg-red-950/30 px-2 py-1 rounded">Error: {error}</span>}
                 </div>
             </DialogContent>
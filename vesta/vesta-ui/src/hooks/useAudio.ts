@@ -1,12 +1,28 @@
 import { useState, useCallback, useRef, useEffect } from 'react';
 
+// Ask audio_relay.py for Opus (~32 kbit/s instead of 705.6 kbit/s of PCM) when this browser
+// can decode it with WebCodecs. The relay's first message says which codec actually follows.
+const OPUS_QUERY = '?codec=opus&bitrate=32000&frame=20';
+const OPUS_CONFIG = { codec: 'opus', sampleRate: 48000, numberOfChannels: 1 };
+
+const canDecodeOpus = async () => {
+    if (typeof AudioDecoder === 'undefined') return false;
+    try {
+        return !!(await AudioDecoder.isConfigSupported(OPUS_CONFIG)).supported;
+    } catch {
+        return false;
+    }
+};
+
 export const useAudio = () => {
     const [micActive, setMicActive] = useState(true); // Default to enabled
     const [speakerActive, setSpeakerActive] = useState(true); // Default to enabled
 
     // Refs to hold instances
     const micRef = useRef<{ ws: WebSocket | null, context: AudioContext | null, stream: MediaStream | null }>({ ws: null, context: null, stream: null });
-    const speakerRef = useRef<{ ws: WebSocket | null, context: AudioContext | null, nextTime: number }>({ ws: null, context: null, nextTime: 0 });
+    // target: seconds of audio to hold before playing, as announced by audio_relay.py from
+    // this connection's measured jitter (the relay sends {"type": "latency", "target": ms})
+    const speakerRef = useRef<{ ws: WebSocket | null, context: AudioContext | null, decoder: AudioDecoder | null, nextTime: number, target: number }>({ ws: null, context: null, decoder: null, nextTime: 0, target: 0.06 });
 
     // --- Speaker Logic (Port 6082) ---
     const startSpeaker = useCallback(async () => {
@@ -23,31 +39,64 @@ export const useAudio = () => {
             const gain = ctx.createGain();
             gain.connect(ctx.destination);
 
+            const play = (float32: Float32Array, rate: number) => {
+                const buffer = ctx.createBuffer(1, float32.length, rate);
+                buffer.getChannelData(0).set(float32);
+
+                const source = ctx.createBufferSource();
+                source.buffer = buffer;
+                source.connect(gain);
+
+                // Jitter buffer: after an underrun, start again `target` ahead of now;
+                // when more than target + 100ms is queued, drop chunks to catch up
+                const time = ctx.currentTime;
+                const { target } = speakerRef.current;
+                if (speakerRef.current.nextTime < time) {
+                    speakerRef.current.nextTime = time + target;
+                } else if (speakerRef.current.nextTime - time > target + 0.1) {
+                    return;
+                }
+                source.start(speakerRef.current.nextTime);
+                speakerRef.current.nextTime += buffer.duration;
+            };
+
             const protocol = window.location.protocol === 'https:' ? 'wss://' : 'ws://';
+            const query = await canDecodeOpus() ? OPUS_QUERY : '';
             // Connect to port 6082
-            const ws = new WebSocket(`${protocol}${window.location.hostname}:6082`, 'binary');
+            const ws = new WebSocket(`${protocol}${window.location.hostname}:6082/${query}`, 'binary');
             ws.binaryType = 'arraybuffer';
 
+            let timestamp = 0;
+            let frameUs = 20000;
             ws.onmessage = (e) => {
-                if (e.data instanceof ArrayBuffer) {
+                if (typeof e.data === 'string') {
+                    const msg = JSON.parse(e.data);
+                    if (msg.type === 'latency') speakerRef.current.target = msg.target / 1000;
+                    if (msg.type === 'format' && msg.codec === 'opus') {
+                        frameUs = msg.frameMs * 1000;
+                        const decoder = new AudioDecoder({
+                            output: (data) => {
+                                const float32 = new Float32Array(data.numberOfFrames);
+                                data.copyTo(float32, { planeIndex: 0, format: 'f32-planar' });
+                                play(float32, data.sampleRate);
+                                data.close();
+                            },
+                            error: (err) => console.error("Audio: Opus decoder error", err),
+                        });
+                        decoder.configure({ codec: 'opus', sampleRate: msg.rate, numberOfChannels: msg.channels });
+                        speakerRef.current.decoder = decoder;
+                    }
+                } else if (e.data instanceof ArrayBuffer) {
+                    const { decoder } = speakerRef.current;
+                    if (decoder) {
+                        decoder.decode(new EncodedAudioChunk({ type: 'key', timestamp, data: e.data }));
+                        timestamp += frameUs;
+                        return;
+                    }
                     const int16 = new Int16Array(e.data);
                     const float32 = new Float32Array(int16.length);
                     for (let i = 0; i < int16.length; i++) float32[i] = int16[i] / 32768;
-
-                    const buffer = ctx.createBuffer(1, float32.length, 44100);
-                    buffer.getChannelData(0).set(float32);
-
-                    const source = ctx.createBufferSource();
-                    source.buffer = buffer;
-                    source.connect(gain);
-
-                    let time = ctx.currentTime;
-                    // Simple jitter buffer logic
-                    if (speakerRef.current.nextTime < time || (speakerRef.current.nextTime - time) > 0.2) {
-                        speakerRef.current.nextTime = time;
-                    }
-                    source.start(speakerRef.current.nextTime);
-                    speakerRef.current.nextTime += buffer.duration;
+                    play(float32, 44100);
                 }
             };
 
@@ -58,7 +107,7 @@ export const useAudio = () => {
                 console.log("Audio: Speaker WS Closed", e.code, e.reason);
             };
 
-            speakerRef.current = { ws, context: ctx, nextTime: 0 };
+            speakerRef.current = { ws, context: ctx, decoder: null, nextTime: 0, target: 0.06 };
             setSpeakerActive(true);
 
             // Resume on interaction if needed
@@ -78,8 +127,9 @@ export const useAudio = () => {
 
     const stopSpeaker = useCallback(() => {
         if (speakerRef.current.ws) speakerRef.current.ws.close();
+        if (speakerRef.current.decoder?.state === 'configured') speakerRef.current.decoder.close();
         if (speakerRef.current.context) speakerRef.current.context.close();
-        speakerRef.current = { ws: null, context: null, nextTime: 0 };
+        speakerRef.current = { ws: null, context: null, decoder: null, nextTime: 0, target: 0.06 };
         setSpeakerActive(false);
     }, []);
 
@@ -7,6 +7,28 @@ export interface FileEntry {
     path: string;
 }
 
+const FILES_PAGE = 200;
+const THUMB_SIZE = 64;
+const DELTA_MIN = 4 * 1024 * 1024;         // Smaller re-uploads are simply sent again
+const DELTA_READ = 16 * 1024 * 1024;       // Bytes of the new file read at a time while matching
+const DELTA_LITERAL_MAX = 64 * 1024 * 1024; // Server limit per literal instruction
+
+// Reads an NDJSON response, handing over the objects that arrived with each network chunk
+const readLines = async (res: Response, onItems: (items: any[]) => void) => {
+    const reader = res.body!.getReader();
+    const decoder = new TextDecoder();
+    let buffered = '';
+    while (true) {
+        const { done, value } = await reader.read();
+        if (done) break;
+        buffered += decoder.decode(value, { stream: true });
+        const lines = buffered.split('\n');
+        buffered = lines.pop()!;
+        const items = lines.filter(Boolean).map(line => JSON.parse(line));
+        if (items.length) onItems(items);
+    }
+};
+
 export const useUSB = (baseUrl: string = '/api') => {
     const [files, setFiles] = useState<FileEntry[]>([]);
     const [currentPath, setCurrentPath] = useState('/root/Desktop');
@@ -15,25 +37,48 @@ export const useUSB = (baseUrl: string = '/api') => {
     const [autoMount, setAutoMount] = useState(false);
     const [passwordEnabled, setPasswordEnabled] = useState(false);
     const [error, setError] = useState<string | null>(null);
+    const [nextCursor, setNextCursor] = useState<string | null>(null);
+
+    // Listings are paged so a huge folder shows its first screen without sending every entry
+    const fetchPage = useCallback(async (path: string, cursor: string | null) => {
+        // Note: vite proxy should map /api to port 6083
+        const res = await fetch(`${baseUrl}/files?path=${encodeURIComponent(path)}&limit=${FILES_PAGE}` +
+            (cursor ? `&cursor=${encodeURIComponent(cursor)}` : ''));
+        if (!res.ok) throw new Error(`Fetch failed: ${res.statusText} (${res.status})`);
+        const data = await res.json();
+        setNextCursor(data.nextCursor);
+        return data.entries.map((f: any) => ({ ...f, path: `${path}/${f.name}` })) as FileEntry[];
+    }, [baseUrl]);
 
     const fetchFiles = useCallback(async (path: string) => {
         setLoading(true);
         setError(null);
         try {
-            // Note: vite proxy should map /api to port 6083
-            const res = await fetch(`${baseUrl}/files?path=${encodeURIComponent(path)}`);
-            if (!res.ok) throw new Error(`Fetch failed: ${res.statusText} (${res.status})`);
-            const data = await res.json();
-            setFiles(data.map((f: any) => ({ ...f, path: `${path}/${f.name}` })));
+            setFiles(await fetchPage(path, null));
             setCurrentPath(path);
         } catch (e: any) {
             console.error(e);
             setError(e.message || "Unknown error");
             setFiles([]); // Clear on error
+            setNextCursor(null);
         } finally {
             setLoading(false);
         }
-    }, [baseUrl]);
+    }, [fetchPage]);
+
+    const loadMore = useCallback(async () => {
+        if (!nextCursor || loading) return;
+        setLoading(true);
+        try {
+            const more = await fetchPage(currentPath, nextCursor);
+            setFiles(prev => [...prev, ...more]);
+        } catch (e: any) {
+            console.error(e);
+            setError(e.message || "Unknown error");
+        } finally {
+            setLoading(false);
+        }
+    }, [fetchPage, currentPath, nextCursor, loading]);
 
     const fetchSettings = useCallback(async () => {
         try {
@@ -87,22 +132,216 @@ export const useUSB = (baseUrl: string = '/api') => {
         }
     }, [baseUrl, passwordEnabled]);
 
+    // Server-side index over every drive. Results stream as NDJSON, so matches are handed
+    // over as they arrive; the final line ({"done": true, ...}) is returned.
+    const searchFiles = useCallback(async (q: string, path: string, onEntries: (entries: FileEntry[]) => void,
+                                           signal?: AbortSignal) => {
+        const res = await fetch(`${baseUrl}/search?q=${encodeURIComponent(q)}&path=${encodeURIComponent(path)}`, { signal });
+        if (!res.ok || !res.body) throw new Error(`Search failed: ${res.statusText} (${res.status})`);
+        let summary: any = null;
+        await readLines(res, (items) => {
+            const entries = items.filter(item => !item.done);
+            if (entries.length < items.length) summary = items[items.length - 1];
+            if (entries.length) onEntries(entries);
+        });
+        return summary;
+    }, [baseUrl]);
+
+    // Thumbnails for a page of files in one request; cached ones arrive first, the rest as
+    // the server makes them. onThumbs gets path -> data URL (null: no preview for that file).
+    const fetchThumbs = useCallback(async (paths: string[], onThumbs: (thumbs: Record<string, string | null>) => void,
+                                           signal?: AbortSignal) => {
+        const res = await fetch(`${baseUrl}/thumbs`, {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ paths, size: THUMB_SIZE * (window.devicePixelRatio > 1 ? 2 : 1) }),
+            signal,
+        });
+        if (!res.ok || !res.body) return;
+        await readLines(res, (items) => onThumbs(Object.fromEntries(items.map(t => [t.path, t.thumb]))));
+    }, [baseUrl]);
+
     const downloadFile = (path: string) => {
         window.open(`${baseUrl}/download?path=${encodeURIComponent(path)}`, '_blank');
     };
 
+    // Re-upload of a file the folder already has: fetch its block signature, find those
+    // blocks anywhere in the new file with a rolling adler32 (checked by SHA-256), and send
+    // references to them plus the bytes in between. False when the server has no such file,
+    // it changed meanwhile, or WebCrypto is missing (plain-http pages): send it whole then.
+    const sendDelta = async (path: string, file: File) => {
+        if (file.size < DELTA_MIN || !globalThis.crypto?.subtle) return false;
+        const target = `${path}/${file.name}`;
+        const res = await fetch(`${baseUrl}/delta/signature?path=${encodeURIComponent(target)}`);
+        if (!res.ok) return false;
+        const sig = new DataView(await res.arrayBuffer());
+        const size = Number(sig.getBigUint64(0));
+        const mtime = sig.getBigUint64(8);
+        const block = sig.getUint32(16);
+        const full = Math.floor(size / block); // A shorter last block is only matched at the very end
+        const byWeak = new Map<number, number[]>();
+        for (let i = 0; i < full; i++) {
+            const weak = sig.getUint32(20 + i * 20);
+            byWeak.set(weak, [...(byWeak.get(weak) || []), i]);
+        }
+        const strongMatches = (hash: ArrayBuffer, i: number) => {
+            const h = new Uint8Array(hash);
+            for (let k = 0; k < 16; k++) if (h[k] !== sig.getUint8(24 + i * 20 + k)) return false;
+            return true;
+        };
+
+        const parts: BlobPart[] = [];
+        let literal = 0; // Start of the bytes no instruction covers yet
+        let run: [number, number] | null = null; // Pending reference: first block, count
+        const flushRun = () => {
+            if (!run) return;
+            const ref = new DataView(new ArrayBuffer(9));
+            ref.setUint8(0, 0x42); // 'B'
+            ref.setUint32(1, run[0]);
+            ref.setUint32(5, run[1]);
+            parts.push(ref.buffer);
+            run = null;
+        };
+        const sendLiteral = (end: number) => {
+            flushRun();
+            for (let o = literal; o < end; o += DELTA_LITERAL_MAX) {
+                const head = new DataView(new ArrayBuffer(5));
+                head.setUint8(0, 0x4c); // 'L'
+                head.setUint32(1, Math.min(DELTA_LITERAL_MAX, end - o));
+                parts.push(head.buffer, file.slice(o, Math.min(o + DELTA_LITERAL_MAX, end)));
+            }
+        };
+        const emit = (i: number, at: number) => {
+            if (at > literal) sendLiteral(at);
+            if (run && run[0] + run[1] === i) run[1]++;
+            else { flushRun(); run = [i, 1]; }
+        };
+
+        const M = 65521;
+        let buf = new Uint8Array(0), bufStart = 0;
+        let a = 0, b = 0, fresh = true, last = -2;
+        for (let pos = 0; pos + block <= file.size;) {
+            if (pos + block > bufStart + buf.length) {
+                buf = new Uint8Array(await file.slice(pos, pos + DELTA_READ + block).arrayBuffer());
+                bufStart = pos;
+                fresh = true;
+            }
+            const o = pos - bufStart;
+            if (fresh) {
+                a = 1; b = 0;
+                for (let k = o; k < o + block; k++) { a = (a + buf[k]) % M; b = (b + a) % M; }
+                fresh = false;
+            }
+            const candidates = byWeak.get(((b << 16) | a) >>> 0);
+            if (candidates) {
+                const hash = await crypto.subtle.digest('SHA-256', buf.subarray(o, o + block));
+                const found = candidates.filter(i => strongMatches(hash, i));
+                if (found.length) {
+                    const i = found.includes(last + 1) ? last + 1 : found[0];
+                    emit(i, pos);
+                    pos = literal = pos + block;
+                    last = i;
+                    fresh = true;
+                    continue;
+                }
+            }
+            if (o + block < buf.length) {
+                const out = buf[o];
+                a = (a - out + buf[o + block] + M) % M;
+                b = (b - (block * out) % M + a - 1 + 2 * M) % M;
+            } else fresh = true;
+            pos++;
+        }
+        const tail = size - full * block;
+        if (tail && file.size - tail >= literal) {
+            const hash = await crypto.subtle.digest('SHA-256', await file.slice(file.size - tail).arrayBuffer());
+            if (strongMatches(hash, full)) {
+                emit(full, file.size - tail);
+                literal = file.size;
+            }
+        }
+        if (file.size > literal) sendLiteral(file.size);
+        flushRun();
+
+        const apply = await fetch(`${baseUrl}/delta/apply?path=${encodeURIComponent(target)}&base=${size}:${mtime}:${block}`, {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/octet-stream' },
+            body: new Blob(parts),
+        });
+        if (apply.status === 412) return false;
+        if (!apply.ok) throw new Error((await apply.json().catch(() => null))?.error || "Upload failed");
+        return true;
+    };
+
+    // Resumable upload: init -> parallel chunks at offsets -> complete. The upload id is
+    // remembered per (folder, file) so picking the same file again after a reload or a
+    // dropped connection only sends the ranges the server is missing.
+    const sendUpload = async (path: string, file: File) => {
+        const key = `vesta-upload:${path}:${file.name}:${file.size}:${file.lastModified}`;
+        let id = localStorage.getItem(key);
+        if (!id && await sendDelta(path, file)) return;
+        let chunkSize = 8 * 1024 * 1024;
+        let parallel = 4;
+        let missing: [number, number][] = [[0, file.size]];
+
+        if (id) {
+            const res = await fetch(`${baseUrl}/upload/status?id=${id}`);
+            if (res.ok) missing = (await res.json()).missing;
+            else id = null;
+        }
+        if (!id) {
+            const res = await fetch(`${baseUrl}/upload/init?path=${encodeURIComponent(path)}`, {
+                method: 'POST',
+                body: JSON.stringify({ name: file.name, size: file.size })
+            });
+            if (!res.ok) throw new Error((await res.json().catch(() => null))?.error || "Upload failed");
+            const init = await res.json();
+            id = init.id as string;
+            chunkSize = init.chunkSize;
+            parallel = init.parallel;
+            localStorage.setItem(key, id);
+        }
+
+        const sendChunk = async (offset: number, end: number) => {
+            for (let attempt = 0; ; attempt++) {
+                try {
+                    const res = await fetch(`${baseUrl}/upload/chunk?id=${id}&offset=${offset}`, {
+                        method: 'POST',
+                        headers: { 'Content-Type': 'application/octet-stream' },
+                        body: file.slice(offset, end)
+                    });
+                    if (res.ok) return;
+                    if (res.status === 404 || res.status === 409) throw new Error("Upload expired");
+                } catch (e: any) {
+                    if (e.message === "Upload expired" || attempt >= 5) throw e;
+                }
+                await new Promise(r => setTimeout(r, Math.min(1000 * 2 ** attempt, 15000)));
+            }
+        };
+
+        // A chunk that failed part-way is re-sent whole; status tells us if anything is still missing
+        for (let round = 0; missing.length && round < 3; round++) {
+            const queue: [number, number][] = [];
+            for (const [start, end] of missing) {
+                for (let o = start; o < end; o += chunkSize) queue.push([o, Math.min(o + chunkSize, end)]);
+            }
+            await Promise.all(Array.from({ length: parallel }, async () => {
+                for (let next = queue.shift(); next; next = queue.shift()) await sendChunk(...next);
+            }));
+            const res = await fetch(`${baseUrl}/upload/status?id=${id}`);
+            if (!res.ok) throw new Error("Upload expired");
+            missing = (await res.json()).missing;
+        }
+
+        const res = await fetch(`${baseUrl}/upload/complete?id=${id}`, { method: 'POST' });
+        if (res.status !== 409) localStorage.removeItem(key); // 409: still incomplete, resumable
+        if (!res.ok) throw new Error((await res.json().catch(() => null))?.error || "Upload failed");
+    };
+
     const uploadFile = async (path: string, file: File) => {
         setLoading(true);
         try {
-            const res = await fetch(`${baseUrl}/upload?path=${encodeURIComponent(path)}`, {
-                method: 'POST',
-                headers: {
-                    'X-File-Name': file.name,
-                    'Content-Type': 'application/octet-stream'
-                },
-                body: file
-            });
-            if (!res.ok) throw new Error("Upload failed");
+            await sendUpload(path, file);
             await fetchFiles(path); // Refresh
         } catch (e: any) {
             console.error("Upload failed", e);
@@ -135,6 +374,34 @@ export const useUSB = (baseUrl: string = '/api') => {
         }
     }, [baseUrl]);
 
+    // Several API operations in one round trip. Results stream back as each op finishes,
+    // in whatever order that is; onResult gets {id, op, status, body}.
+    const batch = useCallback(async (ops: Record<string, any>[], onResult: (result: any) => void) => {
+        const res = await fetch(`${baseUrl}/batch`, {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ ops }),
+        });
+        if (!res.ok || !res.body) throw new Error(`Batch failed: ${res.statusText} (${res.status})`);
+        await readLines(res, (items) => items.filter(item => !item.done).forEach(onResult));
+    }, [baseUrl]);
+
+    // fetchDrives and fetchAvailableDevices together, for the Files modal's drive panel
+    const fetchDriveLists = useCallback(async () => {
+        const lists = { drives: { portable: [], host: [], internal: [] } as any, devices: [] as any[] };
+        try {
+            await batch([{ op: 'drives' }, { op: 'devices' }], (r) => {
+                if (r.status !== 200) return;
+                if (r.op === 'drives') lists.drives = r.body;
+                else lists.devices = r.body.devices;
+            });
+        } catch (e: any) {
+            console.error(e);
+            setError(`Drive Error: ${e.message}`);
+        }
+        return lists;
+    }, [batch]);
+
     const mountDevice = async (device: string) => {
         try {
             const res = await fetch(`${baseUrl}/mount_usb?device=${encodeURIComponent(device)}`);
@@ -170,13 +437,19 @@ export const useUSB = (baseUrl: string = '/api') => {
         error,
         baseUrl,
         fetchFiles,
+        hasMore: nextCursor !== null,
+        loadMore,
         fetchSettings,
         toggleUsb,
         toggleAuto,
+        searchFiles,
+        fetchThumbs,
         downloadFile,
         uploadFile,
         fetchDrives,
         fetchAvailableDevices,
+        fetchDriveLists,
+        batch,
         mountDevice,
         unmountDevice,
         passwordEnabled,